@@ -0,0 +1,269 @@
+import io
+import json
+import re
+import threading
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+
+# In-memory stand-ins for the S3, DynamoDB and Step Functions clients the pipeline uses.
+# They implement only the calls and response fields the Lambdas and notebooks read, and
+# count every call so the benchmark can report API round trips per stage.
+
+DYNAMODB_PAGE_BYTES = 1024 * 1024  # Scan pages stop at 1 MB, like DynamoDB
+ESTIMATED_ITEM_BYTES = 1024
+
+
+class LocalClientError(Exception):
+    """Raised for requests the real service would reject (missing keys, unknown tables)"""
+
+    def __init__(self, message):
+        super().__init__(message)
+        # Error code in the shape of botocore's ClientError.response, e.g. "NoSuchKey"
+        self.response = {"Error": {"Code": message.split(":", 1)[0]}}
+
+
+class LocalS3:
+    """Objects kept in a dict keyed by (bucket, key)"""
+
+    def __init__(self):
+        self.objects = {}
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    def put_object(self, Bucket, Key, Body, ContentType=None, Metadata=None, **kwargs):
+        self.calls["put_object"] += 1
+        body = Body.encode("utf-8") if isinstance(Body, str) else bytes(Body)
+        with self.lock:
+            self.objects[(Bucket, Key)] = {
+                "Body": body,
+                "Metadata": dict(Metadata or {}),
+                "LastModified": datetime.now(timezone.utc),
+                "ETag": f'"{uuid.uuid4().hex}"',
+            }
+        return {"ETag": self.objects[(Bucket, Key)]["ETag"]}
+
+    def _object(self, bucket, key):
+        try:
+            return self.objects[(bucket, key)]
+        except KeyError:
+            raise LocalClientError(f"NoSuchKey: s3://{bucket}/{key}")
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None, **kwargs):
+        self.calls["get_object"] += 1
+        stored = self._object(Bucket, Key)
+        if IfNoneMatch is not None and IfNoneMatch == stored["ETag"]:
+            raise LocalClientError(f"304: s3://{Bucket}/{Key} not modified")
+        return {
+            "Body": io.BytesIO(stored["Body"]),
+            "ContentLength": len(stored["Body"]),
+            "Metadata": stored["Metadata"],
+            "ETag": stored["ETag"],
+            "LastModified": stored["LastModified"],
+        }
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self.calls["head_object"] += 1
+        stored = self._object(Bucket, Key)
+        return {
+            "ContentLength": len(stored["Body"]),
+            "Metadata": stored["Metadata"],
+            "ETag": stored["ETag"],
+            "LastModified": stored["LastModified"],
+        }
+
+    def list_objects_v2(self, Bucket, Prefix="", ContinuationToken=None, MaxKeys=1000, **kwargs):
+        self.calls["list_objects_v2"] += 1
+        keys = sorted(key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix))
+        start = int(ContinuationToken or 0)
+        page = keys[start : start + MaxKeys]
+
+        response = {"KeyCount": len(page), "IsTruncated": start + MaxKeys < len(keys)}
+        if page:
+            response["Contents"] = [
+                {
+                    "Key": key,
+                    "Size": len(self.objects[(Bucket, key)]["Body"]),
+                    "ETag": self.objects[(Bucket, key)]["ETag"],
+                    "LastModified": self.objects[(Bucket, key)]["LastModified"],
+                }
+                for key in page
+            ]
+        if response["IsTruncated"]:
+            response["NextContinuationToken"] = str(start + MaxKeys)
+        return response
+
+    def get_paginator(self, operation_name):
+        if operation_name != "list_objects_v2":
+            raise NotImplementedError(operation_name)
+        return LocalListObjectsPaginator(self)
+
+
+class LocalListObjectsPaginator:
+    def __init__(self, s3):
+        self.s3 = s3
+
+    def paginate(self, **kwargs):
+        token = None
+        while True:
+            page = self.s3.list_objects_v2(ContinuationToken=token, **kwargs)
+            yield page
+            token = page.get("NextContinuationToken")
+            if not token:
+                break
+
+
+class LocalDynamoDBExceptions:
+    class ConditionalCheckFailedException(LocalClientError):
+        pass
+
+
+class LocalDynamoDB:
+    """
+    Serves scans of synthetic tables (see synthetic_data.SyntheticDynamoTable).
+
+    Items are generated as pages are requested, so a 50M-item table costs no memory.
+    Segments split the id range evenly, like DynamoDB's parallel scan. Tables without a
+    synthetic source (the trigger's lock table) hold the items put into them, keyed by
+    their first attribute.
+    """
+
+    exceptions = LocalDynamoDBExceptions
+
+    def __init__(self):
+        self.tables = {}
+        self.items = {}
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    def add_table(self, table_name, synthetic_table):
+        self.tables[table_name] = synthetic_table
+
+    def _table(self, table_name):
+        try:
+            return self.tables[table_name]
+        except KeyError:
+            raise LocalClientError(f"ResourceNotFoundException: {table_name}")
+
+    def describe_table(self, TableName):
+        self.calls["describe_table"] += 1
+        table = self._table(TableName)
+        return {"Table": {"TableName": TableName, "ItemCount": table.row_count, "TableStatus": "ACTIVE"}}
+
+    def get_item(self, TableName, Key, **kwargs):
+        self.calls["get_item"] += 1
+        item = self.items.get((TableName, json.dumps(Key, sort_keys=True)))
+        return {"Item": item} if item else {}
+
+    def put_item(self, TableName, Item, ConditionExpression=None, ExpressionAttributeValues=None, **kwargs):
+        """Supports conditions of `attribute_not_exists(a)` and `a = :value` clauses joined by OR"""
+        self.calls["put_item"] += 1
+        key_name = next(iter(Item))
+        key = (TableName, json.dumps({key_name: Item[key_name]}, sort_keys=True))
+        with self.lock:
+            current = self.items.get(key)
+            if ConditionExpression:
+                satisfied = False
+                for clause in re.split(r"\s+OR\s+", ConditionExpression):
+                    not_exists = re.fullmatch(r"attribute_not_exists\((\w+)\)", clause.strip())
+                    if not_exists:
+                        satisfied = satisfied or current is None or not_exists.group(1) not in current
+                    else:
+                        attribute, placeholder = [part.strip() for part in clause.split("=")]
+                        satisfied = satisfied or (current or {}).get(attribute) == ExpressionAttributeValues[placeholder]
+                if not satisfied:
+                    raise self.exceptions.ConditionalCheckFailedException(
+                        "ConditionalCheckFailedException: The conditional request failed"
+                    )
+            self.items[key] = Item
+        return {}
+
+    def scan(self, TableName, Segment=0, TotalSegments=1, Select="ALL_ATTRIBUTES", Limit=None, ExclusiveStartKey=None, **kwargs):
+        self.calls["scan"] += 1
+        table = self._table(TableName)
+
+        segment_size = -(-table.row_count // TotalSegments)
+        first_id = Segment * segment_size + 1
+        last_id = min(table.row_count, (Segment + 1) * segment_size)
+        if ExclusiveStartKey:
+            first_id = int(ExclusiveStartKey["treatment_id_partition_key"]["N"]) + 1
+
+        page_size = DYNAMODB_PAGE_BYTES // ESTIMATED_ITEM_BYTES
+        if Limit:
+            page_size = min(page_size, Limit)
+        page_last_id = min(last_id, first_id + page_size - 1)
+
+        count = max(0, page_last_id - first_id + 1)
+        response = {"Count": count, "ScannedCount": count}
+        if Select != "COUNT":
+            response["Items"] = list(table.items(first_id, page_last_id)) if count else []
+        if page_last_id < last_id:
+            response["LastEvaluatedKey"] = {"treatment_id_partition_key": {"N": str(page_last_id)}}
+        return response
+
+
+class LocalStepFunctionsExceptions:
+    class ExecutionAlreadyExists(LocalClientError):
+        pass
+
+    class ExecutionDoesNotExist(LocalClientError):
+        pass
+
+
+class LocalStepFunctions:
+    """Records executions; the benchmark runner drives the state machine itself"""
+
+    exceptions = LocalStepFunctionsExceptions
+
+    def __init__(self):
+        self.executions = []
+        self.calls = Counter()
+
+    def start_execution(self, stateMachineArn, input, name=None, **kwargs):
+        self.calls["start_execution"] += 1
+        name = name or uuid.uuid4().hex
+        for execution in self.executions:
+            if execution["stateMachineArn"] == stateMachineArn and execution["name"] == name:
+                if execution["status"] == "RUNNING" and execution["input"] == input:
+                    return {"executionArn": execution["executionArn"], "startDate": execution["startDate"]}
+                raise self.exceptions.ExecutionAlreadyExists(f"Execution already exists: {name}")
+
+        execution = {
+            "executionArn": f"{stateMachineArn.replace(':stateMachine:', ':execution:')}:{name}",
+            "stateMachineArn": stateMachineArn,
+            "name": name,
+            "input": input,
+            "status": "RUNNING",
+            "startDate": datetime.now(timezone.utc),
+        }
+        self.executions.append(execution)
+        return {"executionArn": execution["executionArn"], "startDate": execution["startDate"]}
+
+    def describe_execution(self, executionArn, **kwargs):
+        self.calls["describe_execution"] += 1
+        for execution in self.executions:
+            if execution["executionArn"] == executionArn:
+                return {key: execution[key] for key in ["executionArn", "stateMachineArn", "name", "status", "startDate", "input"]}
+        raise self.exceptions.ExecutionDoesNotExist(f"ExecutionDoesNotExist: {executionArn}")
+
+
+class LocalBoto3:
+    """Stands in for the boto3 module: `client(name)` hands out the shared local clients"""
+
+    def __init__(self, clients):
+        self.clients = clients
+
+    def client(self, service_name, *args, **kwargs):
+        try:
+            return self.clients[service_name]
+        except KeyError:
+            raise NotImplementedError(f"No local stand-in for the {service_name} client")
+
+
+def encode_rows(rows):
+    """Serialises Silver rows for a local S3 object (JSON lines; the local COPY reads them back)"""
+    return "".join(json.dumps(row) + "\n" for row in rows).encode("utf-8")
+
+
+def decode_rows(body):
+    return [json.loads(line) for line in body.decode("utf-8").splitlines() if line]
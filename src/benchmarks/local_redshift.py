@@ -0,0 +1,352 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+
+from local_aws import LocalClientError, decode_rows, encode_rows
+from redshift_procedures import check_port, procedure_signatures, procedures, register_functions
+
+# A Redshift Data API stand-in backed by SQLite. The silver and gold schemas are attached
+# in-memory databases, so the Lambdas' schema-qualified SQL runs unchanged. Statements run
+# synchronously when they are submitted and are FINISHED by the first describe_statement,
+# which keeps the measured latency down to the work itself. The pieces SQLite cannot run
+# are intercepted: CREATE TEMP TABLE ... (LIKE ...) copies a table's columns,
+# COPY ... MANIFEST reads the Silver batch files from the local S3,
+# UNLOAD writes a query's rows to it, pg_last_copy_count() and pg_last_unload_count()
+# answer from the batch's session, and CALLs are dispatched to the SQLite models in
+# redshift_procedures, each checked against the procedure's signature as it runs.
+
+SQL_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "redshift-sql-queries")
+DDL_FILE = os.path.join(SQL_DIRECTORY, "DDL_Big_Dim_Fact_ETL_Tracking_Entities.sql")
+
+RESULT_PAGE_ROWS = 1000
+
+COPY_PATTERN = re.compile(r"^\s*COPY\s+(\S+)\s+FROM\s+'s3://([^/]+)/([^']+)'.*\bMANIFEST\b", re.IGNORECASE | re.DOTALL)
+CALL_PATTERN = re.compile(r"^\s*CALL\s+([\w.]+)\s*\((.*)\)\s*;?\s*$", re.IGNORECASE | re.DOTALL)
+LAST_COPY_COUNT_PATTERN = re.compile(r"^\s*SELECT\s+pg_last_copy_count\(\)\s*;?\s*$", re.IGNORECASE)
+UNLOAD_PATTERN = re.compile(r"^\s*UNLOAD\s*\(\s*'((?:[^']|'')*)'\s*\)\s*TO\s+'s3://([^/]+)/([^']*)'", re.IGNORECASE | re.DOTALL)
+LAST_UNLOAD_COUNT_PATTERN = re.compile(r"^\s*SELECT\s+pg_last_unload_count\(\)\s*;?\s*$", re.IGNORECASE)
+CREATE_LIKE_PATTERN = re.compile(r"^\s*CREATE\s+TEMP\s+TABLE\s+(\w+)\s*\(\s*LIKE\s+([\w.]+)\s*\)\s*;?\s*$", re.IGNORECASE)
+
+# Redshift-only table attributes, dropped when the DDL is loaded into SQLite
+DDL_REWRITES = [
+    (re.compile(r"\bBIGINT\s+IDENTITY\(\d+,\s*\d+\)\s+PRIMARY KEY", re.IGNORECASE), "INTEGER PRIMARY KEY"),
+    (re.compile(r"\bENCODE\s+\w+", re.IGNORECASE), ""),
+    (re.compile(r"\bREFERENCES\s+[\w.]+\(\w+\)", re.IGNORECASE), ""),
+    (re.compile(r"\bDISTSTYLE\s+\w+", re.IGNORECASE), ""),
+    (re.compile(r"\bDISTKEY\s*\([^)]*\)", re.IGNORECASE), ""),
+    (re.compile(r"\b(INTERLEAVED\s+)?SORTKEY\s*(\([^)]*\)|AUTO)", re.IGNORECASE), ""),
+]
+
+
+def translate_ddl(ddl):
+    """Rewrites the Redshift table DDL into SQLite DDL"""
+    statements = []
+    for statement in ddl.split(";"):
+        for pattern, replacement in DDL_REWRITES:
+            statement = pattern.sub(replacement, statement)
+
+        # Redshift does not enforce primary keys and Silver keeps every version of a row
+        if re.search(r"CREATE\s+TABLE\s+silver\.", statement, re.IGNORECASE):
+            statement = re.sub(r"\bPRIMARY KEY\b", "", statement, flags=re.IGNORECASE)
+        statements.append(statement)
+    return ";".join(statements)
+
+
+def parse_call_arguments(arguments):
+    """Parses the literal arguments of a CALL (NULL, numbers and quoted strings)"""
+    values = []
+    for argument in re.findall(r"'(?:[^']|'')*'|[^,\s][^,]*", arguments):
+        argument = argument.strip()
+        if argument.upper() == "NULL":
+            values.append(None)
+        elif argument.startswith("'"):
+            values.append(argument[1:-1].replace("''", "'"))
+        else:
+            values.append(float(argument) if "." in argument else int(argument))
+    return values
+
+
+def field(value):
+    """Wraps a value the way get_statement_result does"""
+    if value is None:
+        return {"isNull": True}
+    if isinstance(value, bool):
+        return {"booleanValue": value}
+    if isinstance(value, int):
+        return {"longValue": value}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def redshift_type(declared_type):
+    """The Redshift type name describe_table reports for a SQLite column's declared type"""
+    declared_type = declared_type.upper()
+    if "INT" in declared_type:
+        return "int8"
+    if any(name in declared_type for name in ("REAL", "FLOA", "DOUB")):
+        return "float8"
+    if any(name in declared_type for name in ("DEC", "NUM")):
+        return "numeric"
+    if "BOOL" in declared_type:
+        return "bool"
+    if declared_type == "DATE":
+        return "date"
+    if "TIMESTAMP" in declared_type:
+        return "timestamp"
+    return "varchar"
+
+
+class LocalRedshiftData:
+    """The subset of the redshift-data client the pipeline uses"""
+
+    def __init__(self, s3, ddl_file=DDL_FILE):
+        self.s3 = s3
+        self.procedures = procedures()
+        self.procedure_signatures = procedure_signatures()
+        self.statements = {}
+        self.calls = Counter()
+        self.sql_statements = 0
+        self.lock = threading.Lock()
+
+        # One connection shared by every session; the lock serialises sessions like a single WLM slot
+        self.connection = sqlite3.connect(":memory:", check_same_thread=False, isolation_level=None)
+        self.connection.execute("ATTACH DATABASE ':memory:' AS silver")
+        self.connection.execute("ATTACH DATABASE ':memory:' AS gold")
+        register_functions(self.connection)
+
+        with open(ddl_file) as ddl:
+            self.connection.executescript(translate_ddl(ddl.read()))
+
+    # Data API calls
+
+    def execute_statement(self, Sql, **kwargs):
+        self.calls["execute_statement"] += 1
+        return {"Id": self._run_session([Sql]), "CreatedAt": datetime.now(timezone.utc)}
+
+    def batch_execute_statement(self, Sqls, **kwargs):
+        self.calls["batch_execute_statement"] += 1
+        return {"Id": self._run_session(Sqls, batch=True), "CreatedAt": datetime.now(timezone.utc)}
+
+    def describe_statement(self, Id):
+        self.calls["describe_statement"] += 1
+        statement = self._statement(Id)
+        description = {
+            key: statement[key]
+            for key in ["Id", "Status", "CreatedAt", "UpdatedAt", "Duration", "HasResultSet", "ResultRows", "QueryString"]
+        }
+        if statement.get("Error"):
+            description["Error"] = statement["Error"]
+        if "SubStatements" in statement:
+            description["SubStatements"] = [
+                {key: sub_statement[key] for key in ["Id", "Status", "Duration", "HasResultSet", "ResultRows", "QueryString"]}
+                for sub_statement in statement["SubStatements"]
+            ]
+        return description
+
+    def get_statement_result(self, Id, NextToken=None):
+        self.calls["get_statement_result"] += 1
+        statement = self._statement(Id)
+        if not statement["HasResultSet"]:
+            raise LocalClientError(f"ResourceNotFoundException: statement {Id} has no result set")
+
+        start = int(NextToken or 0)
+        rows = statement["Rows"][start : start + RESULT_PAGE_ROWS]
+        response = {
+            "ColumnMetadata": [{"name": name, "label": name} for name in statement["Columns"]],
+            "Records": [[field(value) for value in row] for row in rows],
+            "TotalNumRows": len(statement["Rows"]),
+        }
+        if start + RESULT_PAGE_ROWS < len(statement["Rows"]):
+            response["NextToken"] = str(start + RESULT_PAGE_ROWS)
+        return response
+
+    def describe_table(self, Schema, Table, **kwargs):
+        self.calls["describe_table"] += 1
+        with self.lock:
+            columns = self.connection.execute(f"PRAGMA {Schema}.table_info({Table})").fetchall()
+        return {
+            "TableName": f"{Schema}.{Table}",
+            "ColumnList": [
+                {"name": name, "typeName": redshift_type(declared_type), "schemaName": Schema, "tableName": Table}
+                for _, name, declared_type, *_ in columns
+            ],
+        }
+
+    def cancel_statement(self, Id):
+        self.calls["cancel_statement"] += 1
+        return {"Status": False}  # Statements have already finished by the time they can be cancelled
+
+    # Execution
+
+    def _statement(self, statement_id):
+        try:
+            return self.statements[statement_id]
+        except KeyError:
+            raise LocalClientError(f"ResourceNotFoundException: statement {statement_id}")
+
+    def _run_session(self, sqls, batch=False):
+        """Runs the statements in one session and one transaction, recording each like the Data API"""
+        statement_id = str(uuid.uuid4())
+        created_at = datetime.now(timezone.utc)
+        session = {"last_copy_count": -1, "last_unload_count": -1}
+        sub_statements = []
+        error = None
+
+        with self.lock:
+            self.sql_statements += len(sqls)
+            started_at = time.perf_counter_ns()
+            self.connection.execute("BEGIN")
+            try:
+                for position, sql in enumerate(sqls, start=1):
+                    sub_started_at = time.perf_counter_ns()
+                    columns, rows = self._run_sql(sql, session)
+                    sub_statements.append({
+                        "Id": f"{statement_id}:{position}",
+                        "Status": "FINISHED",
+                        "Duration": time.perf_counter_ns() - sub_started_at,
+                        "HasResultSet": columns is not None,
+                        "ResultRows": len(rows) if columns is not None else -1,
+                        "QueryString": sql,
+                        "Columns": columns,
+                        "Rows": rows,
+                    })
+                self.connection.execute("COMMIT")
+            except Exception as e:
+                self.connection.execute("ROLLBACK")
+                error = f"ERROR: {str(e)}"
+                for sub_statement in sub_statements:
+                    sub_statement["Status"] = "ABORTED"
+                sub_statements.append({
+                    "Id": f"{statement_id}:{len(sub_statements) + 1}",
+                    "Status": "FAILED",
+                    "Duration": -1,
+                    "HasResultSet": False,
+                    "ResultRows": -1,
+                    "QueryString": sqls[len(sub_statements)],
+                    "Columns": None,
+                    "Rows": [],
+                })
+            finally:
+                self._drop_temp_tables()
+            duration = time.perf_counter_ns() - started_at
+
+        statement = {
+            "Id": statement_id,
+            "Status": "FAILED" if error else "FINISHED",
+            "Error": error,
+            "CreatedAt": created_at,
+            "UpdatedAt": datetime.now(timezone.utc),
+            "Duration": -1 if error else duration,
+            "QueryString": "; ".join(sqls),
+        }
+        if batch:
+            statement.update({"HasResultSet": False, "ResultRows": -1, "SubStatements": sub_statements})
+            for sub_statement in sub_statements:
+                self.statements[sub_statement["Id"]] = sub_statement
+        else:
+            only = sub_statements[0]
+            statement.update({
+                "HasResultSet": only["HasResultSet"],
+                "ResultRows": only["ResultRows"],
+                "Columns": only["Columns"],
+                "Rows": only["Rows"],
+            })
+
+        self.statements[statement_id] = statement
+        return statement_id
+
+    def _drop_temp_tables(self):
+        """Temp tables live as long as the session, which ends with the statement or batch"""
+        temp_tables = self.connection.execute("SELECT name FROM temp.sqlite_master WHERE type = 'table'").fetchall()
+        for (table,) in temp_tables:
+            self.connection.execute(f'DROP TABLE temp."{table}"')
+
+    def _run_sql(self, sql, session):
+        """Runs one statement and returns its (columns, rows), with columns None when it returns nothing"""
+        copy = COPY_PATTERN.match(sql)
+        if copy:
+            session["last_copy_count"] = self._copy_from_manifest(*copy.groups())
+            return None, []
+
+        if LAST_COPY_COUNT_PATTERN.match(sql):
+            return ["pg_last_copy_count"], [(session["last_copy_count"],)]
+
+        unload = UNLOAD_PATTERN.match(sql)
+        if unload:
+            session["last_unload_count"] = self._unload(unload.group(1).replace("''", "'"), *unload.groups()[1:])
+            return None, []
+
+        if LAST_UNLOAD_COUNT_PATTERN.match(sql):
+            return ["pg_last_unload_count"], [(session["last_unload_count"],)]
+
+        call = CALL_PATTERN.match(sql)
+        if call:
+            name, arguments = call.groups()
+            try:
+                procedure = self.procedures[name.lower()]
+            except KeyError:
+                raise Exception(f"procedure {name} does not exist")
+            written = set()
+
+            def record_writes(action, table, _, database, __):
+                if action in (sqlite3.SQLITE_INSERT, sqlite3.SQLITE_UPDATE, sqlite3.SQLITE_DELETE) and database in ("silver", "gold"):
+                    written.add(f"{database}.{table}".lower())
+                return sqlite3.SQLITE_OK
+
+            self.connection.set_authorizer(record_writes)
+            try:
+                outputs = procedure(self.connection, *parse_call_arguments(arguments))
+            finally:
+                self.connection.set_authorizer(None)
+            check_port(self.procedure_signatures, name.lower(), outputs, written)
+            if not outputs:
+                return None, []
+            return list(outputs), [tuple(outputs.values())]
+
+        create_like = CREATE_LIKE_PATTERN.match(sql)
+        if create_like:
+            temp_table, table = create_like.groups()
+            self.connection.execute(f"CREATE TEMP TABLE {temp_table} AS SELECT * FROM {table} WHERE 0")
+            return None, []
+
+        sql = re.sub(r"\bGETDATE\(\)", "CURRENT_TIMESTAMP", sql, flags=re.IGNORECASE)
+        sql = re.sub(r"\bSYSDATE\b", "strftime('%Y-%m-%d %H:%M:%f', 'now')", sql, flags=re.IGNORECASE)
+        cursor = self.connection.execute(sql)
+        if cursor.description is None:
+            return None, []
+        return [column[0] for column in cursor.description], cursor.fetchall()
+
+    def _copy_from_manifest(self, table, bucket, manifest_key):
+        """COPY ... MANIFEST: loads every file the manifest lists and returns the rows loaded"""
+        manifest = json.loads(self.s3.get_object(Bucket=bucket, Key=manifest_key)["Body"].read())
+        schema, table_name = table.split(".") if "." in table else ("temp", table)
+        table_columns = [row[1] for row in self.connection.execute(f"PRAGMA {schema}.table_info({table_name})")]
+        if not table_columns:
+            raise Exception(f"relation {table} does not exist")
+
+        insert_sql = f"INSERT INTO {table} ({', '.join(table_columns)}) VALUES ({', '.join('?' * len(table_columns))})"
+        loaded = 0
+        for entry in manifest["entries"]:
+            file_key = entry["url"].split(f"s3://{bucket}/", 1)[-1]
+            rows = decode_rows(self.s3.get_object(Bucket=bucket, Key=file_key)["Body"].read())
+            self.connection.executemany(insert_sql, ([row.get(column) for column in table_columns] for row in rows))
+            loaded += len(rows)
+        return loaded
+
+    def _unload(self, query, bucket, prefix):
+        """UNLOAD ... PARALLEL OFF: writes the query's rows to a single file under the prefix"""
+        cursor = self.connection.execute(query)
+        columns = [column[0] for column in cursor.description]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        self.s3.put_object(Bucket=bucket, Key=f"{prefix}000.parquet", Body=encode_rows(rows))
+        return len(rows)
+
+    def table_count(self, table):
+        return self.connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
@@ -0,0 +1,436 @@
+import os
+import re
+from datetime import date, timedelta
+
+# SQLite models of the stored procedures in DDL_Stored_Procedures.sql, registered with the
+# local Redshift Data API under their Redshift names. They are hand-written copies, not the
+# SQL itself: each one follows its procedure step for step (load-time window, staged latest
+# versions, merge or delete+insert) and returns the procedure's OUT parameters, so the
+# Lambdas see the same result sets they get from Redshift, but timings measure the model.
+# check_port compares every CALL against the SQL's OUT parameters and the Gold tables it
+# writes, so a procedure that changes without its model fails the benchmark.
+
+PROCEDURES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "redshift-sql-queries", "DDL_Stored_Procedures.sql")
+PROCEDURE_PATTERN = re.compile(r"CREATE OR REPLACE PROCEDURE\s+([\w.]+)\s*\((.*?)\)\s*LANGUAGE\s+plpgsql\s+AS\s+\$\$(.*?)\$\$", re.IGNORECASE | re.DOTALL)
+WRITE_PATTERN = re.compile(r"\b(?:MERGE\s+INTO|INSERT\s+INTO|DELETE\s+FROM|UPDATE)\s+((?:silver|gold)\.\w+)", re.IGNORECASE)
+NESTED_CALL_PATTERN = re.compile(r"\bCALL\s+([\w.]+)", re.IGNORECASE)
+
+SILVER_TABLE = "silver.tbl_healthcare_analytics_data"
+MAX_GENERATED_DAYS = 100000
+
+
+def sql_literal(value):
+    if value is None:
+        return "NULL"
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def f_date_sk(timestamp):
+    """silver.f_date_sk: YYYYMMDD of a 'YYYY-MM-DD[ HH:MM:SS]' value"""
+    if timestamp is None:
+        return None
+    return int(timestamp[:10].replace("-", ""))
+
+
+def f_time_sk(timestamp):
+    """silver.f_time_sk: seconds since midnight of a 'YYYY-MM-DD HH:MM:SS' value"""
+    if timestamp is None:
+        return None
+    hours, minutes, seconds = (int(part) for part in (timestamp[11:19] or "00:00:00").split(":"))
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def register_functions(connection):
+    connection.create_function("f_date_sk", 1, f_date_sk, deterministic=True)
+    connection.create_function("f_time_sk", 1, f_time_sk, deterministic=True)
+
+
+def scalar(connection, sql, parameters=()):
+    row = connection.execute(sql, parameters).fetchone()
+    return row[0] if row else None
+
+
+def resolve_watermarks(connection, destination_table, since_watermark):
+    """silver.sp_resolve_watermarks: the load-time window and the oldest version it holds"""
+    if since_watermark is None:
+        since_watermark = scalar(
+            connection,
+            "SELECT COALESCE(MAX(high_watermark), '1900-01-01 00:00:00') FROM gold.etl_tracker WHERE destination_table = ? AND status = 'SUCCESS'",
+            (destination_table,),
+        )
+
+    high_watermark, delta_modified_from = connection.execute(
+        f"SELECT MAX(silver_loaded_at), MIN(COALESCE(metadata_modified_at, silver_loaded_at)) FROM {SILVER_TABLE} WHERE silver_loaded_at > ?",
+        (since_watermark,),
+    ).fetchone()
+    return since_watermark, high_watermark or since_watermark, delta_modified_from
+
+
+def latest_versions_sql(key_column, columns, since_watermark, high_watermark, delta_modified_from):
+    """
+    The staged delta every populate procedure builds: each key loaded in the window, at its
+    latest version among all of its Silver rows
+    """
+    return f"""
+        SELECT {", ".join(columns)}
+        FROM (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY {key_column} ORDER BY metadata_modified_at DESC, silver_loaded_at DESC) AS version_rank
+            FROM {SILVER_TABLE}
+            WHERE {key_column} IN (
+                    SELECT {key_column}
+                    FROM {SILVER_TABLE}
+                    WHERE silver_loaded_at > {sql_literal(since_watermark)}
+                        AND silver_loaded_at <= {sql_literal(high_watermark)}
+                )
+                AND COALESCE(metadata_modified_at, silver_loaded_at) >= {sql_literal(delta_modified_from)}
+                AND silver_loaded_at <= {sql_literal(high_watermark)}
+        ) AS versions
+        WHERE version_rank = 1
+    """
+
+
+def window_counts(connection, key_column, since_watermark, high_watermark):
+    """The reconciliation counts every populate procedure takes from Silver: rows read and rows superseded"""
+    return connection.execute(
+        f"SELECT COUNT(*), COUNT(*) - COUNT(DISTINCT {key_column}) FROM {SILVER_TABLE} "
+        "WHERE silver_loaded_at > ? AND silver_loaded_at <= ?",
+        (since_watermark, high_watermark),
+    ).fetchone()
+
+
+def populate_dimension(connection, destination_table, column_mapping, since_watermark):
+    """
+    silver.sp_populate_dim_*: stages the latest version of each key and MERGEs it.
+
+    `column_mapping` maps each dimension column to its Silver column, key first.
+    """
+    since_watermark, high_watermark, delta_modified_from = resolve_watermarks(connection, destination_table, since_watermark)
+    outputs = {"high_watermark": high_watermark, "rows_read": 0, "rows_filtered": 0, "rows_merged": 0}
+    if high_watermark <= since_watermark:
+        return outputs
+
+    stage_columns = [f"{source} AS {target}" for target, source in column_mapping.items()]
+    source_key = next(iter(column_mapping.values()))
+    outputs["rows_read"], outputs["rows_filtered"] = window_counts(connection, source_key, since_watermark, high_watermark)
+
+    connection.execute("DROP TABLE IF EXISTS temp.dim_stage")
+    connection.execute(
+        "CREATE TEMP TABLE dim_stage AS "
+        + latest_versions_sql(source_key, stage_columns, since_watermark, high_watermark, delta_modified_from)
+    )
+
+    columns = list(column_mapping)
+    updates = ", ".join(f"{column} = excluded.{column}" for column in columns[1:])
+    cursor = connection.execute(
+        f"""
+        INSERT INTO {destination_table} ({", ".join(columns)})
+        SELECT {", ".join(columns)} FROM temp.dim_stage WHERE true
+        ON CONFLICT ({columns[0]}) DO UPDATE SET {updates}
+        """
+    )
+    outputs["rows_merged"] = cursor.rowcount
+    return outputs
+
+
+DIMENSIONS = {
+    "silver.sp_populate_dim_treatment_types_and_outcome_statuses": (
+        "gold.dim_treatment_types_and_outcome_statuses",
+        {
+            "treatment_type_and_outcome_status_sk": "treatment_type_and_outcome_status_id",
+            "treatment_type": "treatment_type",
+            "treatment_outcome_status": "treatment_outcome_status",
+        },
+    ),
+    "silver.sp_populate_dim_locations": (
+        "gold.dim_locations",
+        {"location_sk": "location_id", "country": "location_country", "state": "location_state", "city": "location_city"},
+    ),
+    "silver.sp_populate_dim_specialities": (
+        "gold.dim_specialities",
+        {"speciality_sk": "provider_speciality_id", "speciality_name": "provider_speciality_name"},
+    ),
+    "silver.sp_populate_dim_providers": (
+        "gold.dim_providers",
+        {
+            "provider_sk": "provider_id",
+            "full_name": "provider_full_name",
+            "speciality_sk": "provider_speciality_id",
+            "affiliated_hospital": "provider_affiliated_hospital",
+            "location_sk": "location_id",
+        },
+    ),
+    "silver.sp_populate_dim_patients": (
+        "gold.dim_patients",
+        {"patient_sk": "patient_id", "full_name": "patient_full_name", "gender": "patient_gender", "age": "patient_age"},
+    ),
+    "silver.sp_populate_dim_diseases": (
+        "gold.dim_diseases",
+        {
+            "disease_sk": "disease_id",
+            "speciality_sk": "disease_speciality_id",
+            "name": "disease_name",
+            "type": "disease_type",
+            "severity": "disease_severity",
+            "transmission_mode": "disease_transmission_mode",
+            "mortality_rate": "disease_mortality_rate",
+        },
+    ),
+}
+
+
+def generate_dim_dates(connection, start_date, end_date):
+    """silver.sp_generate_dim_dates (TO_CHAR's 'Day' and 'Month' are blank-padded to 9)"""
+    if start_date is None or end_date is None:
+        return {}
+
+    start = date.fromisoformat(str(start_date)[:10])
+    end = date.fromisoformat(str(end_date)[:10])
+    if end < start:
+        return {}
+    if (end - start).days >= MAX_GENERATED_DAYS:
+        raise Exception(f"Date range {start} to {end} exceeds {MAX_GENERATED_DAYS} days")
+
+    rows = []
+    for offset in range((end - start).days + 1):
+        day = start + timedelta(days=offset)
+        rows.append((
+            int(day.strftime("%Y%m%d")),
+            day.isoformat(),
+            f"{day.strftime('%A'):<9}",
+            f"{day.strftime('%B'):<9}",
+            (day.month - 1) // 3 + 1,
+            day.year,
+            day.weekday() >= 5,
+        ))
+
+    connection.executemany(
+        "INSERT OR IGNORE INTO gold.dim_dates (date_sk, date, day_of_week, month, quarter, year, is_weekend) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        rows,
+    )
+    return {}
+
+
+def generate_dim_times(connection):
+    """silver.sp_generate_dim_times"""
+    connection.executemany(
+        "INSERT OR IGNORE INTO gold.dim_times (time_sk, hours, minutes, seconds) VALUES (?, ?, ?, ?)",
+        ((n, n // 3600, n // 60 % 60, n % 60) for n in range(86400)),
+    )
+    return {}
+
+
+FACT_COLUMNS = [
+    "fact_treatment_sk", "treatment_type_and_outcome_status_sk", "provider_sk", "location_sk",
+    "patient_sk", "disease_sk", "speciality_sk", "start_date_sk", "completion_date_sk",
+    "outcome_date_sk", "start_time_sk", "completion_time_sk", "outcome_time_sk",
+    "duration_in_days", "cost",
+]
+
+
+def populate_fact_treatments(connection, since_watermark):
+    """silver.sp_populate_fact_treatments"""
+    since_watermark, high_watermark, delta_modified_from = resolve_watermarks(connection, "gold.fact_treatments", since_watermark)
+    outputs = {"high_watermark": high_watermark, "rows_read": 0, "rows_filtered": 0, "rows_inserted": 0, "rows_updated": 0}
+    if high_watermark <= since_watermark:
+        return outputs
+    outputs["rows_read"], outputs["rows_filtered"] = window_counts(connection, "treatment_id", since_watermark, high_watermark)
+
+    stage_columns = [
+        "treatment_id AS fact_treatment_sk",
+        "treatment_type_and_outcome_status_id AS treatment_type_and_outcome_status_sk",
+        "provider_id AS provider_sk",
+        "location_id AS location_sk",
+        "patient_id AS patient_sk",
+        "disease_id AS disease_sk",
+        "provider_speciality_id AS speciality_sk",
+        "f_date_sk(treatment_start_date) AS start_date_sk",
+        "f_date_sk(treatment_completion_date) AS completion_date_sk",
+        "f_date_sk(treatment_outcome_date) AS outcome_date_sk",
+        "f_time_sk(treatment_start_date) AS start_time_sk",
+        "f_time_sk(treatment_completion_date) AS completion_time_sk",
+        "f_time_sk(treatment_outcome_date) AS outcome_time_sk",
+        "treatment_duration_in_days AS duration_in_days",
+        "treatment_cost AS cost",
+    ]
+    connection.execute("DROP TABLE IF EXISTS temp.fact_stage")
+    connection.execute(
+        "CREATE TEMP TABLE fact_stage AS SELECT * FROM ("
+        + latest_versions_sql("treatment_id", stage_columns, since_watermark, high_watermark, delta_modified_from)
+        + ")"
+    )
+    outputs["rows_filtered"] += connection.execute("DELETE FROM temp.fact_stage WHERE start_date_sk IS NULL").rowcount
+
+    # LEAST/GREATEST ignore NULLs in Redshift, so take each column's bounds separately
+    bounds = connection.execute(
+        "SELECT MIN(start_date_sk), MIN(completion_date_sk), MIN(outcome_date_sk), "
+        "MAX(start_date_sk), MAX(completion_date_sk), MAX(outcome_date_sk) FROM temp.fact_stage"
+    ).fetchone()
+    lower = [value for value in bounds[:3] if value is not None]
+    upper = [value for value in bounds[3:] if value is not None]
+    if lower:
+        to_date = lambda date_sk: f"{str(date_sk)[:4]}-{str(date_sk)[4:6]}-{str(date_sk)[6:]}"
+        generate_dim_dates(connection, to_date(sorted(lower)[0]), to_date(sorted(upper)[-1]))
+
+    outputs["rows_updated"] = connection.execute(
+        "DELETE FROM gold.fact_treatments WHERE fact_treatment_sk IN (SELECT fact_treatment_sk FROM temp.fact_stage)"
+    ).rowcount
+    rows_written = connection.execute(
+        f"INSERT INTO gold.fact_treatments ({', '.join(FACT_COLUMNS)}) SELECT {', '.join(FACT_COLUMNS)} FROM temp.fact_stage"
+    ).rowcount
+    outputs["rows_inserted"] = rows_written - outputs["rows_updated"]
+    return outputs
+
+
+def apply_summary_state_delta(connection):
+    """silver.sp_apply_summary_state_delta"""
+    last_watermark = scalar(
+        connection,
+        "SELECT COALESCE(MAX(high_watermark), '1900-01-01 00:00:00') FROM gold.etl_tracker WHERE destination_table = 'gold.summary_state' AND status = 'SUCCESS'",
+    )
+    new_watermark = scalar(
+        connection,
+        f"SELECT MAX(silver_loaded_at) FROM {SILVER_TABLE} WHERE silver_loaded_at > ?",
+        (last_watermark,),
+    )
+    fact_watermark = scalar(
+        connection,
+        "SELECT MAX(high_watermark) FROM gold.etl_tracker WHERE destination_table = 'gold.fact_treatments' AND status = 'SUCCESS'",
+    )
+    if fact_watermark is not None and new_watermark is not None and new_watermark > fact_watermark:
+        new_watermark = fact_watermark
+    if new_watermark is None or new_watermark <= last_watermark:
+        return {}
+
+    connection.execute("DROP TABLE IF EXISTS temp.changed_facts")
+    connection.execute(f"""
+        CREATE TEMP TABLE changed_facts AS
+        SELECT
+            f.fact_treatment_sk, f.provider_sk, f.location_sk, f.start_date_sk,
+            CASE WHEN f.treatment_type_and_outcome_status_sk = 1 THEN 1 ELSE 0 END AS is_success,
+            f.cost
+        FROM gold.fact_treatments f
+        JOIN (
+            SELECT DISTINCT treatment_id
+            FROM {SILVER_TABLE}
+            WHERE silver_loaded_at > {sql_literal(last_watermark)}
+                AND silver_loaded_at <= {sql_literal(new_watermark)}
+        ) changed
+            ON f.fact_treatment_sk = changed.treatment_id
+    """)
+
+    connection.execute("DROP TABLE IF EXISTS temp.summary_delta")
+    connection.execute("""
+        CREATE TEMP TABLE summary_delta AS
+        SELECT
+            c.provider_sk, c.location_sk, c.start_date_sk,
+            -1 AS treatments, -c.is_success AS successes, -c.cost AS cost,
+            CASE WHEN c.cost IS NULL THEN 0 ELSE -1 END AS costed
+        FROM gold.summary_state_contributions c
+        JOIN temp.changed_facts cf
+            ON c.fact_treatment_sk = cf.fact_treatment_sk
+        UNION ALL
+        SELECT provider_sk, location_sk, start_date_sk, 1, is_success, cost, CASE WHEN cost IS NULL THEN 0 ELSE 1 END
+        FROM temp.changed_facts
+    """)
+
+    connection.execute("""
+        INSERT INTO gold.summary_state_providers (provider_sk, total_treatments, successful_treatments, total_cost, costed_treatments)
+        SELECT * FROM (
+            SELECT provider_sk, SUM(treatments), SUM(successes), COALESCE(SUM(cost), 0), SUM(costed)
+            FROM temp.summary_delta
+            GROUP BY provider_sk
+        ) WHERE true
+        ON CONFLICT (provider_sk) DO UPDATE SET
+            total_treatments = total_treatments + excluded.total_treatments,
+            successful_treatments = successful_treatments + excluded.successful_treatments,
+            total_cost = total_cost + excluded.total_cost,
+            costed_treatments = costed_treatments + excluded.costed_treatments
+    """)
+    connection.execute("""
+        INSERT INTO gold.summary_state_locations (location_sk, total_treatments)
+        SELECT * FROM (
+            SELECT location_sk, SUM(treatments) FROM temp.summary_delta GROUP BY location_sk
+        ) WHERE true
+        ON CONFLICT (location_sk) DO UPDATE SET
+            total_treatments = total_treatments + excluded.total_treatments
+    """)
+    connection.execute("""
+        INSERT INTO gold.summary_state_dates (start_date_sk, total_treatments, successful_treatments)
+        SELECT * FROM (
+            SELECT start_date_sk, SUM(treatments), SUM(successes) FROM temp.summary_delta GROUP BY start_date_sk
+        ) WHERE true
+        ON CONFLICT (start_date_sk) DO UPDATE SET
+            total_treatments = total_treatments + excluded.total_treatments,
+            successful_treatments = successful_treatments + excluded.successful_treatments
+    """)
+
+    for table in ["gold.summary_state_providers", "gold.summary_state_locations", "gold.summary_state_dates"]:
+        connection.execute(f"DELETE FROM {table} WHERE total_treatments = 0")
+
+    connection.execute(
+        "DELETE FROM gold.summary_state_contributions WHERE fact_treatment_sk IN (SELECT fact_treatment_sk FROM temp.changed_facts)"
+    )
+    connection.execute("""
+        INSERT INTO gold.summary_state_contributions (fact_treatment_sk, provider_sk, location_sk, start_date_sk, is_success, cost)
+        SELECT fact_treatment_sk, provider_sk, location_sk, start_date_sk, is_success, cost
+        FROM temp.changed_facts
+    """)
+    connection.execute(
+        "INSERT INTO gold.etl_tracker (source_layer, destination_layer, source_table, destination_table, status, source_count, high_watermark, completion_timestamp) "
+        "SELECT 'gold', 'gold', 'gold.fact_treatments', 'gold.summary_state', 'SUCCESS', COUNT(*), ?, CURRENT_TIMESTAMP FROM temp.changed_facts",
+        (new_watermark,),
+    )
+    return {}
+
+
+def procedure_signatures(procedures_file=PROCEDURES_FILE):
+    """
+    Reads each procedure's OUT parameters and the tables it writes from DDL_Stored_Procedures.sql.
+
+    Tables written by the procedures it CALLs count as its own.
+    """
+    with open(procedures_file) as sql:
+        definitions = {
+            name.lower(): (re.findall(r"(\w+)\s+OUT\b", parameters, re.IGNORECASE), body)
+            for name, parameters, body in PROCEDURE_PATTERN.findall(sql.read())
+        }
+
+    def written_tables(name, visited=()):
+        body = definitions[name][1]
+        tables = {table.lower() for table in WRITE_PATTERN.findall(body)}
+        for nested in NESTED_CALL_PATTERN.findall(body):
+            if nested.lower() in definitions and nested.lower() not in visited:
+                tables |= written_tables(nested.lower(), visited + (name,))
+        return tables
+
+    return {name: (out_parameters, written_tables(name)) for name, (out_parameters, _) in definitions.items()}
+
+
+def check_port(signatures, name, outputs, written):
+    """Raises if a model's CALL returned other OUT parameters or wrote other tables than the procedure"""
+    if name not in signatures:
+        raise Exception(f"{name} has a model but no procedure in DDL_Stored_Procedures.sql")
+
+    out_parameters, tables = signatures[name]
+    if list(outputs or {}) != out_parameters:
+        raise Exception(f"Model of {name} returned {list(outputs or {})}, the procedure returns {out_parameters}")
+    if not written <= tables:
+        raise Exception(f"Model of {name} wrote {sorted(written - tables)}, which the procedure never writes")
+
+
+def procedures():
+    """Maps each procedure name to a callable taking (connection, *call arguments)"""
+    registry = {
+        "silver.sp_generate_dim_dates": generate_dim_dates,
+        "silver.sp_generate_dim_times": generate_dim_times,
+        "silver.sp_populate_fact_treatments": populate_fact_treatments,
+        "silver.sp_apply_summary_state_delta": apply_summary_state_delta,
+    }
+    for name, (destination_table, column_mapping) in DIMENSIONS.items():
+        registry[name] = (
+            lambda connection, since_watermark=None, destination_table=destination_table, column_mapping=column_mapping:
+            populate_dimension(connection, destination_table, column_mapping, since_watermark)
+        )
+    return registry
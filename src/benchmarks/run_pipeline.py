@@ -0,0 +1,423 @@
+"""
+Offline end-to-end benchmark of the pipeline.
+
+Generates a synthetic DynamoDB table, stands in for the Databricks notebooks by scanning it
+into a Silver batch (files plus manifest, as LayerUtils writes them), and then drives the
+real TriggerStepFunctionLambda, CopyToRedShiftLambda, TransformToGoldLambda,
+ExecuteAnalyticalQueriesLambda and PublishGoldSnapshotsLambda through StateMachine.json
+against local stand-ins for S3, DynamoDB, Step Functions and the Redshift Data API, then
+reads the published snapshots as a dashboard would. Nothing touches AWS.
+
+The stored procedures run as SQLite models (redshift_procedures.py), not as the Redshift
+SQL, so Gold timings measure the models. Every CALL is checked against the procedure's OUT
+parameters and the tables it writes in DDL_Stored_Procedures.sql.
+
+Every stage reports its latency, rows/sec, SQL statements and API calls so performance
+changes can be compared run to run:
+
+    python run_pipeline.py --rows 100000 --update-rows 10000 --output baseline.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+BENCHMARK_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+SOURCE_DIRECTORY = os.path.dirname(BENCHMARK_DIRECTORY)
+LAMBDA_DIRECTORY = os.path.join(SOURCE_DIRECTORY, "lambda_functions")
+DASHBOARD_DIRECTORY = os.path.join(SOURCE_DIRECTORY, "dashboard")
+STATE_MACHINE_FILE = os.path.join(SOURCE_DIRECTORY, "step_function", "StateMachine.json")
+STATIC_DIMENSIONS_FILE = os.path.join(SOURCE_DIRECTORY, "redshift-sql-queries", "DML_Static_Dimensions.sql")
+
+sys.path[:0] = [BENCHMARK_DIRECTORY, LAMBDA_DIRECTORY, DASHBOARD_DIRECTORY]
+
+from local_aws import LocalBoto3, LocalDynamoDB, LocalS3, LocalStepFunctions, decode_rows, encode_rows
+from local_redshift import LocalRedshiftData
+from synthetic_data import TIMESTAMP_FORMAT, SyntheticDynamoTable, silver_row
+
+BUCKET = "healthcare-analytics-data"
+DYNAMO_TABLE = "tbl_healthcare_analytics_data"
+SILVER_PREFIX = "silver-layer"
+STATE_MACHINE_ARN = "arn:aws:states:local:000000000000:stateMachine:HealthcareAnalyticsPipeline"
+FIRST_LOAD_MODIFIED_AT = datetime(2024, 6, 1)
+
+
+def install_local_aws(refresh_mode, trace_sink_path):
+    """Creates the local clients and makes `import boto3` hand them to the Lambdas"""
+    s3 = LocalS3()
+    clients = {
+        "s3": s3,
+        "dynamodb": LocalDynamoDB(),
+        "stepfunctions": LocalStepFunctions(),
+        "redshift-data": LocalRedshiftData(s3),
+    }
+    sys.modules["boto3"] = LocalBoto3(clients)
+
+    os.environ.update({
+        "REDSHIFT_CLUSTER_ID": "local-cluster",
+        "REDSHIFT_DB": "dev",
+        "DB_USER": "benchmark",
+        "TABLE": "silver.tbl_healthcare_analytics_data",
+        "REDSHIFT_ROLE": "arn:aws:iam::000000000000:role/local-redshift",
+        "STEP_FUNCTION_ARN": STATE_MACHINE_ARN,
+        "PIPELINE_LOCK_TABLE": "healthcare-pipeline-lock",
+        "TRIGGER_QUEUE_URL": "https://sqs.local/000000000000/healthcare-silver-notifications",
+        "REFRESH_MODE": refresh_mode,
+        "TRACE_SINK_PATH": trace_sink_path,
+        "SNAPSHOT_BUCKET": BUCKET,
+    })
+    return clients
+
+
+def api_calls(clients):
+    """Total calls made to every local client so far"""
+    calls = {}
+    for service, client in clients.items():
+        for operation, count in client.calls.items():
+            calls[f"{service}.{operation}"] = count
+    return calls
+
+
+class StageRecorder:
+    """Times stages and attributes SQL statements and API calls to each of them"""
+
+    def __init__(self, clients):
+        self.clients = clients
+        self.stages = []
+        self.batch = None
+
+    def run(self, name, function, rows=None):
+        """Runs function(); `rows` maps its result to the number of rows the stage processed"""
+        calls_before = api_calls(self.clients)
+        statements_before = self.clients["redshift-data"].sql_statements
+        started_at = time.perf_counter()
+
+        result = function()
+
+        latency = time.perf_counter() - started_at
+        calls_after = api_calls(self.clients)
+        row_count = rows(result) if rows else None
+
+        self.stages.append({
+            "batch": self.batch,
+            "stage": name,
+            "latency_seconds": round(latency, 3),
+            "rows": row_count,
+            "rows_per_second": round(row_count / latency, 1) if row_count and latency > 0 else None,
+            "sql_statements": self.clients["redshift-data"].sql_statements - statements_before,
+            "api_calls": {
+                operation: count - calls_before.get(operation, 0)
+                for operation, count in calls_after.items()
+                if count - calls_before.get(operation, 0)
+            },
+        })
+        return result
+
+
+def load_static_dimensions(redshift_data):
+    """Runs DML_Static_Dimensions.sql one statement at a time, like the query editor would"""
+    with open(STATIC_DIMENSIONS_FILE) as dml:
+        statements = [
+            "\n".join(line for line in statement.splitlines() if not line.strip().startswith("--")).strip()
+            for statement in dml.read().split(";")
+        ]
+
+    for sql in statements:
+        if sql.upper().startswith("TRUNCATE"):
+            sql = sql.replace("TRUNCATE", "DELETE FROM", 1)  # SQLite has no TRUNCATE
+        if sql:
+            redshift_data.execute_statement(Sql=sql)
+    return statements
+
+
+def extract_silver_batch(clients, batch_id, segments, rows_per_file):
+    """
+    Stands in for the Extraction and Transformation notebooks.
+
+    Scans the DynamoDB table with a segmented scan, flattens each item into its Silver row
+    and writes the batch as files plus a manifest carrying the record count, under the keys
+    LayerUtils.write_partitioned and write_redshift_manifest use. The local COPY reads the
+    files back, so they hold JSON lines rather than Parquet.
+    """
+    dynamodb, s3 = clients["dynamodb"], clients["s3"]
+
+    def write_file(segment, part, rows):
+        key = f"{SILVER_PREFIX}/batch_id={batch_id}/part-{segment:03d}-{part:05d}.parquet"
+        body = encode_rows(rows)
+        response = s3.put_object(Bucket=BUCKET, Key=key, Body=body)
+        return {"Key": key, "ETag": response["ETag"], "Size": len(body), "Rows": len(rows)}
+
+    # Each segment flushes its rows to a file as soon as one fills, so memory stays bounded
+    def scan_segment(segment):
+        files, rows = [], []
+        scan_kwargs = {"TableName": DYNAMO_TABLE, "Segment": segment, "TotalSegments": segments}
+        while True:
+            response = dynamodb.scan(**scan_kwargs)
+            rows.extend(silver_row(item) for item in response.get("Items", []))
+            while len(rows) >= rows_per_file:
+                files.append(write_file(segment, len(files), rows[:rows_per_file]))
+                rows = rows[rows_per_file:]
+            if "LastEvaluatedKey" not in response:
+                break
+            scan_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+        if rows:
+            files.append(write_file(segment, len(files), rows))
+        return files
+
+    with ThreadPoolExecutor(max_workers=segments) as executor:
+        files = [file for segment_files in executor.map(scan_segment, range(segments)) for file in segment_files]
+    record_count = 0
+    for file in files:
+        record_count += file["Rows"]
+
+    manifest = {
+        "entries": [
+            {"url": f"s3://{BUCKET}/{file['Key']}", "mandatory": True, "meta": {"content_length": file["Size"]}}
+            for file in files
+        ]
+    }
+    manifest_key = f"{SILVER_PREFIX}/_manifests/{batch_id}.manifest"
+    response = s3.put_object(
+        Bucket=BUCKET,
+        Key=manifest_key,
+        Body=json.dumps(manifest).encode("utf-8"),
+        ContentType="application/json",
+        Metadata={"record-count": str(record_count), "batch-id": batch_id},
+    )
+    objects = [{"Key": file["Key"], "ETag": file["ETag"]} for file in files]
+    objects.append({"Key": manifest_key, "ETag": response["ETag"]})
+    return {"objects": objects, "rows": record_count, "files": len(files)}
+
+
+def s3_event(bucket, objects, repeat=()):
+    """
+    What the trigger Lambda receives in batching mode: one SQS batch of S3 ObjectCreated
+    notifications, one per object. Notifications for `repeat` are delivered twice, as S3
+    may do.
+    """
+    def message(s3_object):
+        return {
+            "eventSource": "aws:sqs",
+            "body": json.dumps({
+                "Records": [{
+                    "eventSource": "aws:s3",
+                    "eventName": "ObjectCreated:Put",
+                    "s3": {"bucket": {"name": bucket}, "object": {"key": s3_object["Key"], "eTag": s3_object["ETag"]}},
+                }]
+            }),
+        }
+
+    return {"Records": [message(s3_object) for s3_object in list(objects) + list(repeat)]}
+
+
+def json_path(document, path):
+    """Resolves the `$.a.b` paths StateMachine.json uses"""
+    value = document
+    for part in path.lstrip("$").strip(".").split("."):
+        if part:
+            value = value[part]
+    return value
+
+
+def task_input(state, state_input):
+    """Applies a Task's Parameters (keys ending in `.$` are paths into the state input)"""
+    if "Parameters" not in state:
+        return state_input
+    return {
+        key[:-2] if key.endswith(".$") else key: json_path(state_input, value) if key.endswith(".$") else value
+        for key, value in state["Parameters"].items()
+    }
+
+
+def run_state_machine(recorder, lambdas, execution_input, rows):
+    """
+    Walks StateMachine.json, invoking each Task's Lambda handler in process.
+
+    A Task's ResultPath places its result in the state; without one the result replaces it,
+    as in Step Functions. A Lambda that reports an error stops the run.
+    """
+    with open(STATE_MACHINE_FILE) as definition:
+        state_machine = json.load(definition)
+
+    state_name = state_machine["StartAt"]
+    state = execution_input
+    while state_name:
+        definition = state_machine["States"][state_name]
+        function_name = definition["Resource"].rsplit(":", 1)[-1]
+        handler = lambdas[function_name].lambda_handler
+        payload = task_input(definition, state)
+
+        result = recorder.run(function_name, lambda: handler(payload, None), rows(function_name))
+        if str(result.get("status", "")).lower() == "error":
+            raise Exception(f"{function_name} failed: {result.get('message')}")
+
+        if "ResultPath" in definition:
+            state = dict(state)
+            state[definition["ResultPath"].split(".", 1)[-1]] = result
+        else:
+            state = result
+
+        state_name = None if definition.get("End") else definition["Next"]
+    return state
+
+
+def run_batch(recorder, clients, lambdas, snapshot_reader, batch_id, segments, rows_per_file):
+    """Extracts one batch and pushes it through the trigger and the state machine"""
+    recorder.batch = batch_id
+    batch = recorder.run("Extract (DynamoDB scan to Silver batch)", lambda: extract_silver_batch(clients, batch_id, segments, rows_per_file), lambda result: result["rows"])
+
+    trigger = lambdas["TriggerStepFunctionLambda"].lambda_handler
+    # The trigger sees a notification for every file and the manifest, plus a duplicate delivery
+    event = s3_event(BUCKET, batch["objects"], repeat=batch["objects"][-1:])
+    recorder.run("TriggerStepFunctionLambda", lambda: trigger(event, None))
+    execution = clients["stepfunctions"].executions[-1]
+
+    # Later stages process the rows of this batch, so their throughput is measured against it
+    def rows(function_name):
+        if function_name == "CopyToRedShiftLambda":
+            return lambda result: result.get("rows_loaded")
+        if function_name == "PublishGoldSnapshotsLambda":
+            return lambda result: result.get("rows_published")
+        return lambda result: batch["rows"]
+
+    run_state_machine(recorder, lambdas, json.loads(execution["input"]), rows)
+    execution["status"] = "SUCCEEDED"
+
+    # Dashboards read every summary twice: the first read fetches the new snapshots, the
+    # second is served from the reader's cache after a 304 on the index
+    for attempt in ["new snapshot", "cached"]:
+        recorder.run(f"Dashboard reads ({attempt})", lambda: read_dashboard(snapshot_reader), lambda result: result)
+    return batch
+
+
+def read_dashboard(snapshot_reader):
+    """Reads every published summary, as a dashboard would, and returns the rows read"""
+    rows = 0
+    for table in snapshot_reader.index()["tables"]:
+        rows += len(snapshot_reader.read_table(table))
+    return rows
+
+
+def run(rows, update_rows, seed, segments, rows_per_file, refresh_mode, log_level=logging.WARNING):
+    # The Lambdas' spans are collected in a local sink and summarized per pipeline run
+    trace_sink = tempfile.NamedTemporaryFile(prefix="pipeline_spans_", suffix=".jsonl", delete=False)
+    trace_sink.close()
+    clients = install_local_aws(refresh_mode, trace_sink.name)
+    redshift_data = clients["redshift-data"]
+
+    # The Lambdas read their environment and build their clients at import time
+    import CopyToRedShiftLambda
+    import ExecuteAnalyticalQueriesLambda
+    import TransformToGoldLambda
+    import PublishGoldSnapshotsLambda
+    import TriggerStepFunctionLambda
+    import pipeline_tracing
+    from gold_snapshot_reader import GoldSnapshotReader
+
+    logging.getLogger().setLevel(log_level)  # The Lambdas set INFO on import
+
+    lambdas = {
+        module.__name__: module
+        for module in [TriggerStepFunctionLambda, CopyToRedShiftLambda, TransformToGoldLambda, ExecuteAnalyticalQueriesLambda, PublishGoldSnapshotsLambda]
+    }
+
+    # Snapshot files are JSON lines locally, like the Silver files; every read revalidates the index
+    snapshot_reader = GoldSnapshotReader(
+        BUCKET,
+        revalidate_seconds=0,
+        s3_client=clients["s3"],
+        decode=lambda bodies, columns: [row for body in bodies for row in decode_rows(body)],
+    )
+
+    recorder = StageRecorder(clients)
+    recorder.batch = "setup"
+    recorder.run("Static dimensions", lambda: load_static_dimensions(redshift_data))
+
+    table = SyntheticDynamoTable(rows, seed=seed, modified_at=FIRST_LOAD_MODIFIED_AT.strftime(TIMESTAMP_FORMAT))
+    clients["dynamodb"].add_table(DYNAMO_TABLE, table)
+    run_batch(recorder, clients, lambdas, snapshot_reader, "full_load", segments, rows_per_file)
+
+    if update_rows:
+        # An update batch: the first `update_rows` treatments move to a new version
+        updated_at = (FIRST_LOAD_MODIFIED_AT + timedelta(days=1)).strftime(TIMESTAMP_FORMAT)
+        updates = SyntheticDynamoTable(rows, seed=seed, modified_at=updated_at, version=1, added_at=table.added_at)
+        updates.row_count = update_rows
+        clients["dynamodb"].add_table(DYNAMO_TABLE, updates)
+        run_batch(recorder, clients, lambdas, snapshot_reader, "update", segments, rows_per_file)
+
+    pipeline_runs = pipeline_tracing.summarize_run(pipeline_tracing.read_spans(trace_sink.name))
+    os.remove(trace_sink.name)
+
+    return {
+        "parameters": {
+            "rows": rows,
+            "update_rows": update_rows,
+            "seed": seed,
+            "segments": segments,
+            "rows_per_file": rows_per_file,
+            "refresh_mode": refresh_mode,
+        },
+        "stages": recorder.stages,
+        "pipeline_runs": pipeline_runs,
+        "snapshot_reads": snapshot_reader.stats,
+        "table_counts": {
+            table_name: redshift_data.table_count(table_name)
+            for table_name in ["silver.tbl_healthcare_analytics_data", "gold.fact_treatments", "gold.dim_providers", "gold.provider_treatment_rank"]
+        },
+    }
+
+
+def print_report(report):
+    print("Gold stored procedures ran as SQLite models of DDL_Stored_Procedures.sql; compare runs, not Redshift timings")
+    print(f"{'batch':<10} {'stage':<42} {'latency s':>10} {'rows':>10} {'rows/s':>12} {'sql':>6} {'api':>6}")
+    for stage in report["stages"]:
+        print(
+            f"{stage['batch']:<10} {stage['stage']:<42} {stage['latency_seconds']:>10.3f} "
+            f"{stage['rows'] if stage['rows'] is not None else '-':>10} "
+            f"{stage['rows_per_second'] if stage['rows_per_second'] is not None else '-':>12} "
+            f"{stage['sql_statements']:>6} {sum(stage['api_calls'].values()):>6}"
+        )
+    for pipeline_run in report["pipeline_runs"]:
+        hot_stages = ", ".join(
+            f"{stage['stage']} {stage['share']:.0%}" + (f" (slowest: {stage['slowest_sub_stage']})" if stage["slowest_sub_stage"] else "")
+            for stage in pipeline_run["hot_stages"]
+        )
+        print(f"run {pipeline_run['pipeline_run_id']}: {pipeline_run['total_seconds']:.3f}s in Lambdas, hot stages: {hot_stages}")
+        if pipeline_run["failed_stages"]:
+            print(f"  failed stages: {', '.join(pipeline_run['failed_stages'])}")
+    print(f"snapshot reads: {', '.join(f'{name} {count}' for name, count in report['snapshot_reads'].items())}")
+    print(json.dumps(report["table_counts"], indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000, help="Items in the synthetic DynamoDB table (10k to 50M)")
+    parser.add_argument("--update-rows", type=int, default=0, help="Items updated in a second, incremental batch")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--segments", type=int, default=8, help="DynamoDB scan segments")
+    parser.add_argument("--rows-per-file", type=int, default=100000, help="Rows per Silver batch file")
+    parser.add_argument("--refresh-mode", choices=["incremental", "full"], default="incremental")
+    parser.add_argument("--output", help="Also write the report as JSON to this file")
+    parser.add_argument("--verbose", action="store_true", help="Show the Lambdas' logs")
+    args = parser.parse_args()
+
+    log_level = logging.INFO if args.verbose else logging.WARNING
+    logging.basicConfig(level=log_level)
+
+    report = run(args.rows, args.update_rows, args.seed, args.segments, args.rows_per_file, args.refresh_mode, log_level)
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
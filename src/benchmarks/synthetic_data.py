@@ -0,0 +1,175 @@
+import random
+from datetime import datetime, timedelta
+
+# Synthetic healthcare records shaped like the DynamoDB items the extractor scans, with the
+# same nested attributes `DataTransformer.structure` unwraps. Every item is derived from its
+# treatment id and the seed alone, so any slice of a table can be regenerated on demand
+# without holding the table in memory.
+
+TREATMENT_TYPES = ["Chemotherapy", "Medication", "Physiotherapy", "Radiation", "Surgery"]
+OUTCOME_STATUSES = ["Failed", "Ongoing", "Successful"]
+COUNTRIES = ["India", "United States", "United Kingdom", "Germany", "Japan"]
+GENDERS = ["Female", "Male"]
+SEVERITIES = ["Low", "Moderate", "High", "Critical"]
+TRANSMISSION_MODES = ["Airborne", "Contact", "Vector", "Non-communicable"]
+
+# Mirrors the codes DictionaryEncoder assigns when every combination is new (ordered by "type_status")
+TREATMENT_TYPE_AND_OUTCOME_STATUS_IDS = {
+    combination: rank
+    for rank, combination in enumerate(
+        sorted(f"{treatment_type}_{status}" for treatment_type in TREATMENT_TYPES for status in OUTCOME_STATUSES),
+        start=1,
+    )
+}
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+FIRST_START_DATE = datetime(2019, 1, 1)
+START_DATE_SPAN_SECONDS = 5 * 365 * 86400
+
+
+def entity_counts(row_count):
+    """Dimension cardinalities that grow with the table like the real data does"""
+    return {
+        "providers": max(10, row_count // 200),
+        "patients": max(10, row_count // 4),
+        "locations": 500,
+        "diseases": 300,
+        "specialities": 25,
+    }
+
+
+def number(value):
+    return {"N": str(value)}
+
+
+def string(value):
+    return {"S": value}
+
+
+class SyntheticDynamoTable:
+    """A virtual DynamoDB table of `row_count` healthcare items, generated on demand"""
+
+    def __init__(self, row_count, seed=42, modified_at="2024-06-01 00:00:00", version=0, added_at=None):
+        self.row_count = row_count
+        self.seed = seed
+        self.modified_at = modified_at
+        self.added_at = added_at or modified_at
+        self.version = version  # Bumping it changes costs and outcomes, like an update batch
+        self.entities = entity_counts(row_count)
+
+    def item(self, treatment_id):
+        """Returns the DynamoDB item of one treatment (ids run from 1 to row_count)"""
+        rng = random.Random(self.seed * 1_000_003 + treatment_id)
+        entities = self.entities
+
+        start_date = FIRST_START_DATE + timedelta(seconds=rng.randrange(START_DATE_SPAN_SECONDS))
+        duration_in_days = rng.randint(1, 120)
+        treatment_type = rng.choice(TREATMENT_TYPES)
+
+        # Updates move a treatment along while keeping its identity and start
+        version_rng = random.Random(self.seed * 7_919 + treatment_id * 31 + self.version)
+        outcome_status = version_rng.choice(OUTCOME_STATUSES)
+        cost = round(version_rng.uniform(100, 50000), 2)
+
+        treatment = {
+            "id": number(treatment_id),
+            "start_date": string(start_date.strftime(TIMESTAMP_FORMAT)),
+            "outcome_status": string(outcome_status),
+            "duration_in_days": number(duration_in_days),
+            "cost": number(cost),
+            "type": string(treatment_type),
+        }
+        if outcome_status != "Ongoing":
+            completion_date = start_date + timedelta(days=duration_in_days, seconds=rng.randrange(86400))
+            outcome_date = completion_date + timedelta(days=rng.randint(0, 14))
+            treatment["completion_date"] = string(completion_date.strftime(TIMESTAMP_FORMAT))
+            treatment["outcome_date"] = string(outcome_date.strftime(TIMESTAMP_FORMAT))
+
+        provider_id = rng.randint(1, entities["providers"])
+        location_id = rng.randint(1, entities["locations"])
+        patient_id = rng.randint(1, entities["patients"])
+        disease_id = rng.randint(1, entities["diseases"])
+        provider_speciality_id = provider_id % entities["specialities"] + 1
+        disease_speciality_id = disease_id % entities["specialities"] + 1
+
+        return {
+            "treatment_id_partition_key": number(treatment_id),
+            "treatment": {"M": treatment},
+            "provider": {"M": {
+                "id": number(provider_id),
+                "full_name": string(f"Provider {provider_id}"),
+                "speciality_id": number(provider_speciality_id),
+                "speciality_name": string(f"Speciality {provider_speciality_id}"),
+                "affiliated_hospital": string(f"Hospital {provider_id % 97}"),
+            }},
+            "location": {"M": {
+                "id": number(location_id),
+                "country": string(COUNTRIES[location_id % len(COUNTRIES)]),
+                "state": string(f"State {location_id % 50}"),
+                "city": string(f"City {location_id}"),
+            }},
+            "patient": {"M": {
+                "id": number(patient_id),
+                "full_name": string(f"Patient {patient_id}"),
+                "gender": string(GENDERS[patient_id % len(GENDERS)]),
+                "age": number(patient_id % 90 + 1),
+            }},
+            "disease": {"M": {
+                "id": number(disease_id),
+                "speciality_id": number(disease_speciality_id),
+                "name": string(f"Disease {disease_id}"),
+                "type": string(f"Type {disease_id % 12}"),
+                "severity": string(SEVERITIES[disease_id % len(SEVERITIES)]),
+                "transmission_mode": string(TRANSMISSION_MODES[disease_id % len(TRANSMISSION_MODES)]),
+                "mortality_rate": number(round(disease_id % 500 / 10, 2)),
+            }},
+            "metadata": {"M": {
+                "added_at": string(self.added_at),
+                "modified_at": string(self.modified_at),
+            }},
+        }
+
+    def items(self, first_id=1, last_id=None):
+        """Yields the items with ids from first_id to last_id (inclusive)"""
+        for treatment_id in range(first_id, (last_id or self.row_count) + 1):
+            yield self.item(treatment_id)
+
+
+def attribute_value(attribute):
+    """Unwraps a scalar DynamoDB attribute ({"S": ...} or {"N": ...})"""
+    if "S" in attribute:
+        return attribute["S"]
+    if "N" in attribute:
+        return attribute["N"]
+    return None
+
+
+def silver_row(item):
+    """
+    Flattens a DynamoDB item into the Silver row the Databricks transformation produces.
+
+    Column names follow `DataTransformer.structure` (`<struct>_<field>`), values are cast as
+    in `cast_column_types_and_format`, and the treatment type/outcome status id is added.
+    """
+    row = {}
+    for struct_name, attribute in item.items():
+        if "M" not in attribute:
+            continue
+        for field, value in attribute["M"].items():
+            row[f"{struct_name}_{field}"] = attribute_value(value)
+
+    for column in ["treatment_completion_date", "treatment_outcome_date"]:
+        row.setdefault(column, None)
+
+    for column in [
+        "treatment_id", "treatment_duration_in_days", "provider_id", "provider_speciality_id",
+        "location_id", "patient_id", "patient_age", "disease_id", "disease_speciality_id",
+    ]:
+        row[column] = int(row[column])
+    for column in ["treatment_cost", "disease_mortality_rate"]:
+        row[column] = float(row[column])
+
+    row["treatment_type_and_outcome_status_id"] = TREATMENT_TYPE_AND_OUTCOME_STATUS_IDS[
+        f"{row['treatment_type']}_{row['treatment_outcome_status']}"
+    ]
+    return row
@@ -0,0 +1,148 @@
+import io
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+
+import boto3
+
+# Serves the gold summaries to dashboards from the snapshots PublishGoldSnapshotsLambda
+# writes, so reads never reach the Redshift cluster. The index is revalidated with its ETag
+# (If-None-Match) at most every `revalidate_seconds`. Snapshot files are never overwritten,
+# so once fetched they are served from memory (LRU) or the disk cache without asking S3.
+
+NOT_MODIFIED_CODES = ("304", "NotModified")
+
+
+def arrow_type(column):
+    """The pyarrow type of a Redshift column from the index"""
+    import pyarrow as pa
+
+    types = {
+        "int2": pa.int16(),
+        "int4": pa.int32(),
+        "int8": pa.int64(),
+        "float4": pa.float32(),
+        "float8": pa.float64(),
+        "bool": pa.bool_(),
+        "date": pa.date32(),
+        "timestamp": pa.timestamp("us"),
+        "timestamptz": pa.timestamp("us", tz="UTC"),
+    }
+    if column["type"] == "numeric":
+        return pa.decimal128(column["precision"] or 18, column["scale"] or 0)
+    return types.get(column["type"], pa.string())
+
+
+def read_parquet(bodies, columns):
+    """Default decoder: the snapshot's Parquet files as one pyarrow Table"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # An empty summary UNLOADs no files, so its table is built from the index's columns
+    if not bodies:
+        return pa.schema([(column["name"], arrow_type(column)) for column in columns]).empty_table()
+    return pa.concat_tables([pq.read_table(io.BytesIO(body)) for body in bodies])
+
+
+class GoldSnapshotReader:
+    """Reads the latest snapshot of each gold summary through a memory and disk cache"""
+
+    def __init__(
+        self,
+        bucket,
+        prefix="gold-snapshots/",
+        cache_dir=None,
+        max_cached_tables=16,
+        revalidate_seconds=30,
+        s3_client=None,
+        decode=read_parquet,
+    ):
+        self.bucket = bucket
+        self.index_key = f"{prefix}index.json"
+        self.cache_dir = cache_dir
+        self.max_cached_tables = max_cached_tables
+        self.revalidate_seconds = revalidate_seconds
+        self.s3_client = s3_client or boto3.client("s3")
+        self.decode = decode
+
+        self._index = None
+        self._index_etag = None
+        self._index_checked_at = None
+        self._tables = OrderedDict()  # content hash -> decoded snapshot, least recently used first
+        self._lock = threading.Lock()
+        self.stats = {"index_fetches": 0, "index_not_modified": 0, "memory_hits": 0, "disk_hits": 0, "downloads": 0}
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def index(self):
+        """Returns the current index, revalidating the cached copy once it is older than revalidate_seconds"""
+        with self._lock:
+            if self._index is not None and time.monotonic() - self._index_checked_at < self.revalidate_seconds:
+                return self._index
+
+            request = {"Bucket": self.bucket, "Key": self.index_key}
+            if self._index_etag:
+                request["IfNoneMatch"] = self._index_etag
+
+            try:
+                response = self.s3_client.get_object(**request)
+                self._index = json.loads(response["Body"].read())
+                self._index_etag = response["ETag"]
+                self.stats["index_fetches"] += 1
+            except Exception as e:
+                if getattr(e, "response", {}).get("Error", {}).get("Code") not in NOT_MODIFIED_CODES:
+                    raise
+                self.stats["index_not_modified"] += 1
+
+            self._index_checked_at = time.monotonic()
+            return self._index
+
+    def read_table(self, table):
+        """Returns the latest snapshot of a summary (e.g. "gold.provider_treatment_rank"), decoded"""
+        snapshot = self.index()["tables"][table]
+        content_hash = snapshot["content_hash"]
+
+        with self._lock:
+            if content_hash in self._tables:
+                self._tables.move_to_end(content_hash)
+                self.stats["memory_hits"] += 1
+                return self._tables[content_hash]
+
+        decoded = self.decode(self._snapshot_bodies(snapshot), snapshot["columns"])
+
+        with self._lock:
+            self._tables[content_hash] = decoded
+            self._tables.move_to_end(content_hash)
+            while len(self._tables) > self.max_cached_tables:
+                self._tables.popitem(last=False)
+        return decoded
+
+    def _snapshot_bodies(self, snapshot):
+        """Loads a snapshot's files from the disk cache or S3, checking them against the index's ETags"""
+        cache_path = None
+        if self.cache_dir:
+            cache_path = os.path.join(self.cache_dir, snapshot["content_hash"].replace(":", "_"))
+            if os.path.exists(cache_path):
+                with open(cache_path, "rb") as cached:
+                    bodies = [cached.read(file["size"]) for file in snapshot["files"]]
+                self.stats["disk_hits"] += 1
+                return bodies
+
+        bodies = []
+        for file in snapshot["files"]:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=file["key"])
+            if response["ETag"] != file["etag"]:
+                raise ValueError(f"Snapshot {snapshot['version']} file {file['key']} does not match its ETag")
+            bodies.append(response["Body"].read())
+        self.stats["downloads"] += 1
+
+        if cache_path:
+            # Files are concatenated in index order; their sizes split them again
+            with open(f"{cache_path}.tmp", "wb") as cached:
+                for body in bodies:
+                    cached.write(body)
+            os.replace(f"{cache_path}.tmp", cache_path)
+        return bodies
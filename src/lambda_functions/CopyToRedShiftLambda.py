@@ -3,186 +3,285 @@ import boto3
 import os
 import logging
 import time
+import uuid
+
+from pipeline_tracing import TRACKER_SPAN_COLUMNS, Span, emit_spans, pipeline_run_id_from_key, sql_values
+from redshift_statement_waiter import wait_for_statement
 
 # Initialize Logger
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+SILVER_PREFIX = "silver-layer/"
+SILVER_MANIFEST_PREFIX = f"{SILVER_PREFIX}_manifests/"
+
+# Load manifests live outside silver-layer/ so writing them does not re-trigger the pipeline
+LOAD_MANIFEST_PREFIX = "redshift-manifests/"
+
+# Stamped on every row a COPY appends; Gold loads cut their windows by it (see
+# silver.sp_resolve_watermarks). It is the table's last column and not in the Silver files.
+LOAD_TIME_COLUMN = "silver_loaded_at"
+
+# Data API statements are capped at 100 KB, so key lookups and tracking inserts are chunked
+KEYS_PER_STATEMENT = 500
+MAX_FILES_PER_COPY = int(os.environ.get("MAX_FILES_PER_COPY", "5000"))
+
+
+def resolve_batch_files(s3_client, s3_bucket, s3_keys):
+    """
+    Expands Silver batch manifests into their data files and keeps plain Silver Parquet keys.
+
+    Returns the de-duplicated files with their sizes, and the expected row count when every
+    key came from a manifest that records one.
+    """
+    files = {}
+    source_count = 0
+
+    for key in s3_keys:
+        if key.startswith(SILVER_MANIFEST_PREFIX) and key.endswith(".manifest"):
+            manifest_object = s3_client.get_object(Bucket=s3_bucket, Key=key)
+            manifest = json.loads(manifest_object["Body"].read())
+
+            record_count = manifest_object.get("Metadata", {}).get("record-count")
+            if source_count is not None and record_count is not None:
+                source_count += int(record_count)
+            else:
+                source_count = None
+
+            for entry in manifest.get("entries", []):
+                file_key = entry["url"].split(f"s3://{s3_bucket}/", 1)[-1]
+                files[file_key] = entry["meta"]["content_length"]
+
+        elif key.endswith(".parquet") and key.startswith(SILVER_PREFIX):
+            # Parquet manifests need each file's size
+            files[key] = s3_client.head_object(Bucket=s3_bucket, Key=key)["ContentLength"]
+            source_count = None
+
+        else:
+            logger.info(f"Skipping {key} because it is not a Silver Parquet file or batch manifest.")
+
+    return files, source_count
+
+
+def fetch_loaded_keys(redshift_data, redshift_params, table, keys):
+    """Returns the subset of keys already loaded into the table according to gold.etl_loaded_files"""
+    loaded_keys = set()
+
+    for start in range(0, len(keys), KEYS_PER_STATEMENT):
+        key_list = ", ".join(f"'{key}'" for key in keys[start : start + KEYS_PER_STATEMENT])
+        response = redshift_data.execute_statement(
+            **redshift_params,
+            Sql=f"SELECT s3_key FROM gold.etl_loaded_files WHERE destination_table = '{table}' AND s3_key IN ({key_list});",
+        )
+
+        status = wait_for_statement(redshift_data, response["Id"])
+        if status["Status"] != "FINISHED":
+            raise Exception(
+                f"Loaded file lookup failed with status {status['Status']}: {status.get('Error')}"
+            )
+
+        result_kwargs = {"Id": response["Id"]}
+        while True:
+            result = redshift_data.get_statement_result(**result_kwargs)
+            loaded_keys.update(record[0]["stringValue"] for record in result["Records"])
+            if "NextToken" not in result:
+                break
+            result_kwargs["NextToken"] = result["NextToken"]
+
+    return loaded_keys
+
+
+def tracker_span_sql(span):
+    """Column list and values of the span columns of the load's gold.etl_tracker row"""
+    return ", ".join(TRACKER_SPAN_COLUMNS), sql_values(span.tracker_values())
+
 
 def lambda_handler(event, context):
+    span = Span(
+        event.get("pipeline_run_id") or pipeline_run_id_from_key(event.get("s3_key") or ""),
+        "copy_to_redshift",
+    )
+
+    # Environment variables for Redshift parameters, bound before the try so the failure
+    # path can always record the load
+    cluster_id = os.environ["REDSHIFT_CLUSTER_ID"]
+    database = os.environ["REDSHIFT_DB"]
+    db_user = os.environ["DB_USER"]
+    table = os.environ["TABLE"]  # e.g., tbl_healthcare_analytics_data
+    iam_role = os.environ["REDSHIFT_ROLE"]  # IAM role with S3 access
+
+    redshift_data = boto3.client("redshift-data")
+    redshift_params = {
+        "ClusterIdentifier": cluster_id,
+        "Database": database,
+        "DbUser": db_user,
+    }
+
     try:
         # Log received event
         logger.info(f"Received Event: {json.dumps(event, indent=2)}")
 
-        # Extract S3 event details
+        # Extract S3 event details (a batch of keys, or the single key of the triggering event)
         s3_bucket = event["s3_bucket"]
-        s3_key = event["s3_key"]
-
-        logger.info(f"Processing file from bucket: {s3_bucket}, key: {s3_key}")
-
-        # Only process .parquet files
-        if not s3_key.endswith(".parquet"):
-            logger.info(f"Skipping non-parquet file: {s3_key}")
-            return {"status": "skipped"}
+        s3_keys = event.get("s3_keys") or [event["s3_key"]]
 
-        # Ensure the file is in the 'silver-layer/' prefix
-        silver_prefix = "silver-layer/"
-        if not s3_key.startswith(silver_prefix):
-            logger.info(
-                f"Skipping file {s3_key} because it is not under the {silver_prefix} prefix."
-            )
-            return {"status": "skipped"}
+        logger.info(f"Processing {len(s3_keys)} key(s) from bucket: {s3_bucket}")
 
-        # List objects in the silver-layer/ prefix
         s3_client = boto3.client("s3")
-        list_response = s3_client.list_objects_v2(
-            Bucket=s3_bucket, Prefix=silver_prefix
+
+        # **Step 1: Resolve the Batch and Drop Files That Were Already Loaded**
+        batch_files, source_count = resolve_batch_files(s3_client, s3_bucket, s3_keys)
+        loaded_keys = fetch_loaded_keys(
+            redshift_data, redshift_params, table, list(batch_files)
         )
+        new_files = [
+            (key, size) for key, size in batch_files.items() if key not in loaded_keys
+        ]
 
-        if "Contents" not in list_response or len(list_response["Contents"]) == 0:
-            logger.info("No objects found under the silver-layer/ prefix.")
+        if not new_files:
+            logger.info("Every file in the batch has already been loaded.")
+            emit_spans([span.finish("SKIPPED")])
             return {"status": "skipped"}
 
-        # Find the latest object by the LastModified attribute
-        latest_object = max(
-            list_response["Contents"], key=lambda obj: obj["LastModified"]
-        )
-        if latest_object["Key"] != s3_key:
-            logger.info(
-                f"Skipping file {s3_key} because it is not the latest. Latest file is: {latest_object['Key']}"
-            )
-            return {"status": "skipped"}
+        if loaded_keys:
+            logger.info(f"Skipping {len(loaded_keys)} file(s) that were already loaded.")
+            source_count = None  # The manifest counts include the skipped files
 
-        # Environment variables for Redshift parameters
-        cluster_id = os.environ["REDSHIFT_CLUSTER_ID"]
-        database = os.environ["REDSHIFT_DB"]
-        db_user = os.environ["DB_USER"]
-        table = os.environ["TABLE"]  # e.g., tbl_healthcare_analytics_data
-        iam_role = os.environ["REDSHIFT_ROLE"]  # IAM role with S3 access
-
-        # **Step 1: Get Source Count Before Loading**
-        source_count_query = f"SELECT COUNT(*) FROM staging.{table};"
-        redshift_data = boto3.client("redshift-data")
-
-        source_count = None
-        destination_count = None
-
-        # **Step 2: Insert Tracking Record (ETL Start)**
-        start_time = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
-        insert_start_query = f"""
-            INSERT INTO gold.etl_tracker (source_layer, destination_layer, source_table, destination_table, status, completion_timestamp, source_count)
-            VALUES ('staging', 'silver', '{table}', '{table}', 'STARTED', '{start_time}', {source_count if source_count is not None else 'NULL'});
-        """
+        statement_timings = []
+        span.bytes_scanned = sum(size for _, size in new_files)
 
-        try:
-            redshift_data.execute_statement(
-                ClusterIdentifier=cluster_id,
-                Database=database,
-                DbUser=db_user,
-                Sql=insert_start_query,
+        # **Step 2: COPY Each Chunk of the Batch Through a Generated Manifest**
+        # One COPY per manifest lets every slice load files in parallel. The files lack the
+        # load time, so the COPY lands in a session-local stage shaped like the table without
+        # it, and the rows are appended stamped with the transaction's start time. The COPY,
+        # the append and the loaded-file records share a transaction, so a rerun never loads a
+        # file twice. pg_last_copy_count() reads the rows the COPY loaded in the same session,
+        # so the destination count comes for free instead of from a COUNT(*) over the table.
+        copy_query_ids = []
+        destination_count = 0
+        for start in range(0, len(new_files), MAX_FILES_PER_COPY):
+            chunk = new_files[start : start + MAX_FILES_PER_COPY]
+            load_id = f"{time.strftime('%Y%m%d_%H%M%S', time.gmtime())}_{uuid.uuid4().hex[:8]}"
+            manifest_key = f"{LOAD_MANIFEST_PREFIX}{load_id}.manifest"
+
+            manifest = {
+                "entries": [
+                    {
+                        "url": f"s3://{s3_bucket}/{key}",
+                        "mandatory": True,
+                        "meta": {"content_length": size},
+                    }
+                    for key, size in chunk
+                ]
+            }
+            s3_client.put_object(
+                Bucket=s3_bucket,
+                Key=manifest_key,
+                Body=json.dumps(manifest).encode("utf-8"),
+                ContentType="application/json",
             )
-        except Exception as e:
-            logger.error(f"Error inserting ETL tracking record: {str(e)}")
 
-        # **Step 3: Execute COPY Command to Load Data into Silver**
-        copy_sql = f"""
-            COPY {table}
-            FROM 's3://{s3_bucket}/{s3_key}'
-            IAM_ROLE '{iam_role}'
-            FORMAT AS PARQUET;
-        """
+            copy_sqls = [
+                f"CREATE TEMP TABLE silver_copy_stage (LIKE {table});",
+                f"ALTER TABLE silver_copy_stage DROP COLUMN {LOAD_TIME_COLUMN};",
+                f"""
+                    COPY silver_copy_stage
+                    FROM 's3://{s3_bucket}/{manifest_key}'
+                    IAM_ROLE '{iam_role}'
+                    FORMAT AS PARQUET
+                    MANIFEST;
+                """,
+                "SELECT pg_last_copy_count();",
+                f"INSERT INTO {table} SELECT *, SYSDATE FROM silver_copy_stage;",
+            ]
 
-        try:
-            copy_response = redshift_data.execute_statement(
-                ClusterIdentifier=cluster_id,
-                Database=database,
-                DbUser=db_user,
-                Sql=copy_sql,
-            )
-            copy_query_id = copy_response["Id"]
-            logger.info(f"Redshift COPY initiated, statement id: {copy_query_id}")
-        except Exception as e:
-            logger.error(f"Error executing COPY: {str(e)}")
-            raise e
+            tracking_sqls = []
+            for tracking_start in range(0, len(chunk), KEYS_PER_STATEMENT):
+                values = ", ".join(
+                    f"('{key}', '{load_id}', '{table}')"
+                    for key, _ in chunk[tracking_start : tracking_start + KEYS_PER_STATEMENT]
+                )
+                tracking_sqls.append(
+                    f"INSERT INTO gold.etl_loaded_files (s3_key, load_id, destination_table) VALUES {values};"
+                )
 
-        # **Step 4: Wait for Copy Completion**
-        time.sleep(10)  # Wait for Redshift COPY to process
-        copy_status_response = redshift_data.describe_statement(Id=copy_query_id)
+            try:
+                copy_response = redshift_data.batch_execute_statement(
+                    **redshift_params,
+                    Sqls=copy_sqls + tracking_sqls,
+                )
+                copy_query_id = copy_response["Id"]
+                logger.info(
+                    f"Redshift COPY of {len(chunk)} file(s) initiated, statement id: {copy_query_id}"
+                )
+            except Exception as e:
+                logger.error(f"Error executing COPY: {str(e)}")
+                raise e
 
-        if copy_status_response["Status"] != "FINISHED":
-            raise Exception(
-                f"COPY operation failed with status {copy_status_response['Status']}"
-            )
+            # **Step 3: Wait for Copy Completion**
+            copy_status_response = wait_for_statement(redshift_data, copy_query_id)
 
-        # **Step 5: Get Destination Count After Loading**
-        destination_count_query = f"SELECT COUNT(*) FROM {table};"
+            if copy_status_response["Status"] != "FINISHED":
+                raise Exception(
+                    f"COPY operation failed with status {copy_status_response['Status']}: {copy_status_response.get('Error')}"
+                )
 
-        try:
-            dest_count_response = redshift_data.execute_statement(
-                ClusterIdentifier=cluster_id,
-                Database=database,
-                DbUser=db_user,
-                Sql=destination_count_query,
-            )
-            query_id = dest_count_response["Id"]
-            time.sleep(5)  # Wait for query execution
+            # Sub-statements of a batch are addressed as <batch id>:<position>, counted from 1
+            copy_count_position = copy_sqls.index("SELECT pg_last_copy_count();") + 1
+            copy_count_result = redshift_data.get_statement_result(Id=f"{copy_query_id}:{copy_count_position}")
+            destination_count += int(copy_count_result["Records"][0][0]["longValue"])
 
-            # Fetch the result
-            fetch_response = redshift_data.get_statement_result(Id=query_id)
-            destination_count = int(fetch_response["Records"][0][0]["longValue"])
-        except Exception as e:
-            logger.error(f"Error fetching destination count: {str(e)}")
-            destination_count = None  # Set to None if error occurs
+            copy_query_ids.append(copy_query_id)
+            statement_timings.append({"statement_id": copy_query_id, **copy_status_response["Timings"]})
+            span.add_statement(copy_status_response["Timings"])
 
-        # **Step 6: Update ETL Tracker with Completion Details**
-        end_time = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+        # **Step 4: Record the Load, Its Reconciliation and Its Span in One Statement**
+        span.add_rows(destination_count)
+        span.finish()
+        span_columns, span_values = tracker_span_sql(span)
         reconciliation_status = (
             "MATCH" if source_count == destination_count else "MISMATCH"
-        )
+        ) if source_count is not None else None
 
-        update_success_query = f"""
-            UPDATE gold.etl_tracker
-            SET status = 'SUCCESS', completion_timestamp = '{end_time}', 
-                destination_count = {destination_count if destination_count is not None else 'NULL'}, 
-                reconciliation_status = '{reconciliation_status}'
-            WHERE destination_table = '{table}' 
-                AND source_table = '{table}' 
-                AND status = 'STARTED';
+        insert_success_query = f"""
+            INSERT INTO gold.etl_tracker (source_layer, destination_layer, source_table, destination_table, status, source_count, destination_count, reconciliation_status, {span_columns})
+            VALUES ('staging', 'silver', '{table}', '{table}', 'SUCCESS',
+                {source_count if source_count is not None else 'NULL'}, {destination_count}, {f"'{reconciliation_status}'" if reconciliation_status else 'NULL'}, {span_values});
         """
 
         try:
-            redshift_data.execute_statement(
-                ClusterIdentifier=cluster_id,
-                Database=database,
-                DbUser=db_user,
-                Sql=update_success_query,
-            )
+            redshift_data.execute_statement(**redshift_params, Sql=insert_success_query)
         except Exception as e:
-            logger.error(f"Error updating ETL tracking record: {str(e)}")
+            logger.error(f"Error inserting ETL tracking record: {str(e)}")
+        emit_spans([span])
 
-        return {"status": "success", "statement_id": copy_query_id}
+        return {
+            "status": "success",
+            "statement_ids": copy_query_ids,
+            "files_loaded": len(new_files),
+            "rows_loaded": destination_count,
+            "statement_timings": statement_timings,
+            "pipeline_run_id": span.pipeline_run_id,
+        }
 
     except Exception as e:
         logger.error(f"Error in CopyToRedShiftLambda: {str(e)}")
-        error_time = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
-
-        # **Step 7: Mark ETL Tracker as Failed in Case of Error**
-        update_failure_query = f"""
-            UPDATE gold.etl_tracker
-            SET status = 'FAILED', completion_timestamp = '{error_time}'
-            WHERE destination_table = '{table}' 
-                AND source_table = '{table}' 
-                AND status = 'STARTED';
-        """
 
-        try:
-            redshift_data.execute_statement(
-                ClusterIdentifier=cluster_id,
-                Database=database,
-                DbUser=db_user,
-                Sql=update_failure_query,
-            )
-        except Exception as e:
-            logger.error(f"Error updating failure status in ETL tracker: {str(e)}")
+        # A failure after the load was recorded (e.g. while emitting its span) is not a failed load
+        if span.status == "RUNNING":
+            span.finish("FAILED", e)
+            span_columns, span_values = tracker_span_sql(span)
+            emit_spans([span])
+
+            # **Step 5: Record the Failed Load in the ETL Tracker**
+            insert_failure_query = f"""
+                INSERT INTO gold.etl_tracker (source_layer, destination_layer, source_table, destination_table, status, {span_columns})
+                VALUES ('staging', 'silver', '{table}', '{table}', 'FAILED', {span_values});
+            """
+
+            try:
+                redshift_data.execute_statement(**redshift_params, Sql=insert_failure_query)
+            except Exception as tracker_error:
+                logger.error(f"Error inserting failure record in ETL tracker: {str(tracker_error)}")
 
         return {"status": "error", "message": str(e)}
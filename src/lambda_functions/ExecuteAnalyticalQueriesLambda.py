@@ -1,7 +1,13 @@
 import os
 import json
 import boto3
-import time
+import logging
+
+from pipeline_tracing import TRACKER_SPAN_COLUMNS, Span, emit_spans, sql_values
+from redshift_statement_waiter import wait_for_statement
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
 
 # Initialize the Redshift Data API client
 client = boto3.client("redshift-data")
@@ -11,59 +17,213 @@ DATABASE = os.environ["REDSHIFT_DB"]
 DB_USER = os.environ["DB_USER"]
 CLUSTER_ID = os.environ["REDSHIFT_CLUSTER_ID"]
 
-# List of queries (DROP + CREATE + INSERT)
-ANALYTICAL_QUERIES = [
-    "DROP TABLE IF EXISTS gold.provider_treatment_rank; CREATE TABLE gold.provider_treatment_rank AS SELECT p.provider_sk AS provider_id, p.full_name AS provider_full_name, COUNT(f.fact_treatment_sk) AS total_treatments FROM gold.fact_treatments f JOIN gold.dim_providers p ON f.provider_sk = p.provider_sk GROUP BY p.provider_sk, p.full_names ORDER BY total_treatments DESC;",
-    "DROP TABLE IF EXISTS gold.provider_success_rate_rank; CREATE TABLE gold.provider_success_rate_rank AS SELECT p.provider_sk AS provider_id, p.full_name AS provider_full_name, COUNT(f.fact_treatment_sk) AS total_treatments, COUNT(CASE WHEN f.treatment_type_and_outcome_status_sk = 1 THEN 1 END) * 100.0 / COUNT(f.fact_treatment_sk) AS success_rate FROM gold.fact_treatments f JOIN gold.dim_providers p ON f.provider_sk = p.provider_sk GROUP BY p.provider_sk, p.full_name ORDER BY success_rate DESC;",
-    "DROP TABLE IF EXISTS gold.monthly_treatment_trends; CREATE TABLE gold.monthly_treatment_trends AS SELECT d.year, d.month, COUNT(f.fact_treatment_sk) AS total_treatments, COUNT(CASE WHEN f.treatment_type_and_outcome_status_sk = 1 THEN 1 END) * 100.0 / COUNT(f.fact_treatment_sk) AS success_rate FROM gold.fact_treatments f JOIN gold.dim_dates d ON f.start_date_sk = d.date_sk GROUP BY d.year, d.month ORDER BY d.year DESC, d.month DESC;",
-    "DROP TABLE IF EXISTS gold.geographical_treatment_distribution; CREATE TABLE gold.geographical_treatment_distribution AS SELECT l.country, l.state, l.city, COUNT(f.fact_treatment_sk) AS total_treatments FROM gold.fact_treatments f JOIN gold.dim_locations l ON f.location_sk = l.location_sk GROUP BY l.country, l.state, l.city ORDER BY total_treatments DESC;",
-    "DROP TABLE IF EXISTS gold.summary_avg_treatment_cost; CREATE TABLE gold.summary_avg_treatment_cost AS SELECT p.provider_sk AS provider_id, p.full_name AS provider_full_name, AVG(f.cost) AS avg_treatment_cost FROM gold.fact_treatments f JOIN gold.dim_providers p ON f.provider_sk = p.provider_sk GROUP BY p.provider_sk, p.full_name;",
-    "DROP TABLE IF EXISTS gold.summary_total_treatments_per_city; CREATE TABLE gold.summary_total_treatments_per_city AS SELECT l.city, COUNT(f.fact_treatment_sk) AS total_treatments FROM gold.fact_treatments f JOIN gold.dim_locations l ON f.location_sk = l.location_sk GROUP BY l.city ORDER BY total_treatments DESC;",
-    "DROP TABLE IF EXISTS gold.summary_provider_success_rates; CREATE TABLE gold.summary_provider_success_rates AS SELECT p.provider_sk AS provider_id, p.full_name AS provider_full_name, COUNT(f.fact_treatment_sk) AS total_treatments, COUNT(CASE WHEN f.treatment_type_and_outcome_status_sk = 1 THEN 1 END) * 100.0 / COUNT(f.fact_treatment_sk) AS success_rate FROM gold.fact_treatments f JOIN gold.dim_providers p ON f.provider_sk = p.provider_sk GROUP BY p.provider_sk, p.full_name;",
+# "incremental" folds only the fact delta into the summary state; "full" rescans the fact table
+REFRESH_MODE = os.environ.get("REFRESH_MODE", "incremental")
+
+# Summaries are built under this suffix and renamed over the live table once complete
+SHADOW_SUFFIX = "__shadow"
+
+# Summaries grouped by the join they aggregate. Each group runs as one batch (one session and
+# one transaction): the shared scan aggregates the join once into a temp table, every summary
+# of the group is built from it into a shadow table, and all shadows are swapped in together.
+# Groups are independent, so their batches run concurrently.
+REFRESH_GROUPS = [
+    {
+        "name": "providers",
+        "shared_scan": "CREATE TEMP TABLE provider_stats AS SELECT p.provider_sk, p.full_name, COUNT(f.fact_treatment_sk) AS total_treatments, COUNT(CASE WHEN f.treatment_type_and_outcome_status_sk = 1 THEN 1 END) AS successful_treatments, SUM(f.cost) AS total_cost, COUNT(f.cost) AS costed_treatments FROM gold.fact_treatments f JOIN gold.dim_providers p ON f.provider_sk = p.provider_sk GROUP BY p.provider_sk, p.full_name;",
+        "summaries": {
+            "gold.provider_treatment_rank": "SELECT provider_sk AS provider_id, full_name AS provider_full_name, total_treatments FROM provider_stats ORDER BY total_treatments DESC",
+            "gold.provider_success_rate_rank": "SELECT provider_sk AS provider_id, full_name AS provider_full_name, total_treatments, successful_treatments * 100.0 / total_treatments AS success_rate FROM provider_stats ORDER BY success_rate DESC",
+            "gold.summary_avg_treatment_cost": "SELECT provider_sk AS provider_id, full_name AS provider_full_name, total_cost / NULLIF(costed_treatments, 0) AS avg_treatment_cost FROM provider_stats",
+            "gold.summary_provider_success_rates": "SELECT provider_sk AS provider_id, full_name AS provider_full_name, total_treatments, successful_treatments * 100.0 / total_treatments AS success_rate FROM provider_stats",
+        },
+    },
+    {
+        "name": "locations",
+        "shared_scan": "CREATE TEMP TABLE location_stats AS SELECT l.country, l.state, l.city, COUNT(f.fact_treatment_sk) AS total_treatments FROM gold.fact_treatments f JOIN gold.dim_locations l ON f.location_sk = l.location_sk GROUP BY l.country, l.state, l.city;",
+        "summaries": {
+            "gold.geographical_treatment_distribution": "SELECT country, state, city, total_treatments FROM location_stats ORDER BY total_treatments DESC",
+            "gold.summary_total_treatments_per_city": "SELECT city, SUM(total_treatments) AS total_treatments FROM location_stats GROUP BY city ORDER BY total_treatments DESC",
+        },
+    },
+    {
+        "name": "dates",
+        "shared_scan": None,
+        "summaries": {
+            "gold.monthly_treatment_trends": "SELECT d.year, d.month, COUNT(f.fact_treatment_sk) AS total_treatments, COUNT(CASE WHEN f.treatment_type_and_outcome_status_sk = 1 THEN 1 END) * 100.0 / COUNT(f.fact_treatment_sk) AS success_rate FROM gold.fact_treatments f JOIN gold.dim_dates d ON f.start_date_sk = d.date_sk GROUP BY d.year, d.month ORDER BY d.year DESC, d.month DESC",
+        },
+    },
+]
+
+
+# Incremental mode first applies the fact delta to the additive state tables with one CALL,
+# then rebuilds every summary from them. The state holds one row per group, so the rebuilds
+# cost next to nothing and the whole refresh scales with the delta rather than with the fact
+# history. The CALL must commit before any rebuild reads the state.
+SUMMARY_STATE_REFRESH = "CALL silver.sp_apply_summary_state_delta();"
+
+INCREMENTAL_SUMMARIES = {
+    "gold.provider_treatment_rank": "SELECT s.provider_sk AS provider_id, p.full_name AS provider_full_name, s.total_treatments FROM gold.summary_state_providers s JOIN gold.dim_providers p ON s.provider_sk = p.provider_sk ORDER BY total_treatments DESC",
+    "gold.provider_success_rate_rank": "SELECT s.provider_sk AS provider_id, p.full_name AS provider_full_name, s.total_treatments, s.successful_treatments * 100.0 / s.total_treatments AS success_rate FROM gold.summary_state_providers s JOIN gold.dim_providers p ON s.provider_sk = p.provider_sk ORDER BY success_rate DESC",
+    "gold.summary_avg_treatment_cost": "SELECT s.provider_sk AS provider_id, p.full_name AS provider_full_name, s.total_cost / NULLIF(s.costed_treatments, 0) AS avg_treatment_cost FROM gold.summary_state_providers s JOIN gold.dim_providers p ON s.provider_sk = p.provider_sk",
+    "gold.summary_provider_success_rates": "SELECT s.provider_sk AS provider_id, p.full_name AS provider_full_name, s.total_treatments, s.successful_treatments * 100.0 / s.total_treatments AS success_rate FROM gold.summary_state_providers s JOIN gold.dim_providers p ON s.provider_sk = p.provider_sk",
+    "gold.geographical_treatment_distribution": "SELECT l.country, l.state, l.city, SUM(s.total_treatments) AS total_treatments FROM gold.summary_state_locations s JOIN gold.dim_locations l ON s.location_sk = l.location_sk GROUP BY l.country, l.state, l.city ORDER BY total_treatments DESC",
+    "gold.summary_total_treatments_per_city": "SELECT l.city, SUM(s.total_treatments) AS total_treatments FROM gold.summary_state_locations s JOIN gold.dim_locations l ON s.location_sk = l.location_sk GROUP BY l.city ORDER BY total_treatments DESC",
+    "gold.monthly_treatment_trends": "SELECT d.year, d.month, SUM(s.total_treatments) AS total_treatments, SUM(s.successful_treatments) * 100.0 / SUM(s.total_treatments) AS success_rate FROM gold.summary_state_dates s JOIN gold.dim_dates d ON s.start_date_sk = d.date_sk GROUP BY d.year, d.month ORDER BY d.year DESC, d.month DESC",
+}
+
+# Each summary is rebuilt in its own group, so the rebuilds run concurrently like the full refresh
+INCREMENTAL_REFRESH_GROUPS = [
+    {"name": table.split(".")[-1], "shared_scan": None, "summaries": {table: select}}
+    for table, select in INCREMENTAL_SUMMARIES.items()
 ]
 
 
-def execute_query(query):
-    """Execute a single SQL query using the Redshift Data API."""
-    response = client.execute_statement(
-        ClusterIdentifier=CLUSTER_ID, Database=DATABASE, DbUser=DB_USER, Sql=query
+def build_refresh_batch(group):
+    """
+    Builds the statements of a refresh group and labels each one with what it refreshes.
+
+    Shadow tables are swapped in at the very end, so dashboards keep reading the previous
+    tables until the whole group commits and never see a dropped table.
+    """
+    sqls = []
+    labels = []
+
+    if group["shared_scan"]:
+        sqls.append(group["shared_scan"])
+        labels.append(f"{group['name']}:shared_scan")
+
+    for table, select in group["summaries"].items():
+        shadow_table = f"{table}{SHADOW_SUFFIX}"
+        sqls += [
+            f"DROP TABLE IF EXISTS {shadow_table};",
+            f"CREATE TABLE {shadow_table} AS {select};",
+        ]
+        labels += [table, table]
+
+    for table in group["summaries"]:
+        table_name = table.split(".")[-1]
+        sqls += [
+            f"DROP TABLE IF EXISTS {table};",
+            f"ALTER TABLE {table}{SHADOW_SUFFIX} RENAME TO {table_name};",
+        ]
+        labels += [table, table]
+
+    return sqls, labels
+
+
+def execute_batch(sqls):
+    """Submits statements as a single Redshift Data API batch (one transaction) without waiting."""
+    response = client.batch_execute_statement(
+        ClusterIdentifier=CLUSTER_ID, Database=DATABASE, DbUser=DB_USER, Sqls=sqls
     )
-    return response["Id"]  # Query execution ID
+    return response["Id"]  # Batch execution ID
+
 
+def summarize_batch(result, labels):
+    """Adds up the execution time of each label's sub-statements (in seconds)."""
+    timings = {}
+    for sub_statement, label in zip(result.get("SubStatements", []), labels):
+        duration_ns = sub_statement.get("Duration", -1)
+        if duration_ns >= 0:
+            timings[label] = round(timings.get(label, 0.0) + duration_ns / 1e9, 3)
+    return timings
 
-def check_query_status(query_id):
-    """Check the status of a Redshift Data API query execution."""
-    while True:
-        response = client.describe_statement(Id=query_id)
-        status = response["Status"]
 
-        if status in ["FAILED", "FINISHED", "ABORTED"]:
-            return response  # Return full response if finished
-        time.sleep(2)  # Wait before checking again
+def write_tracker_spans(spans):
+    """Records the refresh's spans in gold.etl_tracker with one INSERT, without waiting for it"""
+    rows = []
+    for span in spans:
+        values = ["gold", "gold", "gold.fact_treatments", "gold.analytical_tables", span.status] + span.tracker_values()
+        rows.append(f"({sql_values(values)})")
+
+    try:
+        client.execute_statement(
+            ClusterIdentifier=CLUSTER_ID,
+            Database=DATABASE,
+            DbUser=DB_USER,
+            Sql=f"INSERT INTO gold.etl_tracker (source_layer, destination_layer, source_table, destination_table, status, {', '.join(TRACKER_SPAN_COLUMNS)}) VALUES {', '.join(rows)};",
+        )
+    except Exception as e:
+        logger.error(f"Error writing ETL tracking records: {str(e)}")
 
 
 def lambda_handler(event, context):
-    """Lambda handler to execute Redshift analytical queries."""
+    """Lambda handler to refresh the Redshift analytical tables."""
     execution_results = []
+    pipeline_run_id = (event or {}).get("pipeline_run_id")
+    lambda_span = Span(pipeline_run_id, "analytical_refresh")
+    spans = []
+
+    refresh_groups = REFRESH_GROUPS
+    if REFRESH_MODE == "incremental":
+        refresh_groups = INCREMENTAL_REFRESH_GROUPS
+        # The rebuilds read the state tables, so the delta is applied before any group is submitted
+        state_span = Span(pipeline_run_id, "analytical_refresh:summary_state")
+        spans.append(state_span)
+        try:
+            result = wait_for_statement(client, execute_batch([SUMMARY_STATE_REFRESH]))
+            state_span.add_statement(result["Timings"])
+            lambda_span.add_concurrent_statement(result)
+            state_span.finish("SUCCESS" if result["Status"] == "FINISHED" else "FAILED", result.get("Error"))
+            execution_results.append(
+                {
+                    "group": "summary_state",
+                    "status": state_span.status,
+                    "error": result.get("Error"),
+                    "timings": result["Timings"],
+                }
+            )
+        except Exception as e:
+            state_span.finish("FAILED", e)
+            execution_results.append({"group": "summary_state", "status": "FAILED", "error": str(e)})
+
+        # Rebuilding from a state the delta did not reach would publish stale summaries
+        if state_span.status == "FAILED":
+            refresh_groups = []
+
+    # Submit every group up front so Redshift works on them concurrently
+    submitted = []
+    for group in refresh_groups:
+        sqls, labels = build_refresh_batch(group)
+        span = Span(pipeline_run_id, f"analytical_refresh:{group['name']}")
+        spans.append(span)
+        try:
+            submitted.append((group, labels, span, execute_batch(sqls)))
+        except Exception as e:
+            span.finish("FAILED", e)
+            execution_results.append(
+                {"group": group["name"], "status": "FAILED", "error": str(e)}
+            )
 
-    for query in ANALYTICAL_QUERIES:
+    for group, labels, span, batch_id in submitted:
         try:
-            query_id = execute_query(query)
-            result = check_query_status(query_id)
-
-            if result["Status"] == "FAILED":
-                execution_results.append(
-                    {
-                        "query_id": query_id,
-                        "status": "FAILED",
-                        "error": result.get("Error", "Unknown error"),
-                    }
-                )
-            else:
-                execution_results.append({"query_id": query_id, "status": "SUCCESS"})
+            result = wait_for_statement(client, batch_id)
+            query_timings = summarize_batch(result, labels)
+            span.add_statement(result["Timings"])
+            lambda_span.add_concurrent_statement(result)
+            span.finish("SUCCESS" if result["Status"] == "FINISHED" else "FAILED", result.get("Error"))
+
+            execution_results.append(
+                {
+                    "group": group["name"],
+                    "query_id": batch_id,
+                    "status": "SUCCESS" if result["Status"] == "FINISHED" else "FAILED",
+                    "error": result.get("Error"),
+                    "timings": result["Timings"],
+                    "query_timings": query_timings,
+                }
+            )
         except Exception as e:
+            span.finish("FAILED", e)
             execution_results.append(
-                {"query": query, "status": "FAILED", "error": str(e)}
+                {"group": group["name"], "query_id": batch_id, "status": "FAILED", "error": str(e)}
             )
 
-    return {"statusCode": 200, "body": json.dumps(execution_results)}
+    failed = [span.stage for span in spans if span.status == "FAILED"]
+    lambda_span.finish("FAILED" if failed else "SUCCESS", f"Failed groups: {failed}" if failed else None)
+    spans.append(lambda_span)
+    write_tracker_spans(spans)
+    emit_spans(spans)
+
+    return {"statusCode": 200, "body": json.dumps(execution_results), "pipeline_run_id": pipeline_run_id}
@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import uuid
+import boto3
+import hashlib
+import logging
+from datetime import datetime, timezone
+
+from pipeline_tracing import TRACKER_SPAN_COLUMNS, Span, emit_spans, sql_values
+from redshift_statement_waiter import wait_for_statement
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Initialize the Redshift Data API and S3 clients
+client = boto3.client("redshift-data")
+s3_client = boto3.client("s3")
+
+# Environment variables
+DATABASE = os.environ["REDSHIFT_DB"]
+DB_USER = os.environ["DB_USER"]
+CLUSTER_ID = os.environ["REDSHIFT_CLUSTER_ID"]
+IAM_ROLE = os.environ["REDSHIFT_ROLE"]  # IAM role with S3 write access
+SNAPSHOT_BUCKET = os.environ["SNAPSHOT_BUCKET"]
+SNAPSHOT_PREFIX = os.environ.get("SNAPSHOT_PREFIX", "gold-snapshots/")
+
+# Readers fetch this first; it names the current version of every summary. Versions are
+# never overwritten, so expire old ones with an S3 lifecycle rule on the prefix.
+INDEX_KEY = f"{SNAPSHOT_PREFIX}index.json"
+
+# The summaries ExecuteAnalyticalQueriesLambda rebuilds
+SUMMARY_TABLES = [
+    "gold.provider_treatment_rank",
+    "gold.provider_success_rate_rank",
+    "gold.summary_avg_treatment_cost",
+    "gold.summary_provider_success_rates",
+    "gold.geographical_treatment_distribution",
+    "gold.summary_total_treatments_per_city",
+    "gold.monthly_treatment_trends",
+]
+
+
+def snapshot_prefix(table, version):
+    return f"{SNAPSHOT_PREFIX}{table}/version={version}/"
+
+
+def build_unload_batch(version):
+    """
+    UNLOADs every summary into its version's prefix, each followed by its row count.
+
+    The batch runs in one transaction, so all snapshots of a version come from the same
+    committed state of the summaries. PARALLEL OFF keeps each snapshot to a single file.
+    """
+    sqls = []
+    for table in SUMMARY_TABLES:
+        sqls += [
+            f"""
+                UNLOAD ('SELECT * FROM {table}')
+                TO 's3://{SNAPSHOT_BUCKET}/{snapshot_prefix(table, version)}'
+                IAM_ROLE '{IAM_ROLE}'
+                FORMAT AS PARQUET
+                PARALLEL OFF;
+            """,
+            "SELECT pg_last_unload_count();",
+        ]
+    return sqls
+
+
+def table_columns(table):
+    """Reads a summary's column names and Redshift types, so readers can rebuild an empty snapshot"""
+    schema, name = table.split(".")
+    request = {"ClusterIdentifier": CLUSTER_ID, "Database": DATABASE, "DbUser": DB_USER, "Schema": schema, "Table": name}
+    columns = []
+    while True:
+        response = client.describe_table(**request)
+        columns += [
+            {"name": column["name"], "type": column["typeName"], "precision": column.get("precision"), "scale": column.get("scale")}
+            for column in response["ColumnList"]
+        ]
+        if not response.get("NextToken"):
+            return columns
+        request["NextToken"] = response["NextToken"]
+
+
+def describe_snapshot(table, version, row_count):
+    """
+    Lists a snapshot's files and hashes their keys and ETags in key order.
+
+    Snapshot files are written once and never overwritten, so their ETags identify their
+    content without downloading them.
+    """
+    files = []
+    content_hash = hashlib.sha256()
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=SNAPSHOT_BUCKET, Prefix=snapshot_prefix(table, version)):
+        for s3_object in page.get("Contents", []):
+            content_hash.update(f"{s3_object['Key']}\n{s3_object['ETag']}\n".encode("utf-8"))
+            files.append({"key": s3_object["Key"], "size": s3_object["Size"], "etag": s3_object["ETag"]})
+
+    return {
+        "version": version,
+        "files": files,
+        "columns": table_columns(table),
+        "row_count": row_count,
+        "bytes": sum(file["size"] for file in files),
+        "content_hash": f"etag-sha256:{content_hash.hexdigest()}",
+    }
+
+
+def write_tracker_span(span):
+    """Records the publish span in gold.etl_tracker without waiting for it"""
+    values = ["gold", "snapshot", "gold.analytical_tables", f"s3://{SNAPSHOT_BUCKET}/{INDEX_KEY}", span.status] + span.tracker_values()
+    try:
+        client.execute_statement(
+            ClusterIdentifier=CLUSTER_ID,
+            Database=DATABASE,
+            DbUser=DB_USER,
+            Sql=f"INSERT INTO gold.etl_tracker (source_layer, destination_layer, source_table, destination_table, status, {', '.join(TRACKER_SPAN_COLUMNS)}) VALUES ({sql_values(values)});",
+        )
+    except Exception as e:
+        logger.error(f"Error writing ETL tracking record: {str(e)}")
+
+
+def lambda_handler(event, context):
+    """Lambda handler to publish Parquet snapshots of the refreshed summaries."""
+    pipeline_run_id = (event or {}).get("pipeline_run_id")
+    span = Span(pipeline_run_id, "publish_snapshots")
+    version = f"{time.strftime('%Y%m%d_%H%M%S', time.gmtime())}_{uuid.uuid4().hex[:8]}"
+
+    try:
+        # **Step 1: UNLOAD Every Summary Into a New Version**
+        response = client.batch_execute_statement(
+            ClusterIdentifier=CLUSTER_ID, Database=DATABASE, DbUser=DB_USER, Sqls=build_unload_batch(version)
+        )
+        result = wait_for_statement(client, response["Id"])
+        if result["Status"] != "FINISHED":
+            raise Exception(f"UNLOAD failed with status {result['Status']}: {result.get('Error')}")
+        span.add_statement(result["Timings"])
+
+        # **Step 2: Describe Each Snapshot**
+        # Every UNLOAD is followed by its pg_last_unload_count(), the batch's even sub-statements
+        tables = {}
+        for position, table in enumerate(SUMMARY_TABLES):
+            count_result = client.get_statement_result(Id=f"{response['Id']}:{2 * position + 2}")
+            row_count = int(count_result["Records"][0][0]["longValue"])
+            tables[table] = describe_snapshot(table, version, row_count)
+            span.add_rows(row_count)
+
+        span.bytes_scanned = sum(snapshot["bytes"] for snapshot in tables.values())
+
+        # **Step 3: Point the Index at the New Version**
+        # The index is written last, so readers only ever see complete snapshots
+        index = {
+            "version": version,
+            "published_at": datetime.now(timezone.utc).isoformat(),
+            "pipeline_run_id": pipeline_run_id,
+            "tables": tables,
+        }
+        s3_client.put_object(
+            Bucket=SNAPSHOT_BUCKET,
+            Key=INDEX_KEY,
+            Body=json.dumps(index, indent=2).encode("utf-8"),
+            ContentType="application/json",
+            CacheControl="no-cache",
+        )
+        logger.info(f"Published snapshot version {version} of {len(tables)} summaries")
+
+        span.finish()
+        write_tracker_span(span)
+        emit_spans([span])
+
+        return {
+            "status": "success",
+            "version": version,
+            "rows_published": span.rows_processed,
+            "pipeline_run_id": pipeline_run_id,
+        }
+
+    except Exception as e:
+        logger.error(f"Error publishing snapshots: {str(e)}")
+        span.finish("FAILED", e)
+        write_tracker_span(span)
+        emit_spans([span])
+        return {"status": "error", "message": str(e), "pipeline_run_id": pipeline_run_id}
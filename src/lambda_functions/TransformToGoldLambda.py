@@ -1,8 +1,11 @@
 import json
 import boto3
 import os
-import time
 import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from pipeline_tracing import TRACKER_SPAN_COLUMNS, Span, emit_spans, sql_values
+from redshift_statement_waiter import wait_for_statement
 
 # Redshift Data API client
 redshift_client = boto3.client("redshift-data")
@@ -12,69 +15,175 @@ cluster_id = os.environ["REDSHIFT_CLUSTER_ID"]
 database = os.environ["REDSHIFT_DB"]
 db_user = os.environ["DB_USER"]
 
+# Upper bound on stored procedures running at once; keep it within the WLM queue's slots
+max_concurrent_steps = int(os.environ.get("MAX_CONCURRENT_STEPS", "4"))
+
 # Set up logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
-def fetch_query_results(statement_id):
-    """Fetch results of a completed query"""
-    try:
-        response = redshift_client.get_statement_result(Id=statement_id)
-        records = response.get("Records", [])
+def fetch_procedure_outputs(statement_id):
+    """Returns the OUT parameters of a finished CALL as a dict keyed by parameter name"""
+    response = redshift_client.get_statement_result(Id=statement_id)
+    records = response.get("Records", [])
+    if not records:
+        return {}
 
-        if not records:
-            return 0  # Default to 0 if no records found
-
-        return int(records[0][0]["longValue"])  # Extract the count from the first row
-    except Exception as e:
-        logger.error(f"Error fetching query results: {str(e)}")
-        return None
+    outputs = {}
+    for column, field in zip(response["ColumnMetadata"], records[0]):
+        outputs[column["name"]] = None if field.get("isNull") else next(iter(field.values()))
+    return outputs
 
 
-def execute_redshift_query(query, fetch_result=False):
+def execute_redshift_query(query):
     """Executes a query in Amazon Redshift using Data API"""
     try:
         logger.info(f"Executing query: {query}")  # Log the query being executed
         response = redshift_client.execute_statement(
             ClusterIdentifier=cluster_id, Database=database, DbUser=db_user, Sql=query
         )
-        statement_id = response["Id"]
-
-        # If fetch_result is requested, wait for query completion and fetch results
-        if fetch_result:
-            status = wait_for_redshift_query(statement_id)
-            if status == "FINISHED":
-                return fetch_query_results(
-                    statement_id
-                )  # Function to retrieve query results
-            else:
-                logger.error(f"Query {query} failed with status: {status}")
-                return None
-
-        return statement_id
+        return response["Id"]
     except Exception as e:
         logger.error(f"Redshift query execution failed: {str(e)}")
         return None
 
 
 def wait_for_redshift_query(statement_id):
-    """Waits for Redshift query to complete"""
-    while True:
-        response = redshift_client.describe_statement(Id=statement_id)
-        status = response["Status"]
-        logger.info(f"Query execution status: {status}")  # Log the status
+    """Waits for Redshift query to complete and returns its final status"""
+    return wait_for_statement(redshift_client, statement_id)["Status"]
+
+
+def resolve_step_dependencies(steps):
+    """
+    Maps each step's destination table to the destination tables it waits for.
+
+    Steps declare their inputs in `depends_on`. A step without the key waits for every
+    step listed before it, so older step lists keep running sequentially.
+    """
+    dependencies = {}
+    for index, step in enumerate(steps):
+        destination_table = step["destination_table"]
+        if "depends_on" in step:
+            depends_on = set(step["depends_on"])
+        else:
+            depends_on = {previous["destination_table"] for previous in steps[:index]}
+
+        unknown = depends_on - {other["destination_table"] for other in steps}
+        if unknown:
+            raise Exception(
+                f"Step {destination_table} depends on unknown steps: {sorted(unknown)}"
+            )
+        dependencies[destination_table] = depends_on
+
+    return dependencies
+
+
+def reconciliation_counts(procedure_outputs):
+    """
+    Returns the source, destination and filtered row counts a Gold procedure reported for its load.
+
+    Procedures count the Silver rows loaded in their window, the rows they drop on purpose
+    (versions superseded by a newer one of the same key, facts without a start date) and the
+    rows their MERGE (or delete+insert) applied, so reconciliation needs no COUNT(*) scans of
+    Gold. Steps whose query reports nothing get no counts.
+    """
+    source_count = procedure_outputs.get("rows_read")
+    filtered_count = procedure_outputs.get("rows_filtered")
+
+    if procedure_outputs.get("rows_merged") is not None:
+        destination_count = procedure_outputs["rows_merged"]
+    elif procedure_outputs.get("rows_inserted") is not None:
+        destination_count = procedure_outputs["rows_inserted"] + (procedure_outputs.get("rows_updated") or 0)
+    else:
+        destination_count = None
+
+    return source_count, destination_count, filtered_count
+
+
+def tracker_row(step, status, span, procedure_outputs=None):
+    """Builds the VALUES tuple of one gold.etl_tracker row, including the step's span"""
+    source_count, destination_count, filtered_count = reconciliation_counts(procedure_outputs or {})
+
+    # Every Silver row in the window is either applied to Gold or accounted for as filtered
+    reconciliation_status = None
+    if source_count is not None and destination_count is not None:
+        accounted_count = destination_count + (filtered_count or 0)
+        reconciliation_status = "MATCH" if source_count == accounted_count else "MISMATCH"
+
+    values = [
+        "silver",
+        "gold",
+        step["source_table"],
+        step["destination_table"],
+        status,
+        source_count,
+        destination_count,
+        filtered_count,
+        reconciliation_status,
+        (procedure_outputs or {}).get("high_watermark"),
+    ] + span.tracker_values()
+    return f"({sql_values(values)})"
+
+
+def write_tracker_rows(rows):
+    """Records every step of the run in gold.etl_tracker with one INSERT"""
+    if not rows:
+        return
+
+    insert_query = f"""
+        INSERT INTO gold.etl_tracker (source_layer, destination_layer, source_table, destination_table, status, source_count, destination_count, filtered_count, reconciliation_status, high_watermark, {", ".join(TRACKER_SPAN_COLUMNS)})
+        VALUES {", ".join(rows)};
+    """
+    statement_id = execute_redshift_query(insert_query)
+    if not statement_id or wait_for_redshift_query(statement_id) != "FINISHED":
+        logger.error("Error writing ETL tracking records.")
+
+
+def run_step(step, span):
+    """Runs one transformation step, returning its timings and outputs and the statement's description"""
+    logger.info(f"Executing step: {step}")
+
+    destination_table = step["destination_table"]
+    merge_query = step["merge_query"]
+
+    # **Execute the Merge Query**
+    transformation_id = execute_redshift_query(merge_query)
+    if not transformation_id:
+        raise Exception(f"MERGE query execution failed for {destination_table}!")
+
+    transformation_status = wait_for_statement(redshift_client, transformation_id)
+    span.add_statement(transformation_status["Timings"])
+
+    status = transformation_status["Status"]
+    if status != "FINISHED":
+        raise Exception(
+            f"MERGE query for {destination_table} failed with status {status}: {transformation_status.get('Error')}"
+        )
 
-        if status in ["FINISHED", "FAILED", "ABORTED"]:
-            return status
+    # Incremental procedures return the Silver watermark they loaded up to along with the
+    # rows they read, filtered and applied, which is everything reconciliation needs
+    procedure_outputs = {}
+    if transformation_status.get("HasResultSet"):
+        procedure_outputs = fetch_procedure_outputs(transformation_id)
+        logger.info(f"{destination_table} procedure outputs: {procedure_outputs}")
+        span.add_rows(reconciliation_counts(procedure_outputs)[1])
 
-        time.sleep(2)
+    return {
+        "destination_table": destination_table,
+        **transformation_status["Timings"],
+        "procedure_outputs": procedure_outputs,
+    }, transformation_status
 
 
 def lambda_handler(event, context):
+    pipeline_run_id = event.get("pipeline_run_id")
+    lambda_span = Span(pipeline_run_id, "transform_to_gold")
+    spans = []
+
     try:
         steps = event["steps"]
-        destination_table = None
+        step_timings = []
 
         # **Step 1: Test Redshift Connection**
         test_query = "SELECT 1;"
@@ -91,86 +200,85 @@ def lambda_handler(event, context):
             "Test query executed successfully! Proceeding with transformations."
         )
 
-        for step in steps:
-            logger.info(f"Executing step: {step}")
-
-            source_tables = step["source_table"].split(
-                ", "
-            )  # Handle multiple source tables
-            destination_table = step["destination_table"]
-            merge_query = step["merge_query"]
-
-            logger.info(
-                f"Source Tables: {source_tables}, Destination Table: {destination_table}"
+        # **Step 2: Run Steps Concurrently as Their Dependencies Complete**
+        dependencies = resolve_step_dependencies(steps)
+        steps_by_table = {step["destination_table"]: step for step in steps}
+        pending = dict(steps_by_table)
+        completed = set()
+        running = {}
+        failure = None
+        tracker_rows = []
+        step_spans = {}
+
+        with ThreadPoolExecutor(max_workers=max_concurrent_steps) as executor:
+            while pending or running:
+                # Stop submitting new work once a step has failed, but let running steps finish
+                if failure is None:
+                    for destination_table, step in list(pending.items()):
+                        if len(running) >= max_concurrent_steps:
+                            break
+                        if dependencies[destination_table] <= completed:
+                            step_spans[destination_table] = Span(pipeline_run_id, f"transform_to_gold:{destination_table}")
+                            running[executor.submit(run_step, step, step_spans[destination_table])] = destination_table
+                            del pending[destination_table]
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    destination_table = running.pop(future)
+                    step = steps_by_table[destination_table]
+                    step_span = step_spans[destination_table]
+                    try:
+                        result, description = future.result()
+                        step_timings.append(result)
+                        tracker_rows.append(
+                            tracker_row(step, "SUCCESS", step_span.finish(), result["procedure_outputs"])
+                        )
+                        # Steps overlap, so the run's span takes the union of their intervals
+                        lambda_span.add_concurrent_statement(description)
+                        lambda_span.add_rows(step_span.rows_processed)
+                        completed.add(destination_table)
+                    except Exception as e:
+                        logger.error(f"Step for {destination_table} failed: {str(e)}")
+                        tracker_rows.append(tracker_row(step, "FAILED", step_span.finish("FAILED", e)))
+                        failure = failure or e
+                    spans.append(step_span)
+
+        # **Step 3: Record Every Step's Reconciliation and Span in One Statement**
+        # The whole run's span is written alongside, so a run's stages are one tracker query away
+        if failure or pending:
+            lambda_span.finish("FAILED", failure or f"Steps never became runnable: {sorted(pending)}")
+        else:
+            lambda_span.finish()
+        spans.append(lambda_span)
+        tracker_rows.append(
+            tracker_row(
+                {"source_table": "silver.tbl_healthcare_analytics_data", "destination_table": "gold"},
+                lambda_span.status,
+                lambda_span,
             )
+        )
+        write_tracker_rows(tracker_rows)
+        emit_spans(spans)
 
-            total_source_count = 0
-            for source_table in source_tables:
-                count_query = f"SELECT COUNT(*) FROM {source_table};"
-                source_count = execute_redshift_query(count_query, fetch_result=True)
-                total_source_count += source_count if source_count else 0
-
-            start_time = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
-
-            insert_start_query = f"""
-                INSERT INTO gold.etl_tracker (source_layer, destination_layer, source_table, destination_table, status, completion_timestamp, source_count)
-                VALUES ('silver', 'gold', '{step["source_table"]}', '{destination_table}', 'STARTED', '{start_time}', {total_source_count});
-            """
-            execute_redshift_query(insert_start_query)
-
-            # **Execute the Merge Query**
-            transformation_id = execute_redshift_query(merge_query)
-            if not transformation_id:
-                raise Exception(
-                    f"MERGE query execution failed for {destination_table}!"
-                )
-
-            status = wait_for_redshift_query(transformation_id)
-            if status != "FINISHED":
-                raise Exception(
-                    f"MERGE query for {destination_table} failed with status {status}!"
-                )
-
-            # **Get Destination Table Count After Transformation**
-            destination_count_query = f"SELECT COUNT(*) FROM {destination_table};"
-            destination_count = execute_redshift_query(
-                destination_count_query, fetch_result=True
-            )
-            destination_count = destination_count if destination_count else 0
-
-            # **Determine Reconciliation Status**
-            reconciliation_status = (
-                "MATCH" if total_source_count == destination_count else "MISMATCH"
+        if failure:
+            raise failure
+        if pending:
+            raise Exception(
+                f"Steps never became runnable, check their depends_on for cycles: {sorted(pending)}"
             )
 
-            end_time = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
-
-            update_success_query = f"""
-                UPDATE gold.etl_tracker
-                SET status = 'SUCCESS', completion_timestamp = '{end_time}', 
-                    destination_count = {destination_count}, reconciliation_status = '{reconciliation_status}'
-                WHERE destination_table = '{destination_table}' 
-                    AND source_table = '{step["source_table"]}' 
-                    AND status = 'STARTED';
-            """
-            execute_redshift_query(update_success_query)
-
         return {
             "status": "Transformations Completed",
             "details": "All steps executed successfully with reconciliation.",
+            "step_timings": step_timings,
+            "pipeline_run_id": pipeline_run_id,
         }
 
     except Exception as e:
         logger.error(f"Error occurred in transformation: {str(e)}")
-        error_time = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
-
-        if destination_table:
-            update_failure_query = f"""
-                UPDATE gold.etl_tracker
-                SET status = 'FAILED', completion_timestamp = '{error_time}'
-                WHERE destination_table = '{destination_table}' 
-                    AND status = 'STARTED';
-            """
-            execute_redshift_query(update_failure_query)
-
+        if lambda_span.status == "RUNNING":
+            emit_spans([lambda_span.finish("FAILED", e)])
         return {"status": "Error", "message": str(e)}
@@ -1,78 +1,265 @@
 import json
 import boto3
 import os
+import re
+import hashlib
 import logging
+from urllib.parse import unquote_plus
+
+from pipeline_tracing import Span, emit_spans, pipeline_run_id_from_key
 
 # Get Step Function ARN from environment variable
 step_function_arn = os.environ['STEP_FUNCTION_ARN']
 
+# DynamoDB table (partition key `lock_id`, a string) holding the pipeline's single-flight lock
+pipeline_lock_table = os.environ['PIPELINE_LOCK_TABLE']
+
+# SQS queue S3 notifies in batching mode (its event source mapping is step_function/TriggerEventSourceMapping.json)
+trigger_queue_url = os.environ['TRIGGER_QUEUE_URL']
+
 # Set up logging for better traceability
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+SILVER_PREFIX = "silver-layer/"
+SILVER_MANIFEST_PREFIX = f"{SILVER_PREFIX}_manifests/"
+
+# Execution names are limited to 80 characters of [0-9A-Za-z_-]
+EXECUTION_NAME_LENGTH = 80
+
+PIPELINE_LOCK_ID = "silver-to-gold"
+
+
+class PipelineBusyError(Exception):
+    """Another pipeline run is still loading Redshift; raised so SQS redelivers the batch later"""
+
+
+def from_queue(event):
+    return any(record.get("eventSource") == "aws:sqs" for record in event.get("Records", []))
+
+
+def s3_records(event):
+    """
+    Flattens the S3 notification records of an event.
+
+    The function is either invoked by S3 directly, or, in batching mode, by an SQS queue that
+    S3 notifies. The queue's event source mapping (step_function/TriggerEventSourceMapping.json)
+    collects messages for up to its MaximumBatchingWindowInSeconds, so one invocation sees
+    every file written in that window.
+    """
+    records = []
+    for record in event.get("Records", []):
+        if record.get("eventSource") == "aws:sqs":
+            body = json.loads(record["body"])
+            records.extend(body.get("Records", []))  # s3:TestEvent messages have no records
+        else:
+            records.append(record)
+    return records
+
+
+def coalesce_keys(records):
+    """
+    De-duplicates the created objects of a batch by key and ETag.
+
+    S3 delivers notifications at least once, so the same object can show up several times.
+    Data files of a Silver batch whose manifest is in the same batch are dropped, since the
+    manifest lists them.
+    """
+    batches = {}
+    for record in records:
+        if not record.get("eventName", "ObjectCreated").startswith("ObjectCreated"):
+            continue
+        s3_object = record["s3"]["object"]
+        key = unquote_plus(s3_object["key"])  # Keys arrive URL-encoded
+        batches.setdefault(record["s3"]["bucket"]["name"], {})[key] = s3_object.get("eTag")
+
+    coalesced = {}
+    for bucket, keys in batches.items():
+        manifest_batches = {
+            pipeline_run_id_from_key(key) for key in keys if key.startswith(SILVER_MANIFEST_PREFIX)
+        }
+        coalesced[bucket] = {
+            key: etag
+            for key, etag in sorted(keys.items())
+            if key.startswith(SILVER_MANIFEST_PREFIX) or pipeline_run_id_from_key(key) not in manifest_batches
+        }
+    return coalesced
+
+
+def execution_name(pipeline_run_id, keys):
+    """
+    Names the execution after the batch's content, so a redelivered batch maps to the
+    execution it already started instead of a second one.
+    """
+    digest = hashlib.sha256(
+        json.dumps(sorted(keys.items()), default=str).encode("utf-8")
+    ).hexdigest()[:16]
+    prefix = re.sub(r"[^0-9A-Za-z_-]", "_", pipeline_run_id)[: EXECUTION_NAME_LENGTH - len(digest) - 1]
+    return f"{prefix}-{digest}"
+
+
+def execution_arn(name):
+    return f"{step_function_arn.replace(':stateMachine:', ':execution:')}:{name}"
+
+
+def execution_status(step_client, name):
+    """Returns the status of the named execution, or None when it was never started"""
+    try:
+        return step_client.describe_execution(executionArn=execution_arn(name))["status"]
+    except step_client.exceptions.ExecutionDoesNotExist:
+        return None
+
+
+def acquire_pipeline_lock(dynamodb_client, step_client, name):
+    """
+    Takes the single-flight lock for the execution `name` and returns the name of the
+    execution that held it before.
+
+    The lock item names the execution that last took it, and is free once that execution is
+    no longer running. It is handed over with a conditional write on the previous holder, so
+    when two triggers race for it only one write succeeds; the other raises PipelineBusyError.
+    Returns `name` itself, without writing, when this batch's execution already holds it.
+    """
+    item = dynamodb_client.get_item(
+        TableName=pipeline_lock_table,
+        Key={"lock_id": {"S": PIPELINE_LOCK_ID}},
+        ConsistentRead=True,
+    ).get("Item")
+    holder = item["execution_name"]["S"] if item else None
+
+    if holder == name:
+        return holder
+    if holder and execution_status(step_client, holder) == "RUNNING":
+        raise PipelineBusyError(f"Pipeline run still in progress: {execution_arn(holder)}")
+
+    try:
+        dynamodb_client.put_item(
+            TableName=pipeline_lock_table,
+            Item={"lock_id": {"S": PIPELINE_LOCK_ID}, "execution_name": {"S": name}},
+            ConditionExpression="attribute_not_exists(lock_id) OR execution_name = :holder",
+            ExpressionAttributeValues={":holder": {"S": holder or ""}},
+        )
+    except dynamodb_client.exceptions.ConditionalCheckFailedException:
+        raise PipelineBusyError("Another trigger took the pipeline lock first")
+    return holder
+
+
+def defer_to_queue(records):
+    """
+    Hands the notifications of a direct S3 invocation to the batching queue, which redelivers
+    them until the pipeline is free. Re-raising would only get the two retries of an
+    asynchronous invocation before the batch is dropped.
+    """
+    sqs_client = boto3.client('sqs')
+    sqs_client.send_message(QueueUrl=trigger_queue_url, MessageBody=json.dumps({"Records": records}))
+
+
 def lambda_handler(event, context):
     logger.info(f"Received Event: {json.dumps(event, indent=2)}")  
 
+    # The run id is only known once the batch's keys are
+    span = Span(None, "trigger")
+
     try:
-        s3_bucket = event["Records"][0]["s3"]["bucket"]["name"]
-        s3_key = event["Records"][0]["s3"]["object"]["key"]
+        records = s3_records(event)
+        batches = coalesce_keys(records)
+        if not batches:
+            logger.info("No created objects in the event.")
+            return {"status": "No Files"}
+
+        if len(batches) > 1:
+            raise ValueError(f"Expected notifications from one bucket, got {sorted(batches)}")
+
+        s3_bucket, keys = next(iter(batches.items()))
+        s3_keys = list(keys)
         logger.info(f"Bucket: {s3_bucket}")
-        logger.info(f"File: {s3_key}")
-        # return {"message": f"Processed {key} from {bucket}"}
+        logger.info(f"{len(s3_keys)} file(s) after de-duplication: {s3_keys}")
 
-        # Create a Step Functions client
+        # Every stage of the run reports its spans under the Silver batch id (the latest one,
+        # when the window caught several batches)
+        pipeline_run_id = sorted(pipeline_run_id_from_key(key) for key in s3_keys)[-1]
+        span.pipeline_run_id = pipeline_run_id
+        name = execution_name(pipeline_run_id, keys)
+
+        # Create the Step Functions and DynamoDB clients
         step_client = boto3.client('stepfunctions')
+        dynamodb_client = boto3.client('dynamodb')
+
+        # At most one run loads Redshift at a time. A batch that arrives while one is running
+        # fails here and SQS redelivers it after its visibility timeout; the run it starts
+        # then loads this batch's own files, which later batches do not include.
+        try:
+            holder = acquire_pipeline_lock(dynamodb_client, step_client, name)
+        except PipelineBusyError as e:
+            if from_queue(event):
+                raise
+            defer_to_queue(records)
+            logger.info(f"{e}; batch handed to the queue for a later run")
+            emit_spans([span.finish("SKIPPED")])
+            return {"status": "Batch Deferred", "pipeline_run_id": pipeline_run_id}
+        if holder == name and execution_status(step_client, name) == "RUNNING":
+            logger.info(f"Batch is already being processed by {execution_arn(name)}")
+            emit_spans([span.finish("SKIPPED")])
+            return {
+                "status": "Step Function Already Running",
+                "executionArn": execution_arn(name),
+                "pipeline_run_id": pipeline_run_id
+            }
         
         # Prepare the input for the Step Function
         step_function_input = {
-            "s3_event": event,  # Pass the entire S3 event structure
             "s3_bucket": s3_bucket,
-            "s3_key": s3_key,
+            "s3_keys": s3_keys,  # Every file of the batch; the S3 event itself is left out to stay under the 256 KB input limit
+            "pipeline_run_id": pipeline_run_id,
             "steps": [
-                {
-                    "source_table": "silver.tbl_healthcare_analytics_data",
-                    "destination_table": "gold.dim_dates",
-                    "merge_query": "CALL silver.sp_populate_dim_dates();"
-                },
-                {
-                    "source_table": "silver.tbl_healthcare_analytics_data",
-                    "destination_table": "gold.dim_times",
-                    "merge_query": "CALL silver.sp_populate_dim_times();"
-                },
                 {
                     "source_table": "silver.tbl_healthcare_analytics_data",
                     "destination_table": "gold.dim_treatment_types_and_outcome_statuses",
-                    "merge_query": "CALL silver.sp_populate_dim_treatment_types_and_outcome_statuses();"
+                    "merge_query": "CALL silver.sp_populate_dim_treatment_types_and_outcome_statuses(NULL);",
+                    "depends_on": []
                 },
                 {
                     "source_table": "silver.tbl_healthcare_analytics_data",
                     "destination_table": "gold.dim_locations",
-                    "merge_query": "CALL silver.sp_populate_dim_locations();"
+                    "merge_query": "CALL silver.sp_populate_dim_locations(NULL);",
+                    "depends_on": []
                 },
                 {
                     "source_table": "silver.tbl_healthcare_analytics_data",
                     "destination_table": "gold.dim_specialities",
-                    "merge_query": "CALL silver.sp_populate_dim_specialities();"
+                    "merge_query": "CALL silver.sp_populate_dim_specialities(NULL);",
+                    "depends_on": []
                 },
                 {
                     "source_table": "silver.tbl_healthcare_analytics_data",
                     "destination_table": "gold.dim_providers",
-                    "merge_query": "CALL silver.sp_populate_dim_providers();"
+                    "merge_query": "CALL silver.sp_populate_dim_providers(NULL);",
+                    "depends_on": []
                 },
                 {
                     "source_table": "silver.tbl_healthcare_analytics_data",
                     "destination_table": "gold.dim_patients",
-                    "merge_query": "CALL silver.sp_populate_dim_patients();"
+                    "merge_query": "CALL silver.sp_populate_dim_patients(NULL);",
+                    "depends_on": []
                 },
                 {
                     "source_table": "silver.tbl_healthcare_analytics_data",
                     "destination_table": "gold.dim_diseases",
-                    "merge_query": "CALL silver.sp_populate_dim_diseases();"
+                    "merge_query": "CALL silver.sp_populate_dim_diseases(NULL);",
+                    "depends_on": []
                 },
                 {
-                    "source_table": "gold.dim_dates, gold.dim_times, gold.dim_treatment_types_and_outcome_statuses, gold.dim_locations, gold.dim_specialities, gold.dim_providers, gold.dim_patients, gold.dim_diseases",
+                    "source_table": "silver.tbl_healthcare_analytics_data",
                     "destination_table": "gold.fact_treatments",
-                    "merge_query": "CALL silver.sp_populate_fact_treatments();"
+                    "merge_query": "CALL silver.sp_populate_fact_treatments(NULL);",
+                    "depends_on": [
+                        "gold.dim_treatment_types_and_outcome_statuses",
+                        "gold.dim_locations",
+                        "gold.dim_specialities",
+                        "gold.dim_providers",
+                        "gold.dim_patients",
+                        "gold.dim_diseases"
+                    ]
                 }
             ]
         }
@@ -82,25 +269,36 @@ def lambda_handler(event, context):
 
         # Start the Step Function execution
         logger.info(f"Invoking the StepFunction.")
-        response = step_client.start_execution(
-            stateMachineArn=step_function_arn,
-            input=json.dumps(step_function_input)
-        )
+        try:
+            response = step_client.start_execution(
+                stateMachineArn=step_function_arn,
+                name=name,
+                input=json.dumps(step_function_input)
+            )
+        except step_client.exceptions.ExecutionAlreadyExists:
+            # A finished execution already processed exactly this batch
+            logger.info(f"Batch was already processed by execution {name}")
+            emit_spans([span.finish("SKIPPED")])
+            return {"status": "Step Function Already Ran", "name": name, "pipeline_run_id": pipeline_run_id}
         
         # Log the response from Step Function execution
         logger.info(f"Step Function started successfully: {response['executionArn']}")
+        emit_spans([span.finish()])
         
         # Return success response with execution ARN
         return {
             "status": "Step Function Started",
-            "executionArn": response["executionArn"]
+            "executionArn": response["executionArn"],
+            "files": len(s3_keys),
+            "pipeline_run_id": pipeline_run_id
         }
     
     except KeyError as e:
+        emit_spans([span.finish("FAILED", e)])
         return {"error": f"Missing key: {e}"}
-        
-        # Return error response
-        return {
-            "status": "Error",
-            "message": str(e)
-        }
\ No newline at end of file
+
+    except Exception as e:
+        logger.error(f"Error triggering the Step Function: {str(e)}")
+        if span.status == "RUNNING":
+            emit_spans([span.finish("FAILED", e)])
+        raise
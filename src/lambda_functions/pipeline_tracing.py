@@ -0,0 +1,239 @@
+import os
+import csv
+import json
+import time
+import logging
+from datetime import datetime, timedelta, timezone
+
+# Shared by the pipeline Lambdas; package it alongside each function (or in a Lambda layer)
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Spans are always logged as JSON lines; set a path to also append them to a local file
+# (".csv" for CSV, anything else for JSON lines), e.g. when running the offline benchmark
+TRACE_SINK_PATH = os.environ.get("TRACE_SINK_PATH")
+
+SPAN_FIELDS = [
+    "pipeline_run_id",
+    "stage",
+    "status",
+    "started_at",
+    "ended_at",
+    "wall_seconds",
+    "queue_seconds",
+    "execution_seconds",
+    "rows_processed",
+    "bytes_scanned",
+    "rows_per_second",
+    "error",
+]
+
+# Span columns of gold.etl_tracker, in the order tracker_values() returns them
+TRACKER_SPAN_COLUMNS = [
+    "pipeline_run_id",
+    "stage",
+    "started_at",
+    "completion_timestamp",
+    "queue_seconds",
+    "execution_seconds",
+    "rows_processed",
+    "bytes_scanned",
+]
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"  # Microseconds, so sub-second stages keep their wall time
+
+
+def pipeline_run_id_from_key(s3_key):
+    """
+    Derives the pipeline run id from a Silver key.
+
+    A run is identified by the batch id the Databricks pipeline wrote its Silver batch under,
+    so the manifest `_manifests/<batch id>.manifest` and files under `batch_id=<batch id>/`
+    all map to the same id.
+    """
+    if "batch_id=" in s3_key:
+        return s3_key.split("batch_id=", 1)[1].split("/", 1)[0]
+    return os.path.splitext(os.path.basename(s3_key))[0]
+
+
+class Span:
+    """One timed stage of a pipeline run"""
+
+    def __init__(self, pipeline_run_id, stage):
+        self.pipeline_run_id = pipeline_run_id
+        self.stage = stage
+        self.status = "RUNNING"
+        self.started_at = datetime.now(timezone.utc)
+        self.ended_at = None
+        self.wall_seconds = None
+        self.queue_seconds = None
+        self.execution_seconds = None
+        self.rows_processed = None
+        self.bytes_scanned = None
+        self.error = None
+        self._started = time.perf_counter()
+        self._statement_intervals = []
+
+    def add_statement(self, timings):
+        """Adds the queue and execution time of a Redshift statement (see statement_timings)"""
+        self.queue_seconds = round((self.queue_seconds or 0.0) + timings["queue_seconds"], 3)
+        if timings.get("execution_seconds") is not None:
+            self.execution_seconds = round((self.execution_seconds or 0.0) + timings["execution_seconds"], 3)
+
+    def add_concurrent_statement(self, description):
+        """
+        Adds a statement that may have run alongside others added to this span.
+
+        `description` is a finished describe_statement response (see wait_for_statement).
+        Execution time is the union of the statements' execution intervals and queue time the
+        rest of the union of their lifetimes, so overlapping statements are not counted twice
+        and the span never reports more time than its statements took end to end.
+        """
+        ended_at = description["UpdatedAt"]
+        execution_seconds = description["Timings"]["execution_seconds"]
+        executing_from = ended_at - timedelta(seconds=execution_seconds or 0)
+        self._statement_intervals.append((description["CreatedAt"], executing_from, ended_at))
+
+        busy_seconds = union_seconds([(created_at, ended_at) for created_at, _, ended_at in self._statement_intervals])
+        executing_seconds = union_seconds([(executing_from, ended_at) for _, executing_from, ended_at in self._statement_intervals])
+        self.queue_seconds = round(max(busy_seconds - executing_seconds, 0.0), 3)
+        if execution_seconds is not None or self.execution_seconds is not None:
+            self.execution_seconds = round(executing_seconds, 3)
+
+    def add_rows(self, rows):
+        if rows is not None:
+            self.rows_processed = (self.rows_processed or 0) + int(rows)
+
+    def finish(self, status="SUCCESS", error=None):
+        self.status = status
+        self.error = str(error) if error else None
+        self.ended_at = datetime.now(timezone.utc)
+        self.wall_seconds = round(time.perf_counter() - self._started, 3)
+        return self
+
+    def rows_per_second(self):
+        if not self.rows_processed or not self.wall_seconds:
+            return None
+        return round(self.rows_processed / self.wall_seconds, 1)
+
+    def as_dict(self):
+        span = {field: getattr(self, field, None) for field in SPAN_FIELDS}
+        span["started_at"] = self.started_at.strftime(TIMESTAMP_FORMAT)
+        span["ended_at"] = self.ended_at.strftime(TIMESTAMP_FORMAT) if self.ended_at else None
+        span["rows_per_second"] = self.rows_per_second()
+        return span
+
+    def tracker_values(self):
+        """Values of TRACKER_SPAN_COLUMNS for this span's gold.etl_tracker row"""
+        span = self.as_dict()
+        return [
+            self.pipeline_run_id,
+            self.stage,
+            span["started_at"],
+            span["ended_at"],
+            self.queue_seconds,
+            self.execution_seconds,
+            self.rows_processed,
+            self.bytes_scanned,
+        ]
+
+
+def union_seconds(intervals):
+    """Length in seconds of the union of (start, end) datetime intervals"""
+    total_seconds = 0.0
+    covered_until = None
+    for start, end in sorted(intervals):
+        if covered_until is not None and start < covered_until:
+            start = covered_until
+        if end > start:
+            total_seconds += (end - start).total_seconds()
+        if covered_until is None or end > covered_until:
+            covered_until = end
+    return total_seconds
+
+
+def sql_values(values):
+    """Formats values as a comma-separated list of Redshift literals for a tracker INSERT"""
+    return ", ".join(
+        "NULL" if value is None
+        else str(value) if isinstance(value, (int, float))
+        else "'" + str(value).replace("'", "''") + "'"
+        for value in values
+    )
+
+
+def emit_spans(spans):
+    """Logs finished spans as structured JSON and appends them to the local sink, if configured"""
+    records = [span.as_dict() for span in spans]
+    for record in records:
+        logger.info(json.dumps({"span": record}))
+
+    if not TRACE_SINK_PATH or not records:
+        return
+
+    try:
+        if TRACE_SINK_PATH.endswith(".csv"):
+            write_header = not os.path.exists(TRACE_SINK_PATH) or os.path.getsize(TRACE_SINK_PATH) == 0
+            with open(TRACE_SINK_PATH, "a", newline="") as sink:
+                writer = csv.DictWriter(sink, fieldnames=SPAN_FIELDS)
+                if write_header:
+                    writer.writeheader()
+                writer.writerows(records)
+        else:
+            with open(TRACE_SINK_PATH, "a") as sink:
+                sink.writelines(json.dumps(record) + "\n" for record in records)
+    except OSError as e:
+        logger.error(f"Error writing spans to {TRACE_SINK_PATH}: {str(e)}")
+
+
+def read_spans(path):
+    """Reads the spans a local sink collected (CSV or JSON lines)"""
+    with open(path, newline="") as sink:
+        if path.endswith(".csv"):
+            return list(csv.DictReader(sink))
+        return [json.loads(line) for line in sink if line.strip()]
+
+
+def summarize_run(spans, top=3):
+    """
+    Names the hot stages of each pipeline run.
+
+    Top-level stages (no ":" in the name) are ranked by wall time with their share of the
+    run; each one lists its slowest sub-stage, e.g. the Gold table or refresh group that
+    dominated it.
+    """
+    runs = {}
+    for span in spans:
+        runs.setdefault(span["pipeline_run_id"], []).append(span)
+
+    summaries = []
+    for pipeline_run_id, run_spans in runs.items():
+        stages = [span for span in run_spans if ":" not in span["stage"]]
+        total_seconds = 0.0
+        for span in stages:
+            total_seconds += float(span["wall_seconds"] or 0)
+
+        hot_stages = []
+        for span in sorted(stages, key=lambda span: float(span["wall_seconds"] or 0), reverse=True)[:top]:
+            sub_stages = sorted(
+                (sub for sub in run_spans if sub["stage"].startswith(f"{span['stage']}:")),
+                key=lambda sub: float(sub["wall_seconds"] or 0),
+                reverse=True,
+            )
+            hot_stages.append({
+                "stage": span["stage"],
+                "wall_seconds": float(span["wall_seconds"] or 0),
+                "share": round(float(span["wall_seconds"] or 0) / total_seconds, 3) if total_seconds else None,
+                "queue_seconds": span["queue_seconds"],
+                "rows_per_second": span["rows_per_second"],
+                "slowest_sub_stage": sub_stages[0]["stage"] if sub_stages else None,
+            })
+
+        summaries.append({
+            "pipeline_run_id": pipeline_run_id,
+            "total_seconds": round(total_seconds, 3),
+            "failed_stages": [span["stage"] for span in run_spans if span["status"] == "FAILED"],
+            "hot_stages": hot_stages,
+        })
+    return summaries
@@ -0,0 +1,85 @@
+import os
+import time
+import logging
+
+# Shared by the pipeline Lambdas; package it alongside each function (or in a Lambda layer)
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+TERMINAL_STATUSES = ["FINISHED", "FAILED", "ABORTED"]
+
+DEFAULT_TIMEOUT_SECONDS = float(os.environ.get("REDSHIFT_STATEMENT_TIMEOUT_SECONDS", "600"))
+INITIAL_POLL_DELAY_SECONDS = 0.1
+MAX_POLL_DELAY_SECONDS = 5.0
+POLL_BACKOFF_FACTOR = 2.0
+
+
+class StatementTimeoutError(Exception):
+    """Raised when a statement does not finish before its deadline"""
+
+
+def statement_timings(description):
+    """
+    Splits a describe_statement response into wall, queue and execution time (seconds).
+
+    Wall time runs from submission to the last status change. Execution time is the
+    Duration reported by Redshift, and whatever remains was spent queued or compiling.
+    """
+    wall_seconds = (description["UpdatedAt"] - description["CreatedAt"]).total_seconds()
+
+    duration_ns = description.get("Duration", -1)
+    execution_seconds = duration_ns / 1e9 if duration_ns >= 0 else None
+    queue_seconds = (
+        wall_seconds - execution_seconds
+        if execution_seconds is not None and wall_seconds > execution_seconds
+        else 0.0
+    )
+
+    return {
+        "wall_seconds": round(wall_seconds, 3),
+        "queue_seconds": round(queue_seconds, 3),
+        "execution_seconds": round(execution_seconds, 3) if execution_seconds is not None else None,
+    }
+
+
+def wait_for_statement(client, statement_id, timeout_seconds=DEFAULT_TIMEOUT_SECONDS):
+    """
+    Waits for a Redshift Data API statement to reach a terminal state.
+
+    Polls with exponential backoff, starting fast so short statements return almost
+    immediately and backing off so long COPYs do not hammer the API. The statement is
+    cancelled if it is still running at the deadline.
+
+    Returns the final describe_statement response with a `Timings` entry added.
+    """
+    deadline = time.monotonic() + timeout_seconds
+    delay = INITIAL_POLL_DELAY_SECONDS
+
+    while True:
+        description = client.describe_statement(Id=statement_id)
+        status = description["Status"]
+
+        if status in TERMINAL_STATUSES:
+            description["Timings"] = statement_timings(description)
+            logger.info(
+                f"Statement {statement_id} {status} in {description['Timings']['wall_seconds']}s "
+                f"(queued {description['Timings']['queue_seconds']}s, "
+                f"executing {description['Timings']['execution_seconds']}s)"
+            )
+            return description
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            try:
+                client.cancel_statement(Id=statement_id)
+                logger.warning(f"Cancelled statement {statement_id} after {timeout_seconds}s")
+            except Exception as e:
+                logger.error(f"Error cancelling statement {statement_id}: {str(e)}")
+
+            raise StatementTimeoutError(
+                f"Statement {statement_id} did not finish within {timeout_seconds}s (last status: {status})"
+            )
+
+        time.sleep(min(delay, remaining))
+        delay = min(delay * POLL_BACKOFF_FACTOR, MAX_POLL_DELAY_SECONDS)
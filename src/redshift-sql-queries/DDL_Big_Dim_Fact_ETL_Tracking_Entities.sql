@@ -35,16 +35,22 @@ CREATE TABLE silver.tbl_healthcare_analytics_data (
     metadata_added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ENCODE az64,
     metadata_modified_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ENCODE az64,
 
-    treatment_type_and_outcome_status_id INT ENCODE az64
+    treatment_type_and_outcome_status_id INT ENCODE az64,
+
+    -- Set by CopyToRedShiftLambda when the row is loaded; keep it the last column, the Silver
+    -- files hold every column before it
+    silver_loaded_at TIMESTAMP ENCODE az64
 )
 DISTSTYLE KEY
 DISTKEY(patient_id)
-SORTKEY(treatment_start_date, treatment_completion_date);
+-- Gold loads read the rows loaded since their last watermark; rows arrive in load order, so
+-- sorting on silver_loaded_at lets zone maps skip every block outside that window
+SORTKEY(silver_loaded_at, metadata_modified_at);
 
 
 
 CREATE TABLE gold.dim_dates (
-    date_sk INT PRIMARY KEY ENCODE az64,
+    date_sk INT PRIMARY KEY ENCODE az64,  -- YYYYMMDD, see silver.f_date_sk
     date DATE ENCODE az64,
     day_of_week VARCHAR(10) ENCODE lzo,
     month VARCHAR(10) ENCODE lzo,
@@ -58,7 +64,7 @@ SORTKEY(year, month);
 
 
 CREATE TABLE gold.dim_times (
-    time_sk INT PRIMARY KEY ENCODE az64,
+    time_sk INT PRIMARY KEY ENCODE az64,  -- Seconds since midnight, see silver.f_time_sk
     hours INT ENCODE az64,
     minutes INT ENCODE az64,
     seconds INT ENCODE az64
@@ -163,7 +169,73 @@ CREATE TABLE gold.etl_tracker (
     status VARCHAR(20) NOT NULL,  
     source_count BIGINT DEFAULT NULL,  -- Count of records in source table
     destination_count BIGINT DEFAULT NULL,  -- Count of records in destination table
-    reconciliation_status VARCHAR(20) DEFAULT NULL,  -- 'MATCH' or 'MISMATCH'
+    filtered_count BIGINT DEFAULT NULL,  -- Source records the load dropped on purpose (superseded versions, facts without a start date)
+    reconciliation_status VARCHAR(20) DEFAULT NULL,  -- 'MATCH' when source_count = destination_count + filtered_count, else 'MISMATCH'
+    high_watermark TIMESTAMP DEFAULT NULL,  -- Latest silver_loaded_at applied by the load
     completion_timestamp TIMESTAMP DEFAULT NULL,  
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP  
-);
\ No newline at end of file
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+
+    -- Span of the stage that wrote the row; rows are only ever appended, one per stage and run
+    pipeline_run_id VARCHAR(100) DEFAULT NULL,  -- Silver batch id shared by every stage of a run
+    stage VARCHAR(200) DEFAULT NULL,  -- e.g. 'copy_to_redshift' or 'transform_to_gold:gold.dim_locations'
+    started_at TIMESTAMP DEFAULT NULL,
+    queue_seconds DECIMAL(12,3) DEFAULT NULL,  -- Time Redshift statements spent queued
+    execution_seconds DECIMAL(12,3) DEFAULT NULL,  -- Time Redshift statements spent executing
+    rows_processed BIGINT DEFAULT NULL,
+    bytes_scanned BIGINT DEFAULT NULL
+);
+
+
+CREATE TABLE gold.etl_loaded_files (
+    s3_key VARCHAR(1024) NOT NULL ENCODE zstd,  -- Silver file loaded by CopyToRedShiftLambda
+    load_id VARCHAR(100) NOT NULL ENCODE zstd,  -- Load manifest the file was copied with
+    destination_table VARCHAR(100) NOT NULL ENCODE zstd,
+    loaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ENCODE az64
+)
+DISTSTYLE EVEN
+SORTKEY(destination_table, s3_key);
+
+
+
+-- Additive state behind the gold summary tables, maintained from the fact delta by
+-- silver.sp_apply_summary_state_delta(). Each fact's last applied contribution is kept so
+-- an updated fact can be retracted before its new values are added.
+CREATE TABLE gold.summary_state_contributions (
+    fact_treatment_sk INT PRIMARY KEY ENCODE az64,
+    provider_sk INT ENCODE az64,
+    location_sk INT ENCODE az64,
+    start_date_sk INT ENCODE az64,
+    is_success INT ENCODE az64,
+    cost DECIMAL(18,2) ENCODE zstd
+)
+DISTSTYLE KEY
+DISTKEY(fact_treatment_sk)
+SORTKEY(fact_treatment_sk);
+
+
+
+CREATE TABLE gold.summary_state_providers (
+    provider_sk INT PRIMARY KEY ENCODE az64,
+    total_treatments BIGINT ENCODE az64,
+    successful_treatments BIGINT ENCODE az64,
+    total_cost DECIMAL(38,2) ENCODE az64,
+    costed_treatments BIGINT ENCODE az64
+)
+DISTSTYLE ALL;
+
+
+
+CREATE TABLE gold.summary_state_locations (
+    location_sk INT PRIMARY KEY ENCODE az64,
+    total_treatments BIGINT ENCODE az64
+)
+DISTSTYLE ALL;
+
+
+
+CREATE TABLE gold.summary_state_dates (
+    start_date_sk INT PRIMARY KEY ENCODE az64,
+    total_treatments BIGINT ENCODE az64,
+    successful_treatments BIGINT ENCODE az64
+)
+DISTSTYLE ALL;
@@ -0,0 +1,20 @@
+-- One-time migration for warehouses created before silver_loaded_at. Run it once, while no
+-- Step Function execution is in progress, before deploying the CopyToRedShiftLambda and the
+-- stored procedures that read the column.
+
+-- Record when each Silver row reached Redshift. Rows already loaded get their source time, or
+-- the migration time if that is in the future, so every one of them falls at or before the
+-- Gold high watermarks below.
+ALTER TABLE silver.tbl_healthcare_analytics_data ADD COLUMN silver_loaded_at TIMESTAMP ENCODE az64;
+
+UPDATE silver.tbl_healthcare_analytics_data
+SET silver_loaded_at = LEAST(metadata_modified_at, SYSDATE)
+WHERE silver_loaded_at IS NULL;
+
+ALTER TABLE silver.tbl_healthcare_analytics_data ALTER SORTKEY (silver_loaded_at, metadata_modified_at);
+
+-- Existing high watermarks are source times; none may sit past the migration, or the first
+-- load-time window would skip the rows loaded just after it.
+UPDATE gold.etl_tracker
+SET high_watermark = SYSDATE
+WHERE high_watermark > SYSDATE;
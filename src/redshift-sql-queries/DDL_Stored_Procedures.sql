@@ -1,100 +1,201 @@
-CREATE OR REPLACE PROCEDURE silver.sp_populate_dim_dates()
+-- Deterministic surrogate keys for the calendar dimensions: YYYYMMDD for dates and seconds
+-- since midnight for times. Loads compute fact keys from the row instead of looking them up.
+CREATE OR REPLACE FUNCTION silver.f_date_sk(DATE)
+RETURNS INT
+IMMUTABLE
+AS $$
+    SELECT (EXTRACT(YEAR FROM $1) * 10000 + EXTRACT(MONTH FROM $1) * 100 + EXTRACT(DAY FROM $1))::INT
+$$ LANGUAGE sql;
+
+
+
+CREATE OR REPLACE FUNCTION silver.f_time_sk(TIMESTAMP)
+RETURNS INT
+IMMUTABLE
+AS $$
+    SELECT (EXTRACT(HOUR FROM $1) * 3600 + EXTRACT(MINUTE FROM $1) * 60 + EXTRACT(SECOND FROM $1))::INT
+$$ LANGUAGE sql;
+
+
+
+-- Digits 0-9, cross joined with itself to generate number ranges for the calendar dimensions
+CREATE OR REPLACE VIEW silver.v_digits AS
+SELECT 0 AS d UNION ALL SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3 UNION ALL SELECT 4
+UNION ALL SELECT 5 UNION ALL SELECT 6 UNION ALL SELECT 7 UNION ALL SELECT 8 UNION ALL SELECT 9;
+
+
+
+-- Resolves the Silver window a Gold load has to apply. Windows are cut by silver_loaded_at,
+-- the time CopyToRedShiftLambda loaded a row, not by its source metadata_modified_at: a row
+-- can reach Silver after a load ran and still carry an older modification time (a late
+-- stream record, a skewed writer), and a source-time window would skip it for good.
+-- The lower bound is the caller's watermark, or the high_watermark of the destination's last
+-- successful load when the caller passes NULL. The upper bound is the newest silver_loaded_at
+-- at call time. A run's COPY commits before its Gold loads start and runs never overlap, so
+-- no row can appear below the bound after it was read. p_delta_modified_from is the oldest
+-- metadata_modified_at in the window: no version older than that can be the latest of a key
+-- the window touches, so the loads skip those blocks when they look up the latest versions.
+-- A row without metadata_modified_at counts as modified when it was loaded, so the bound and
+-- the loads' filter both use COALESCE(metadata_modified_at, silver_loaded_at) to keep it.
+CREATE OR REPLACE PROCEDURE silver.sp_resolve_watermarks(
+    p_destination_table VARCHAR(100),
+    p_since_watermark INOUT TIMESTAMP,
+    p_high_watermark INOUT TIMESTAMP,
+    p_delta_modified_from INOUT TIMESTAMP
+)
 LANGUAGE plpgsql
 AS $$
 BEGIN
-    MERGE INTO gold.dim_dates
-    USING (
-        SELECT
-            ROW_NUMBER() OVER (ORDER BY date_value) AS date_sk,
-            date_value AS date,
-            TO_CHAR(date_value, 'Day') AS day_of_week,
-            TO_CHAR(date_value, 'Month') AS month,
-            EXTRACT(QUARTER FROM date_value) AS quarter,
-            EXTRACT(YEAR FROM date_value) AS year,
-            CASE WHEN EXTRACT(DOW FROM date_value) IN (0, 6) THEN TRUE ELSE FALSE END AS is_weekend
-        FROM (
-            SELECT DISTINCT date_column::DATE AS date_value
-            FROM (
-                SELECT treatment_start_date AS date_column FROM silver.tbl_healthcare_analytics_data
-                UNION
-                SELECT treatment_completion_date FROM silver.tbl_healthcare_analytics_data
-                UNION
-                SELECT treatment_outcome_date FROM silver.tbl_healthcare_analytics_data
-                UNION
-                SELECT metadata_added_at::DATE FROM silver.tbl_healthcare_analytics_data
-                UNION
-                SELECT metadata_modified_at::DATE FROM silver.tbl_healthcare_analytics_data
-            ) AS all_dates
-        ) AS distinct_dates
-    ) AS staging_dates
-    ON gold.dim_dates.date = staging_dates.date
-    WHEN MATCHED THEN
-        UPDATE SET date = staging_dates.date
-    WHEN NOT MATCHED THEN
-        INSERT (date_sk, date, day_of_week, month, quarter, year, is_weekend)
-        VALUES (staging_dates.date_sk, staging_dates.date, staging_dates.day_of_week, staging_dates.month,
-                staging_dates.quarter, staging_dates.year, staging_dates.is_weekend);
+    IF p_since_watermark IS NULL THEN
+        SELECT COALESCE(MAX(t.high_watermark), '1900-01-01'::TIMESTAMP) INTO p_since_watermark
+        FROM gold.etl_tracker t
+        WHERE t.destination_table = p_destination_table
+            AND t.status = 'SUCCESS';
+    END IF;
+
+    SELECT MAX(silver_loaded_at), MIN(COALESCE(metadata_modified_at, silver_loaded_at)) INTO p_high_watermark, p_delta_modified_from
+    FROM silver.tbl_healthcare_analytics_data
+    WHERE silver_loaded_at > p_since_watermark;
+
+    -- Nothing new: keep the previous watermark
+    IF p_high_watermark IS NULL THEN
+        p_high_watermark := p_since_watermark;
+    END IF;
 END;
 $$;
 
 
 
-CREATE OR REPLACE PROCEDURE silver.sp_populate_dim_times()
+CREATE OR REPLACE PROCEDURE silver.sp_generate_dim_dates(p_start_date DATE, p_end_date DATE)
 LANGUAGE plpgsql
 AS $$
 BEGIN
-    MERGE INTO gold.dim_times
-    USING (
-        SELECT
-            ROW_NUMBER() OVER (ORDER BY hours, minutes, seconds) AS time_sk,
-            hours,
-            minutes,
-            seconds
+    IF p_start_date IS NULL OR p_end_date IS NULL OR p_end_date < p_start_date THEN
+        RETURN;
+    END IF;
+
+    IF p_end_date - p_start_date >= 100000 THEN
+        RAISE EXCEPTION 'Date range % to % exceeds 100000 days', p_start_date, p_end_date;
+    END IF;
+
+    -- Calendar rows are pure arithmetic, so generate the range from a digits cross join and
+    -- skip the dates that already exist; reruns and overlapping ranges are no-ops
+    INSERT INTO gold.dim_dates (date_sk, date, day_of_week, month, quarter, year, is_weekend)
+    SELECT
+        silver.f_date_sk(date_value) AS date_sk,
+        date_value AS date,
+        TO_CHAR(date_value, 'Day') AS day_of_week,
+        TO_CHAR(date_value, 'Month') AS month,
+        EXTRACT(QUARTER FROM date_value) AS quarter,
+        EXTRACT(YEAR FROM date_value) AS year,
+        CASE WHEN EXTRACT(DOW FROM date_value) IN (0, 6) THEN TRUE ELSE FALSE END AS is_weekend
+    FROM (
+        SELECT (p_start_date + n)::DATE AS date_value
         FROM (
-            SELECT DISTINCT
-                EXTRACT(HOUR FROM time_value) AS hours,
-                EXTRACT(MINUTE FROM time_value) AS minutes,
-                EXTRACT(SECOND FROM time_value) AS seconds
-            FROM (
-                SELECT treatment_start_date::TIME AS time_value FROM silver.tbl_healthcare_analytics_data
-                UNION
-                SELECT treatment_completion_date::TIME FROM silver.tbl_healthcare_analytics_data
-                UNION
-                SELECT treatment_outcome_date::TIME FROM silver.tbl_healthcare_analytics_data
-                UNION
-                SELECT metadata_added_at::TIME FROM silver.tbl_healthcare_analytics_data
-                UNION
-                SELECT metadata_modified_at::TIME FROM silver.tbl_healthcare_analytics_data
-            ) AS distinct_times
-        ) AS unique_times
-    ) AS source
-    ON gold.dim_times.hours = source.hours
-       AND gold.dim_times.minutes = source.minutes
-       AND gold.dim_times.seconds = source.seconds
+            SELECT d1.d + d2.d * 10 + d3.d * 100 + d4.d * 1000 + d5.d * 10000 AS n
+            FROM silver.v_digits d1
+            CROSS JOIN silver.v_digits d2
+            CROSS JOIN silver.v_digits d3
+            CROSS JOIN silver.v_digits d4
+            CROSS JOIN silver.v_digits d5
+        ) AS numbers
+        WHERE n <= p_end_date - p_start_date
+    ) AS calendar
+    WHERE NOT EXISTS (
+        SELECT 1 FROM gold.dim_dates WHERE gold.dim_dates.date_sk = silver.f_date_sk(calendar.date_value)
+    );
+END;
+$$;
 
-    WHEN MATCHED THEN
-        UPDATE SET hours = gold.dim_times.hours  -- No actual change, but required by Redshift
 
-    WHEN NOT MATCHED THEN
-        INSERT (time_sk, hours, minutes, seconds)
-        VALUES (source.time_sk, source.hours, source.minutes, source.seconds);
+
+CREATE OR REPLACE PROCEDURE silver.sp_generate_dim_times()
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    -- Every second of the day, keyed by seconds since midnight
+    INSERT INTO gold.dim_times (time_sk, hours, minutes, seconds)
+    SELECT
+        n AS time_sk,
+        n / 3600 AS hours,
+        n / 60 % 60 AS minutes,
+        n % 60 AS seconds
+    FROM (
+        SELECT d1.d + d2.d * 10 + d3.d * 100 + d4.d * 1000 + d5.d * 10000 AS n
+        FROM silver.v_digits d1
+        CROSS JOIN silver.v_digits d2
+        CROSS JOIN silver.v_digits d3
+        CROSS JOIN silver.v_digits d4
+        CROSS JOIN silver.v_digits d5
+    ) AS numbers
+    WHERE n < 86400
+        AND NOT EXISTS (
+            SELECT 1 FROM gold.dim_times WHERE gold.dim_times.time_sk = numbers.n
+        );
 END;
 $$;
 
 
 
-CREATE OR REPLACE PROCEDURE silver.sp_populate_dim_treatment_types_and_outcome_statuses()
+CREATE OR REPLACE PROCEDURE silver.sp_populate_dim_treatment_types_and_outcome_statuses(
+    p_since_watermark TIMESTAMP,
+    high_watermark OUT TIMESTAMP,
+    rows_read OUT BIGINT,
+    rows_filtered OUT BIGINT,
+    rows_merged OUT BIGINT
+)
 LANGUAGE plpgsql
 AS $$
+DECLARE
+    since_watermark TIMESTAMP := p_since_watermark;
+    delta_modified_from TIMESTAMP;
 BEGIN
-    MERGE INTO gold.dim_treatment_types_and_outcome_statuses
-    USING (
-        SELECT DISTINCT 
+    rows_read := 0;
+    rows_filtered := 0;
+    rows_merged := 0;
+
+    CALL silver.sp_resolve_watermarks('gold.dim_treatment_types_and_outcome_statuses', since_watermark, high_watermark, delta_modified_from);
+    IF high_watermark <= since_watermark THEN
+        RETURN;
+    END IF;
+
+    -- Reconciliation counts, taken from Silver rather than from the stage: every row loaded in
+    -- the window, and the ones no Gold row is written for because another version of the
+    -- same key supersedes them (rows without a key included)
+    SELECT COUNT(*), COUNT(*) - COUNT(DISTINCT treatment_type_and_outcome_status_id)
+    INTO rows_read, rows_filtered
+    FROM silver.tbl_healthcare_analytics_data
+    WHERE silver_loaded_at > since_watermark
+        AND silver_loaded_at <= high_watermark;
+
+    -- Every status loaded into Silver since the last load, at its latest version among all of its
+    -- Silver rows: a late row must not overwrite a newer version an earlier load applied
+    DROP TABLE IF EXISTS dim_stage;
+    CREATE TEMP TABLE dim_stage AS
+    SELECT
+        treatment_type_and_outcome_status_id,
+        treatment_type,
+        treatment_outcome_status
+    FROM (
+        SELECT
             treatment_type_and_outcome_status_id,
             treatment_type,
-            treatment_outcome_status
+            treatment_outcome_status,
+            ROW_NUMBER() OVER (PARTITION BY treatment_type_and_outcome_status_id ORDER BY metadata_modified_at DESC, silver_loaded_at DESC) AS version_rank
         FROM silver.tbl_healthcare_analytics_data
-    ) AS source
+        WHERE treatment_type_and_outcome_status_id IN (
+                SELECT treatment_type_and_outcome_status_id
+                FROM silver.tbl_healthcare_analytics_data
+                WHERE silver_loaded_at > since_watermark
+                    AND silver_loaded_at <= high_watermark
+            )
+            AND COALESCE(metadata_modified_at, silver_loaded_at) >= delta_modified_from
+            AND silver_loaded_at <= high_watermark
+    ) AS versions
+    WHERE version_rank = 1;
+
+    MERGE INTO gold.dim_treatment_types_and_outcome_statuses
+    USING dim_stage AS source
     ON gold.dim_treatment_types_and_outcome_statuses.treatment_type_and_outcome_status_sk = source.treatment_type_and_outcome_status_id
     
     WHEN MATCHED THEN
@@ -109,24 +210,73 @@ BEGIN
             source.treatment_type, 
             source.treatment_outcome_status
         );
+    GET DIAGNOSTICS rows_merged := ROW_COUNT;
 END;
 $$;
 
 
 
-CREATE OR REPLACE PROCEDURE silver.sp_populate_dim_locations()
+CREATE OR REPLACE PROCEDURE silver.sp_populate_dim_locations(
+    p_since_watermark TIMESTAMP,
+    high_watermark OUT TIMESTAMP,
+    rows_read OUT BIGINT,
+    rows_filtered OUT BIGINT,
+    rows_merged OUT BIGINT
+)
 LANGUAGE plpgsql
 AS $$
+DECLARE
+    since_watermark TIMESTAMP := p_since_watermark;
+    delta_modified_from TIMESTAMP;
 BEGIN
-    MERGE INTO gold.dim_locations
-    USING (
-        SELECT DISTINCT
-            location_id,  -- Assuming location_id is the surrogate key from silver table
+    rows_read := 0;
+    rows_filtered := 0;
+    rows_merged := 0;
+
+    CALL silver.sp_resolve_watermarks('gold.dim_locations', since_watermark, high_watermark, delta_modified_from);
+    IF high_watermark <= since_watermark THEN
+        RETURN;
+    END IF;
+
+    -- Reconciliation counts, taken from Silver rather than from the stage: every row loaded in
+    -- the window, and the ones no Gold row is written for because another version of the
+    -- same key supersedes them (rows without a key included)
+    SELECT COUNT(*), COUNT(*) - COUNT(DISTINCT location_id)
+    INTO rows_read, rows_filtered
+    FROM silver.tbl_healthcare_analytics_data
+    WHERE silver_loaded_at > since_watermark
+        AND silver_loaded_at <= high_watermark;
+
+    -- Every key loaded into Silver since the last load, at its latest version among all of its
+    -- Silver rows: a late row must not overwrite a newer version an earlier load applied
+    DROP TABLE IF EXISTS dim_stage;
+    CREATE TEMP TABLE dim_stage AS
+    SELECT
+        location_id,  -- Assuming location_id is the surrogate key from silver table
+        location_country,
+        location_state,
+        location_city
+    FROM (
+        SELECT
+            location_id,
             location_country,
             location_state,
-            location_city
+            location_city,
+            ROW_NUMBER() OVER (PARTITION BY location_id ORDER BY metadata_modified_at DESC, silver_loaded_at DESC) AS version_rank
         FROM silver.tbl_healthcare_analytics_data
-    ) AS staging_locations
+        WHERE location_id IN (
+                SELECT location_id
+                FROM silver.tbl_healthcare_analytics_data
+                WHERE silver_loaded_at > since_watermark
+                    AND silver_loaded_at <= high_watermark
+            )
+            AND COALESCE(metadata_modified_at, silver_loaded_at) >= delta_modified_from
+            AND silver_loaded_at <= high_watermark
+    ) AS versions
+    WHERE version_rank = 1;
+
+    MERGE INTO gold.dim_locations
+    USING dim_stage AS staging_locations
     ON gold.dim_locations.location_sk = staging_locations.location_id
     WHEN MATCHED THEN
         UPDATE SET
@@ -141,22 +291,69 @@ BEGIN
             staging_locations.location_state,
             staging_locations.location_city
         );
+    GET DIAGNOSTICS rows_merged := ROW_COUNT;
 END;
 $$;
 
 
 
-CREATE OR REPLACE PROCEDURE silver.sp_populate_dim_specialities()
+CREATE OR REPLACE PROCEDURE silver.sp_populate_dim_specialities(
+    p_since_watermark TIMESTAMP,
+    high_watermark OUT TIMESTAMP,
+    rows_read OUT BIGINT,
+    rows_filtered OUT BIGINT,
+    rows_merged OUT BIGINT
+)
 LANGUAGE plpgsql
 AS $$
+DECLARE
+    since_watermark TIMESTAMP := p_since_watermark;
+    delta_modified_from TIMESTAMP;
 BEGIN
-    MERGE INTO gold.dim_specialities
-    USING (
-        SELECT DISTINCT
-            provider_speciality_id,  -- Assuming speciality_id is the surrogate key from silver table
-            provider_speciality_name
+    rows_read := 0;
+    rows_filtered := 0;
+    rows_merged := 0;
+
+    CALL silver.sp_resolve_watermarks('gold.dim_specialities', since_watermark, high_watermark, delta_modified_from);
+    IF high_watermark <= since_watermark THEN
+        RETURN;
+    END IF;
+
+    -- Reconciliation counts, taken from Silver rather than from the stage: every row loaded in
+    -- the window, and the ones no Gold row is written for because another version of the
+    -- same key supersedes them (rows without a key included)
+    SELECT COUNT(*), COUNT(*) - COUNT(DISTINCT provider_speciality_id)
+    INTO rows_read, rows_filtered
+    FROM silver.tbl_healthcare_analytics_data
+    WHERE silver_loaded_at > since_watermark
+        AND silver_loaded_at <= high_watermark;
+
+    -- Every key loaded into Silver since the last load, at its latest version among all of its
+    -- Silver rows: a late row must not overwrite a newer version an earlier load applied
+    DROP TABLE IF EXISTS dim_stage;
+    CREATE TEMP TABLE dim_stage AS
+    SELECT
+        provider_speciality_id,  -- Assuming speciality_id is the surrogate key from silver table
+        provider_speciality_name
+    FROM (
+        SELECT
+            provider_speciality_id,
+            provider_speciality_name,
+            ROW_NUMBER() OVER (PARTITION BY provider_speciality_id ORDER BY metadata_modified_at DESC, silver_loaded_at DESC) AS version_rank
         FROM silver.tbl_healthcare_analytics_data
-    ) AS source
+        WHERE provider_speciality_id IN (
+                SELECT provider_speciality_id
+                FROM silver.tbl_healthcare_analytics_data
+                WHERE silver_loaded_at > since_watermark
+                    AND silver_loaded_at <= high_watermark
+            )
+            AND COALESCE(metadata_modified_at, silver_loaded_at) >= delta_modified_from
+            AND silver_loaded_at <= high_watermark
+    ) AS versions
+    WHERE version_rank = 1;
+
+    MERGE INTO gold.dim_specialities
+    USING dim_stage AS source
     ON gold.dim_specialities.speciality_sk = source.provider_speciality_id
     
     WHEN MATCHED THEN
@@ -169,25 +366,75 @@ BEGIN
             source.provider_speciality_id,
             source.provider_speciality_name
         );
+    GET DIAGNOSTICS rows_merged := ROW_COUNT;
 END;
 $$;
 
 
 
-CREATE OR REPLACE PROCEDURE silver.sp_populate_dim_providers()
+CREATE OR REPLACE PROCEDURE silver.sp_populate_dim_providers(
+    p_since_watermark TIMESTAMP,
+    high_watermark OUT TIMESTAMP,
+    rows_read OUT BIGINT,
+    rows_filtered OUT BIGINT,
+    rows_merged OUT BIGINT
+)
 LANGUAGE plpgsql
 AS $$
+DECLARE
+    since_watermark TIMESTAMP := p_since_watermark;
+    delta_modified_from TIMESTAMP;
 BEGIN
-    MERGE INTO gold.dim_providers
-    USING (
-        SELECT DISTINCT
+    rows_read := 0;
+    rows_filtered := 0;
+    rows_merged := 0;
+
+    CALL silver.sp_resolve_watermarks('gold.dim_providers', since_watermark, high_watermark, delta_modified_from);
+    IF high_watermark <= since_watermark THEN
+        RETURN;
+    END IF;
+
+    -- Reconciliation counts, taken from Silver rather than from the stage: every row loaded in
+    -- the window, and the ones no Gold row is written for because another version of the
+    -- same key supersedes them (rows without a key included)
+    SELECT COUNT(*), COUNT(*) - COUNT(DISTINCT provider_id)
+    INTO rows_read, rows_filtered
+    FROM silver.tbl_healthcare_analytics_data
+    WHERE silver_loaded_at > since_watermark
+        AND silver_loaded_at <= high_watermark;
+
+    -- Every key loaded into Silver since the last load, at its latest version among all of its
+    -- Silver rows: a late row must not overwrite a newer version an earlier load applied
+    DROP TABLE IF EXISTS dim_stage;
+    CREATE TEMP TABLE dim_stage AS
+    SELECT
+        provider_id,
+        provider_full_name,
+        provider_speciality_id,
+        provider_affiliated_hospital,
+        location_id
+    FROM (
+        SELECT
             provider_id,
             provider_full_name,
             provider_speciality_id,
             provider_affiliated_hospital,
-            location_id
+            location_id,
+            ROW_NUMBER() OVER (PARTITION BY provider_id ORDER BY metadata_modified_at DESC, silver_loaded_at DESC) AS version_rank
         FROM silver.tbl_healthcare_analytics_data
-    ) AS source
+        WHERE provider_id IN (
+                SELECT provider_id
+                FROM silver.tbl_healthcare_analytics_data
+                WHERE silver_loaded_at > since_watermark
+                    AND silver_loaded_at <= high_watermark
+            )
+            AND COALESCE(metadata_modified_at, silver_loaded_at) >= delta_modified_from
+            AND silver_loaded_at <= high_watermark
+    ) AS versions
+    WHERE version_rank = 1;
+
+    MERGE INTO gold.dim_providers
+    USING dim_stage AS source
     ON gold.dim_providers.provider_sk = source.provider_id
     
     WHEN MATCHED THEN
@@ -206,24 +453,73 @@ BEGIN
             source.provider_affiliated_hospital,
             source.location_id
         );
+    GET DIAGNOSTICS rows_merged := ROW_COUNT;
 END;
 $$;
 
 
 
-CREATE OR REPLACE PROCEDURE silver.sp_populate_dim_patients()
+CREATE OR REPLACE PROCEDURE silver.sp_populate_dim_patients(
+    p_since_watermark TIMESTAMP,
+    high_watermark OUT TIMESTAMP,
+    rows_read OUT BIGINT,
+    rows_filtered OUT BIGINT,
+    rows_merged OUT BIGINT
+)
 LANGUAGE plpgsql
 AS $$
+DECLARE
+    since_watermark TIMESTAMP := p_since_watermark;
+    delta_modified_from TIMESTAMP;
 BEGIN
-    MERGE INTO gold.dim_patients
-    USING (
-        SELECT DISTINCT
+    rows_read := 0;
+    rows_filtered := 0;
+    rows_merged := 0;
+
+    CALL silver.sp_resolve_watermarks('gold.dim_patients', since_watermark, high_watermark, delta_modified_from);
+    IF high_watermark <= since_watermark THEN
+        RETURN;
+    END IF;
+
+    -- Reconciliation counts, taken from Silver rather than from the stage: every row loaded in
+    -- the window, and the ones no Gold row is written for because another version of the
+    -- same key supersedes them (rows without a key included)
+    SELECT COUNT(*), COUNT(*) - COUNT(DISTINCT patient_id)
+    INTO rows_read, rows_filtered
+    FROM silver.tbl_healthcare_analytics_data
+    WHERE silver_loaded_at > since_watermark
+        AND silver_loaded_at <= high_watermark;
+
+    -- Every key loaded into Silver since the last load, at its latest version among all of its
+    -- Silver rows: a late row must not overwrite a newer version an earlier load applied
+    DROP TABLE IF EXISTS dim_stage;
+    CREATE TEMP TABLE dim_stage AS
+    SELECT
+        patient_id,
+        patient_full_name,
+        patient_gender,
+        patient_age
+    FROM (
+        SELECT
             patient_id,
             patient_full_name,
             patient_gender,
-            patient_age
+            patient_age,
+            ROW_NUMBER() OVER (PARTITION BY patient_id ORDER BY metadata_modified_at DESC, silver_loaded_at DESC) AS version_rank
         FROM silver.tbl_healthcare_analytics_data
-    ) AS source
+        WHERE patient_id IN (
+                SELECT patient_id
+                FROM silver.tbl_healthcare_analytics_data
+                WHERE silver_loaded_at > since_watermark
+                    AND silver_loaded_at <= high_watermark
+            )
+            AND COALESCE(metadata_modified_at, silver_loaded_at) >= delta_modified_from
+            AND silver_loaded_at <= high_watermark
+    ) AS versions
+    WHERE version_rank = 1;
+
+    MERGE INTO gold.dim_patients
+    USING dim_stage AS source
     ON gold.dim_patients.patient_sk = source.patient_id
     
     WHEN MATCHED THEN
@@ -240,27 +536,79 @@ BEGIN
             source.patient_gender,
             source.patient_age
         );
+    GET DIAGNOSTICS rows_merged := ROW_COUNT;
 END;
 $$;
 
 
 
-CREATE OR REPLACE PROCEDURE silver.sp_populate_dim_diseases()
+CREATE OR REPLACE PROCEDURE silver.sp_populate_dim_diseases(
+    p_since_watermark TIMESTAMP,
+    high_watermark OUT TIMESTAMP,
+    rows_read OUT BIGINT,
+    rows_filtered OUT BIGINT,
+    rows_merged OUT BIGINT
+)
 LANGUAGE plpgsql
 AS $$
+DECLARE
+    since_watermark TIMESTAMP := p_since_watermark;
+    delta_modified_from TIMESTAMP;
 BEGIN
-    MERGE INTO gold.dim_diseases
-    USING (
-        SELECT DISTINCT
+    rows_read := 0;
+    rows_filtered := 0;
+    rows_merged := 0;
+
+    CALL silver.sp_resolve_watermarks('gold.dim_diseases', since_watermark, high_watermark, delta_modified_from);
+    IF high_watermark <= since_watermark THEN
+        RETURN;
+    END IF;
+
+    -- Reconciliation counts, taken from Silver rather than from the stage: every row loaded in
+    -- the window, and the ones no Gold row is written for because another version of the
+    -- same key supersedes them (rows without a key included)
+    SELECT COUNT(*), COUNT(*) - COUNT(DISTINCT disease_id)
+    INTO rows_read, rows_filtered
+    FROM silver.tbl_healthcare_analytics_data
+    WHERE silver_loaded_at > since_watermark
+        AND silver_loaded_at <= high_watermark;
+
+    -- Every key loaded into Silver since the last load, at its latest version among all of its
+    -- Silver rows: a late row must not overwrite a newer version an earlier load applied
+    DROP TABLE IF EXISTS dim_stage;
+    CREATE TEMP TABLE dim_stage AS
+    SELECT
+        disease_id,
+        disease_speciality_id,
+        disease_name,
+        disease_type,
+        disease_severity,
+        disease_transmission_mode,
+        disease_mortality_rate
+    FROM (
+        SELECT
             disease_id,
             disease_speciality_id,
             disease_name,
             disease_type,
             disease_severity,
             disease_transmission_mode,
-            disease_mortality_rate
+            disease_mortality_rate,
+            ROW_NUMBER() OVER (PARTITION BY disease_id ORDER BY metadata_modified_at DESC, silver_loaded_at DESC) AS version_rank
         FROM silver.tbl_healthcare_analytics_data
-    ) AS source_data
+        WHERE disease_id IN (
+                SELECT disease_id
+                FROM silver.tbl_healthcare_analytics_data
+                WHERE silver_loaded_at > since_watermark
+                    AND silver_loaded_at <= high_watermark
+            )
+            AND COALESCE(metadata_modified_at, silver_loaded_at) >= delta_modified_from
+            AND silver_loaded_at <= high_watermark
+    ) AS versions
+    WHERE version_rank = 1;
+
+    MERGE INTO gold.dim_diseases
+    USING dim_stage AS source_data
     ON gold.dim_diseases.disease_sk = source_data.disease_id
     WHEN MATCHED THEN
         UPDATE SET
@@ -281,134 +629,293 @@ BEGIN
             source_data.disease_transmission_mode,
             source_data.disease_mortality_rate
         );
+    GET DIAGNOSTICS rows_merged := ROW_COUNT;
+END;
+$$;
+
+
+
+CREATE OR REPLACE PROCEDURE silver.sp_populate_fact_treatments(
+    p_since_watermark TIMESTAMP,
+    high_watermark OUT TIMESTAMP,
+    rows_read OUT BIGINT,
+    rows_filtered OUT BIGINT,
+    rows_inserted OUT BIGINT,
+    rows_updated OUT BIGINT
+)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    since_watermark TIMESTAMP := p_since_watermark;
+    delta_modified_from TIMESTAMP;
+    min_date_sk INT;
+    max_date_sk INT;
+    rows_without_start_date BIGINT;
+    rows_written BIGINT;
+BEGIN
+    rows_read := 0;
+    rows_filtered := 0;
+    rows_inserted := 0;
+    rows_updated := 0;
+
+    CALL silver.sp_resolve_watermarks('gold.fact_treatments', since_watermark, high_watermark, delta_modified_from);
+    IF high_watermark <= since_watermark THEN
+        RETURN;
+    END IF;
+
+    -- Reconciliation counts, taken from Silver rather than from the stage: every row loaded in
+    -- the window, and the ones no Gold row is written for because another version of the
+    -- same key supersedes them (rows without a key included)
+    SELECT COUNT(*), COUNT(*) - COUNT(DISTINCT treatment_id)
+    INTO rows_read, rows_filtered
+    FROM silver.tbl_healthcare_analytics_data
+    WHERE silver_loaded_at > since_watermark
+        AND silver_loaded_at <= high_watermark;
+
+    -- One pass over the Silver delta: keep the latest version of each treatment loaded since the
+    -- last load, among all of its Silver rows, and compute every key from the row. The stage
+    -- shares the fact's distribution, so the insert below does not redistribute anything.
+    DROP TABLE IF EXISTS fact_stage;
+    CREATE TEMP TABLE fact_stage DISTKEY(provider_sk) SORTKEY(fact_treatment_sk) AS
+    SELECT
+        treatment_id AS fact_treatment_sk,
+        treatment_type_and_outcome_status_id AS treatment_type_and_outcome_status_sk,
+        provider_id AS provider_sk,
+        location_id AS location_sk,
+        patient_id AS patient_sk,
+        disease_id AS disease_sk,
+        provider_speciality_id AS speciality_sk,
+        silver.f_date_sk(treatment_start_date::DATE) AS start_date_sk,
+        silver.f_date_sk(treatment_completion_date::DATE) AS completion_date_sk,
+        silver.f_date_sk(treatment_outcome_date::DATE) AS outcome_date_sk,
+        silver.f_time_sk(treatment_start_date) AS start_time_sk,
+        silver.f_time_sk(treatment_completion_date) AS completion_time_sk,
+        silver.f_time_sk(treatment_outcome_date) AS outcome_time_sk,
+        treatment_duration_in_days AS duration_in_days,
+        treatment_cost AS cost
+    FROM (
+        SELECT
+            *,
+            ROW_NUMBER() OVER (PARTITION BY treatment_id ORDER BY metadata_modified_at DESC, silver_loaded_at DESC) AS version_rank
+        FROM silver.tbl_healthcare_analytics_data
+        WHERE treatment_id IN (
+                SELECT treatment_id
+                FROM silver.tbl_healthcare_analytics_data
+                WHERE silver_loaded_at > since_watermark
+                    AND silver_loaded_at <= high_watermark
+            )
+            AND COALESCE(metadata_modified_at, silver_loaded_at) >= delta_modified_from
+            AND silver_loaded_at <= high_watermark
+    ) AS versions
+    WHERE version_rank = 1;
+
+    -- Facts need a start date; treatments whose latest version has none are filtered too
+    DELETE FROM fact_stage WHERE start_date_sk IS NULL;
+    GET DIAGNOSTICS rows_without_start_date := ROW_COUNT;
+    rows_filtered := rows_filtered + rows_without_start_date;
+
+    -- Make sure the calendar covers the delta; dates that already exist are skipped
+    SELECT
+        MIN(LEAST(start_date_sk, completion_date_sk, outcome_date_sk)),
+        MAX(GREATEST(start_date_sk, completion_date_sk, outcome_date_sk))
+    INTO min_date_sk, max_date_sk
+    FROM fact_stage;
+
+    CALL silver.sp_generate_dim_dates(
+        TO_DATE(min_date_sk::VARCHAR, 'YYYYMMDD'),
+        TO_DATE(max_date_sk::VARCHAR, 'YYYYMMDD')
+    );
+
+    -- Replace changed facts and append new ones
+    DELETE FROM gold.fact_treatments
+    USING fact_stage
+    WHERE gold.fact_treatments.fact_treatment_sk = fact_stage.fact_treatment_sk;
+    GET DIAGNOSTICS rows_updated := ROW_COUNT;
+
+    INSERT INTO gold.fact_treatments (
+        fact_treatment_sk,
+        treatment_type_and_outcome_status_sk,
+        provider_sk,
+        location_sk,
+        patient_sk,
+        disease_sk,
+        speciality_sk,
+        start_date_sk,
+        completion_date_sk,
+        outcome_date_sk,
+        start_time_sk,
+        completion_time_sk,
+        outcome_time_sk,
+        duration_in_days,
+        cost
+    )
+    SELECT
+        fact_treatment_sk,
+        treatment_type_and_outcome_status_sk,
+        provider_sk,
+        location_sk,
+        patient_sk,
+        disease_sk,
+        speciality_sk,
+        start_date_sk,
+        completion_date_sk,
+        outcome_date_sk,
+        start_time_sk,
+        completion_time_sk,
+        outcome_time_sk,
+        duration_in_days,
+        cost
+    FROM fact_stage;
+    GET DIAGNOSTICS rows_written := ROW_COUNT;
+
+    rows_inserted := rows_written - rows_updated;
 END;
 $$;
 
 
 
-CREATE OR REPLACE PROCEDURE silver.sp_populate_fact_treatments()
+CREATE OR REPLACE PROCEDURE silver.sp_apply_summary_state_delta()
 LANGUAGE plpgsql
 AS $$
+DECLARE
+    last_watermark TIMESTAMP;
+    new_watermark TIMESTAMP;
+    fact_watermark TIMESTAMP;
 BEGIN
-    MERGE INTO gold.fact_treatments 
+    SELECT COALESCE(MAX(high_watermark), '1900-01-01'::TIMESTAMP) INTO last_watermark
+    FROM gold.etl_tracker
+    WHERE destination_table = 'gold.summary_state'
+        AND status = 'SUCCESS';
+
+    -- Windows are cut by load time, like the Gold loads (see sp_resolve_watermarks)
+    SELECT MAX(silver_loaded_at) INTO new_watermark
+    FROM silver.tbl_healthcare_analytics_data
+    WHERE silver_loaded_at > last_watermark;
+
+    -- Never move past the rows the fact load has already applied
+    SELECT MAX(high_watermark) INTO fact_watermark
+    FROM gold.etl_tracker
+    WHERE destination_table = 'gold.fact_treatments'
+        AND status = 'SUCCESS';
+
+    IF fact_watermark IS NOT NULL AND new_watermark > fact_watermark THEN
+        new_watermark := fact_watermark;
+    END IF;
+
+    IF new_watermark IS NULL OR new_watermark <= last_watermark THEN
+        RETURN;
+    END IF;
+
+    -- Facts whose silver rows were loaded since the last refresh
+    DROP TABLE IF EXISTS changed_facts;
+    CREATE TEMP TABLE changed_facts DISTKEY(fact_treatment_sk) AS
+    SELECT
+        f.fact_treatment_sk,
+        f.provider_sk,
+        f.location_sk,
+        f.start_date_sk,
+        CASE WHEN f.treatment_type_and_outcome_status_sk = 1 THEN 1 ELSE 0 END AS is_success,
+        f.cost
+    FROM gold.fact_treatments f
+    JOIN (
+        SELECT DISTINCT treatment_id
+        FROM silver.tbl_healthcare_analytics_data
+        WHERE silver_loaded_at > last_watermark
+            AND silver_loaded_at <= new_watermark
+    ) changed
+        ON f.fact_treatment_sk = changed.treatment_id;
+
+    -- Retract each changed fact's previous contribution and add its current one
+    DROP TABLE IF EXISTS summary_delta;
+    CREATE TEMP TABLE summary_delta AS
+    SELECT
+        c.provider_sk,
+        c.location_sk,
+        c.start_date_sk,
+        -1 AS treatments,
+        -c.is_success AS successes,
+        -c.cost AS cost,
+        CASE WHEN c.cost IS NULL THEN 0 ELSE -1 END AS costed
+    FROM gold.summary_state_contributions c
+    JOIN changed_facts cf
+        ON c.fact_treatment_sk = cf.fact_treatment_sk
+    UNION ALL
+    SELECT
+        provider_sk,
+        location_sk,
+        start_date_sk,
+        1,
+        is_success,
+        cost,
+        CASE WHEN cost IS NULL THEN 0 ELSE 1 END
+    FROM changed_facts;
+
+    MERGE INTO gold.summary_state_providers
     USING (
-        SELECT DISTINCT
-            t.treatment_id,
-            t.treatment_type_and_outcome_status_id,
-            t.provider_id,
-            t.location_id,
-            t.patient_id,
-            t.disease_id,
-            t.provider_speciality_id,
-            d.start_date_sk,
-            d.completion_date_sk,
-            d.outcome_date_sk,
-            tm.start_time_sk,
-            tm.completion_time_sk,
-            tm.outcome_time_sk,
-            t.treatment_duration_in_days,
-            t.treatment_cost
-        FROM silver.tbl_healthcare_analytics_data t
-        JOIN (
-            SELECT DISTINCT
-                treatment_start_date,
-                treatment_completion_date,
-                treatment_outcome_date,
-                DATE_PART(EPOCH, treatment_start_date)::INT AS start_date_sk,
-                CASE 
-                    WHEN treatment_completion_date IS NOT NULL 
-                    THEN DATE_PART(EPOCH, treatment_completion_date)::INT 
-                    ELSE NULL 
-                END AS completion_date_sk,
-                CASE 
-                    WHEN treatment_outcome_date IS NOT NULL 
-                    THEN DATE_PART(EPOCH, treatment_outcome_date)::INT 
-                    ELSE NULL 
-                END AS outcome_date_sk
-            FROM silver.tbl_healthcare_analytics_data
-            WHERE treatment_start_date IS NOT NULL
-        ) d
-            ON t.treatment_start_date = d.treatment_start_date
-            AND COALESCE(t.treatment_completion_date, '1900-01-01'::DATE) = COALESCE(d.treatment_completion_date, '1900-01-01'::DATE)
-            AND COALESCE(t.treatment_outcome_date, '1900-01-01'::DATE) = COALESCE(d.treatment_outcome_date, '1900-01-01'::DATE)
-        JOIN (
-            SELECT DISTINCT
-                treatment_start_date,
-                treatment_completion_date,
-                treatment_outcome_date,
-                (EXTRACT(HOUR FROM treatment_start_date::TIME) * 3600 + 
-                 EXTRACT(MINUTE FROM treatment_start_date::TIME) * 60 + 
-                 EXTRACT(SECOND FROM treatment_start_date::TIME))::INT AS start_time_sk,
-                CASE 
-                    WHEN treatment_completion_date IS NOT NULL 
-                    THEN (EXTRACT(HOUR FROM treatment_completion_date::TIME) * 3600 + 
-                          EXTRACT(MINUTE FROM treatment_completion_date::TIME) * 60 + 
-                          EXTRACT(SECOND FROM treatment_completion_date::TIME))::INT 
-                    ELSE NULL 
-                END AS completion_time_sk,
-                CASE 
-                    WHEN treatment_outcome_date IS NOT NULL 
-                    THEN (EXTRACT(HOUR FROM treatment_outcome_date::TIME) * 3600 + 
-                          EXTRACT(MINUTE FROM treatment_outcome_date::TIME) * 60 + 
-                          EXTRACT(SECOND FROM treatment_outcome_date::TIME))::INT 
-                    ELSE NULL 
-                END AS outcome_time_sk
-            FROM silver.tbl_healthcare_analytics_data
-            WHERE treatment_start_date IS NOT NULL
-        ) tm
-            ON t.treatment_start_date = tm.treatment_start_date
-            AND COALESCE(t.treatment_completion_date, '1900-01-01'::DATE) = COALESCE(tm.treatment_completion_date, '1900-01-01'::DATE)
-            AND COALESCE(t.treatment_outcome_date, '1900-01-01'::DATE) = COALESCE(tm.treatment_outcome_date, '1900-01-01'::DATE)
-    ) source_data
-    ON gold.fact_treatments.fact_treatment_sk = source_data.treatment_id
+        SELECT
+            provider_sk,
+            SUM(treatments) AS treatments,
+            SUM(successes) AS successes,
+            COALESCE(SUM(cost), 0) AS cost,
+            SUM(costed) AS costed
+        FROM summary_delta
+        GROUP BY provider_sk
+    ) AS delta
+    ON gold.summary_state_providers.provider_sk = delta.provider_sk
     WHEN MATCHED THEN
         UPDATE SET
-            treatment_type_and_outcome_status_sk = source_data.treatment_type_and_outcome_status_id,
-            provider_sk = source_data.provider_id,
-            location_sk = source_data.location_id,
-            patient_sk = source_data.patient_id,
-            disease_sk = source_data.disease_id,
-            speciality_sk = source_data.provider_speciality_id,
-            start_date_sk = source_data.start_date_sk,
-            completion_date_sk = source_data.completion_date_sk,
-            outcome_date_sk = source_data.outcome_date_sk,
-            start_time_sk = source_data.start_time_sk,
-            completion_time_sk = source_data.completion_time_sk,
-            outcome_time_sk = source_data.outcome_time_sk,
-            duration_in_days = source_data.treatment_duration_in_days,
-            cost = source_data.treatment_cost
+            total_treatments = gold.summary_state_providers.total_treatments + delta.treatments,
+            successful_treatments = gold.summary_state_providers.successful_treatments + delta.successes,
+            total_cost = gold.summary_state_providers.total_cost + delta.cost,
+            costed_treatments = gold.summary_state_providers.costed_treatments + delta.costed
     WHEN NOT MATCHED THEN
-        INSERT (
-            fact_treatment_sk,
-            treatment_type_and_outcome_status_sk,
-            provider_sk,
-            location_sk,
-            patient_sk,
-            disease_sk,
-            speciality_sk,
-            start_date_sk,
-            completion_date_sk,
-            outcome_date_sk,
-            start_time_sk,
-            completion_time_sk,
-            outcome_time_sk,
-            duration_in_days,
-            cost
-        ) VALUES (
-            source_data.treatment_id,
-            source_data.treatment_type_and_outcome_status_id,
-            source_data.provider_id,
-            source_data.location_id,
-            source_data.patient_id,
-            source_data.disease_id,
-            source_data.provider_speciality_id,
-            source_data.start_date_sk,
-            source_data.completion_date_sk,
-            source_data.outcome_date_sk,
-            source_data.start_time_sk,
-            source_data.completion_time_sk,
-            source_data.outcome_time_sk,
-            source_data.treatment_duration_in_days,
-            source_data.treatment_cost
-        );
-END $$;
\ No newline at end of file
+        INSERT (provider_sk, total_treatments, successful_treatments, total_cost, costed_treatments)
+        VALUES (delta.provider_sk, delta.treatments, delta.successes, delta.cost, delta.costed);
+
+    MERGE INTO gold.summary_state_locations
+    USING (
+        SELECT location_sk, SUM(treatments) AS treatments
+        FROM summary_delta
+        GROUP BY location_sk
+    ) AS delta
+    ON gold.summary_state_locations.location_sk = delta.location_sk
+    WHEN MATCHED THEN
+        UPDATE SET
+            total_treatments = gold.summary_state_locations.total_treatments + delta.treatments
+    WHEN NOT MATCHED THEN
+        INSERT (location_sk, total_treatments)
+        VALUES (delta.location_sk, delta.treatments);
+
+    MERGE INTO gold.summary_state_dates
+    USING (
+        SELECT start_date_sk, SUM(treatments) AS treatments, SUM(successes) AS successes
+        FROM summary_delta
+        GROUP BY start_date_sk
+    ) AS delta
+    ON gold.summary_state_dates.start_date_sk = delta.start_date_sk
+    WHEN MATCHED THEN
+        UPDATE SET
+            total_treatments = gold.summary_state_dates.total_treatments + delta.treatments,
+            successful_treatments = gold.summary_state_dates.successful_treatments + delta.successes
+    WHEN NOT MATCHED THEN
+        INSERT (start_date_sk, total_treatments, successful_treatments)
+        VALUES (delta.start_date_sk, delta.treatments, delta.successes);
+
+    -- Groups whose facts all moved elsewhere
+    DELETE FROM gold.summary_state_providers WHERE total_treatments = 0;
+    DELETE FROM gold.summary_state_locations WHERE total_treatments = 0;
+    DELETE FROM gold.summary_state_dates WHERE total_treatments = 0;
+
+    DELETE FROM gold.summary_state_contributions
+    USING changed_facts
+    WHERE gold.summary_state_contributions.fact_treatment_sk = changed_facts.fact_treatment_sk;
+
+    INSERT INTO gold.summary_state_contributions (fact_treatment_sk, provider_sk, location_sk, start_date_sk, is_success, cost)
+    SELECT fact_treatment_sk, provider_sk, location_sk, start_date_sk, is_success, cost
+    FROM changed_facts;
+
+    INSERT INTO gold.etl_tracker (source_layer, destination_layer, source_table, destination_table, status, source_count, high_watermark, completion_timestamp)
+    SELECT 'gold', 'gold', 'gold.fact_treatments', 'gold.summary_state', 'SUCCESS', COUNT(*), new_watermark, GETDATE()
+    FROM changed_facts;
+END;
+$$;
@@ -7,7 +7,7 @@ SELECT
     COUNT(f.fact_treatment_sk) AS total_treatments
 FROM gold.fact_treatments f
 JOIN gold.dim_providers p ON f.provider_sk = p.provider_sk
-GROUP BY p.provider_sk, p.full_names
+GROUP BY p.provider_sk, p.full_name
 ORDER BY total_treatments DESC;
 
 
@@ -0,0 +1,99 @@
+-- Incremental refresh: fold the fact delta since the last refresh into the summary state,
+-- then rebuild the summaries of DML_Analycial_Queries.sql from the (small) state tables
+-- instead of the fact table. Run this in place of DML_Analycial_Queries.sql, not after it.
+CALL silver.sp_apply_summary_state_delta();
+
+
+
+-- 1. Rank Providers Based on Total Treatments
+DROP TABLE IF EXISTS gold.provider_treatment_rank;
+CREATE TABLE gold.provider_treatment_rank AS
+SELECT 
+    s.provider_sk AS provider_id,
+    p.full_name AS provider_full_name,
+    s.total_treatments
+FROM gold.summary_state_providers s
+JOIN gold.dim_providers p ON s.provider_sk = p.provider_sk
+ORDER BY total_treatments DESC;
+
+
+
+-- 2. Rank Providers Based on Treatment Success Rate
+DROP TABLE IF EXISTS gold.provider_success_rate_rank;
+CREATE TABLE gold.provider_success_rate_rank AS
+SELECT 
+    s.provider_sk AS provider_id,
+    p.full_name AS provider_full_name,
+    s.total_treatments,
+    s.successful_treatments * 100.0 / s.total_treatments AS success_rate
+FROM gold.summary_state_providers s
+JOIN gold.dim_providers p ON s.provider_sk = p.provider_sk
+ORDER BY success_rate DESC;
+
+
+
+-- 3. Monthly Trends in Treatment Success Rates
+DROP TABLE IF EXISTS gold.monthly_treatment_trends;
+CREATE TABLE gold.monthly_treatment_trends AS
+SELECT 
+    d.year,
+    d.month,
+    SUM(s.total_treatments) AS total_treatments,
+    SUM(s.successful_treatments) * 100.0 / SUM(s.total_treatments) AS success_rate
+FROM gold.summary_state_dates s
+JOIN gold.dim_dates d ON s.start_date_sk = d.date_sk
+GROUP BY d.year, d.month
+ORDER BY d.year DESC, d.month DESC;
+
+
+
+-- 4. Geographical Distribution of Treatments
+DROP TABLE IF EXISTS gold.geographical_treatment_distribution;
+CREATE TABLE gold.geographical_treatment_distribution AS
+SELECT 
+    l.country,
+    l.state,
+    l.city,
+    SUM(s.total_treatments) AS total_treatments
+FROM gold.summary_state_locations s
+JOIN gold.dim_locations l ON s.location_sk = l.location_sk
+GROUP BY l.country, l.state, l.city
+ORDER BY total_treatments DESC;
+
+
+
+-- 5. Summary Metrics - Average Treatment Cost
+DROP TABLE IF EXISTS gold.summary_avg_treatment_cost;
+CREATE TABLE gold.summary_avg_treatment_cost AS
+SELECT 
+    s.provider_sk AS provider_id,
+    p.full_name AS provider_full_name,
+    s.total_cost / NULLIF(s.costed_treatments, 0) AS avg_treatment_cost
+FROM gold.summary_state_providers s
+JOIN gold.dim_providers p ON s.provider_sk = p.provider_sk;
+
+
+
+-- 6. Summary Metrics - Total Treatments Per City
+DROP TABLE IF EXISTS gold.summary_total_treatments_per_city;
+CREATE TABLE gold.summary_total_treatments_per_city AS
+SELECT 
+    l.city,
+    SUM(s.total_treatments) AS total_treatments
+FROM gold.summary_state_locations s
+JOIN gold.dim_locations l ON s.location_sk = l.location_sk
+GROUP BY l.city
+ORDER BY total_treatments DESC;
+
+
+
+-- 7. Summary Metrics - Provider Success Rate
+DROP TABLE IF EXISTS gold.summary_provider_success_rates;
+CREATE TABLE gold.summary_provider_success_rates AS
+SELECT 
+    s.provider_sk AS provider_id,
+    p.full_name AS provider_full_name,
+    s.total_treatments,
+    s.successful_treatments * 100.0 / s.total_treatments AS success_rate
+FROM gold.summary_state_providers s
+JOIN gold.dim_providers p ON s.provider_sk = p.provider_sk;
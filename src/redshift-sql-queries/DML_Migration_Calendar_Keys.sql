@@ -0,0 +1,56 @@
+-- One-time migration for warehouses loaded before the calendar dimensions had deterministic
+-- keys. Earlier loads keyed gold.dim_dates and gold.dim_times by ROW_NUMBER and stored each
+-- fact's dates as epoch seconds, so neither matches silver.f_date_sk / silver.f_time_sk.
+-- Run it once, while no Step Function execution is in progress, after deploying
+-- DDL_Stored_Procedures.sql; then run DML_Static_Dimensions.sql and DML_Analycial_Queries.sql
+-- so the calendar and the summaries' date keys are complete. Rows already migrated are
+-- skipped, so a rerun is harmless.
+
+
+
+CREATE OR REPLACE PROCEDURE silver.sp_migrate_calendar_keys()
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    min_date_sk INT;
+    max_date_sk INT;
+BEGIN
+    -- Epoch seconds of any date after March 1973 exceed the largest YYYYMMDD key, so only
+    -- facts that still hold the old keys are rewritten. Their times of day come from the same
+    -- timestamps, so the time keys are recomputed alongside.
+    UPDATE gold.fact_treatments
+    SET
+        start_date_sk = silver.f_date_sk((TIMESTAMP 'epoch' + start_date_sk * INTERVAL '1 second')::DATE),
+        completion_date_sk = silver.f_date_sk((TIMESTAMP 'epoch' + completion_date_sk * INTERVAL '1 second')::DATE),
+        outcome_date_sk = silver.f_date_sk((TIMESTAMP 'epoch' + outcome_date_sk * INTERVAL '1 second')::DATE),
+        start_time_sk = silver.f_time_sk(TIMESTAMP 'epoch' + start_date_sk * INTERVAL '1 second'),
+        completion_time_sk = silver.f_time_sk(TIMESTAMP 'epoch' + completion_date_sk * INTERVAL '1 second'),
+        outcome_time_sk = silver.f_time_sk(TIMESTAMP 'epoch' + outcome_date_sk * INTERVAL '1 second')
+    WHERE start_date_sk > 99991231;
+
+    -- Drop the calendar rows whose keys are not the deterministic ones
+    DELETE FROM gold.dim_dates WHERE date_sk <> silver.f_date_sk(date);
+    DELETE FROM gold.dim_times WHERE time_sk <> hours * 3600 + minutes * 60 + seconds;
+
+    -- Regenerate the dates every fact refers to; DML_Static_Dimensions.sql adds the rest
+    SELECT
+        MIN(LEAST(start_date_sk, completion_date_sk, outcome_date_sk)),
+        MAX(GREATEST(start_date_sk, completion_date_sk, outcome_date_sk))
+    INTO min_date_sk, max_date_sk
+    FROM gold.fact_treatments;
+
+    CALL silver.sp_generate_dim_dates(
+        TO_DATE(min_date_sk::VARCHAR, 'YYYYMMDD'),
+        TO_DATE(max_date_sk::VARCHAR, 'YYYYMMDD')
+    );
+    CALL silver.sp_generate_dim_times();
+END;
+$$;
+
+
+
+CALL silver.sp_migrate_calendar_keys();
+
+
+
+DROP PROCEDURE silver.sp_migrate_calendar_keys();
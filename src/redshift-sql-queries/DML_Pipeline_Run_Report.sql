@@ -0,0 +1,69 @@
+-- Per-run stage report from the spans recorded in gold.etl_tracker. Every stage of a run shares
+-- its pipeline_run_id (the Silver batch id). Top-level stages are ranked by wall time with
+-- their share of the run, and the three slowest are flagged as the run's hot stages.
+-- Sub-stages ('transform_to_gold:gold.dim_locations') are ranked within their stage.
+
+
+
+-- 1. Hot stages of the last 10 runs
+WITH spans AS (
+    SELECT
+        pipeline_run_id,
+        stage,
+        SPLIT_PART(stage, ':', 1) AS parent_stage,
+        stage NOT LIKE '%:%' AS is_top_level,
+        status,
+        started_at,
+        MIN(started_at) OVER (PARTITION BY pipeline_run_id) AS run_started_at,
+        DATEDIFF(millisecond, started_at, completion_timestamp) / 1000.0 AS wall_seconds,
+        queue_seconds,
+        execution_seconds,
+        rows_processed,
+        bytes_scanned
+    FROM gold.etl_tracker
+    WHERE status <> 'IN_PROGRESS'
+        AND pipeline_run_id IN (
+            SELECT pipeline_run_id
+            FROM gold.etl_tracker
+            WHERE pipeline_run_id IS NOT NULL
+            GROUP BY pipeline_run_id
+            ORDER BY MIN(started_at) DESC
+            LIMIT 10
+        )
+)
+SELECT
+    pipeline_run_id,
+    stage,
+    status,
+    started_at,
+    wall_seconds,
+    queue_seconds,
+    execution_seconds,
+    rows_processed,
+    rows_processed / NULLIF(wall_seconds, 0) AS rows_per_second,
+    bytes_scanned,
+    CASE WHEN is_top_level
+        THEN wall_seconds / NULLIF(SUM(CASE WHEN is_top_level THEN wall_seconds END) OVER (PARTITION BY pipeline_run_id), 0)
+    END AS share_of_run,
+    RANK() OVER (PARTITION BY pipeline_run_id, is_top_level, CASE WHEN is_top_level THEN '' ELSE parent_stage END ORDER BY wall_seconds DESC) AS wall_rank,
+    is_top_level AND RANK() OVER (PARTITION BY pipeline_run_id, is_top_level ORDER BY wall_seconds DESC) <= 3 AS is_hot_stage
+FROM spans
+ORDER BY run_started_at DESC, pipeline_run_id, parent_stage, is_top_level DESC, wall_seconds DESC;
+
+
+
+-- 2. Stage throughput trend across runs, to spot regressions
+SELECT
+    stage,
+    COUNT(DISTINCT pipeline_run_id) AS runs,
+    AVG(DATEDIFF(millisecond, started_at, completion_timestamp) / 1000.0) AS avg_wall_seconds,
+    AVG(queue_seconds) AS avg_queue_seconds,
+    AVG(execution_seconds) AS avg_execution_seconds,
+    SUM(rows_processed) / NULLIF(SUM(DATEDIFF(millisecond, started_at, completion_timestamp) / 1000.0), 0) AS rows_per_second
+FROM gold.etl_tracker
+WHERE pipeline_run_id IS NOT NULL
+    AND stage NOT LIKE '%:%'
+    AND status = 'SUCCESS'
+    AND started_at >= DATEADD(day, -30, GETDATE())
+GROUP BY stage
+ORDER BY avg_wall_seconds DESC;
@@ -0,0 +1,15 @@
+-- Setup of the calendar dimensions. Their rows are pure date and clock arithmetic,
+-- keyed by silver.f_date_sk (YYYYMMDD) and silver.f_time_sk (seconds since midnight), so
+-- they are generated up front rather than derived from Silver on every Gold run.
+-- Both procedures skip rows that already exist; rerun with a wider range to extend the calendar.
+-- Warehouses loaded before these keys existed run DML_Migration_Calendar_Keys.sql first.
+
+
+
+-- 1. Calendar dates (the fact load also extends the range for any dates outside it)
+CALL silver.sp_generate_dim_dates('2000-01-01', '2050-12-31');
+
+
+
+-- 2. Every second of the day (86,400 rows)
+CALL silver.sp_generate_dim_times();